@@ -8,12 +8,19 @@ Telegram бот "Блинная башня" с анимированной игр
 import os
 import logging
 import time
-import threading
 from dotenv import load_dotenv
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaAnimation, InputMediaPhoto
 from telegram.ext import Updater, CommandHandler, CallbackQueryHandler, CallbackContext
 
-from pancake_game import PancakeGame
+from animation_scheduler import animation_scheduler
+from frame_pacing import ANIMATION_MIN_INTERVAL
+from pancake_game import PRECOMPUTE_CYCLE, PancakeGame, animation_frame_interval
+from rate_limit import RateLimited, rate_limiter
+from render_pool import render_frames
+from session_db import open_session_database
+from session_store import SessionStore
+from sharding import BOT_SHARDS, run_sharded
+from telegram_media import animation_for, photo_for, remember_animation, remember_photo
 
 # Настройка логирования
 logging.basicConfig(
@@ -22,74 +29,172 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Хранилище активных игр и их потоков анимации
-active_games = {}
-animation_threads = {}
-last_update_time = {}  # Словарь для хранения времени последнего обновления для каждого пользователя
-UPDATE_INTERVAL = 1.0  # Увеличиваем интервал обновления до 1 секунды
+# Сессии игр: игра, таймер анимации и время последнего обновления сообщения.
+# С SESSION_DB игры сохраняются в базу и переживают перезапуск
+active_games = SessionStore(database=open_session_database())
 
-def start_animation(user_id, context):
-    """Запускает анимацию движения блина для конкретного пользователя"""
-    if user_id not in active_games or active_games[user_id].game_over:
+# Режим анимации: "edits" - фото редактируется по таймеру,
+# "gif" - колебания блина отправляются одной зацикленной GIF-анимацией
+# на каждое состояние башни, а положение при нажатии вычисляется по времени
+ANIMATION_MODE = os.getenv("ANIMATION_MODE", "edits")
+
+def edit_game_message(context, game, caption, reply_markup, block=True, pacer=None):
+    """Обновляет сообщение игры: GIF с колебаниями в режиме gif, иначе фото кадра
+
+    Отправка идет через общий ограничитель частоты: с block=False, когда
+    бюджет чата исчерпан, выбрасывается RateLimited вместо ожидания.
+    Время отрисовки и ответа Telegram учитывается в pacer (frame_pacing).
+    """
+    if ANIMATION_MODE == "gif" and not game.game_over:
+        animation_key, animation = animation_for(game)
+        message = rate_limiter.call(
+            game.chat_id, context.bot.edit_message_media, block=block,
+            chat_id=game.chat_id,
+            message_id=game.message_id,
+            media=InputMediaAnimation(
+                media=animation,
+                caption=caption
+            ),
+            reply_markup=reply_markup
+        )
+        remember_animation(animation_key, message)
+        
+        # Отсчитываем положение блина с момента, когда анимация дошла до клиента
+        game.start_animation_clock()
+        return message
+    
+    # Генерируем изображение игры
+    # (или берем file_id такого же кадра, уже загруженного в Telegram)
+    started = time.perf_counter()
+    frame_key, photo = photo_for(game)
+    rendered = time.perf_counter()
+    
+    message = rate_limiter.call(
+        game.chat_id, context.bot.edit_message_media, block=block,
+        chat_id=game.chat_id,
+        message_id=game.message_id,
+        media=InputMediaPhoto(
+            media=photo,
+            caption=caption
+        ),
+        reply_markup=reply_markup
+    )
+    if pacer is not None:
+        pacer.observe(time.perf_counter() - rendered, rendered - started, rate_limiter.load())
+    remember_photo(frame_key, message)
+    return message
+
+def schedule_animation(user_id, context, delay=None):
+    """Планирует следующее обновление анимации пользователя через delay секунд
+
+    Без delay - на следующий момент кадра анимации с интервалом, подобранным
+    для игры пользователя (PancakeGame.animation_frame_time): положения блина
+    в эти моменты отрисовываются заранее.
+    """
+    if delay is None:
+        pacer = active_games.pacer(user_id)
+        interval = ANIMATION_MIN_INTERVAL if pacer is None else pacer.interval
+        game = active_games.peek(user_id)
+        if game is None:
+            delay = interval
+        else:
+            now = time.time()
+            delay = max(0.0, game.animation_frame_time(interval, now) + animation_frame_interval(interval) - now)
+    
+    timer = animation_scheduler.timer(delay, start_animation, user_id, context)
+    active_games.set_timer(user_id, timer)
+    timer.start()
+
+def frame_delay(user_id, game, pacer, now):
+    """Возвращает, через сколько секунд можно отправить кадр игры (0 - сейчас)"""
+    # Интервал кадров подстраивается под задержки Telegram и отказы по бюджету
+    last_update = active_games.last_update(user_id)
+    if last_update is not None and now - last_update < pacer.interval:
+        return pacer.interval - (now - last_update)
+    
+    # Бюджет отправки в чат исчерпан - кадр, который не отправить, не нужен
+    return rate_limiter.wait_time(game.chat_id)
+
+def render_due_frames(now, calls):
+    """Отрисовывает одной пачкой кадры всех игр, обновления которых наступили в одном шаге"""
+    if ANIMATION_MODE == "gif":
         return
     
-    game = active_games[user_id]
+    games = []
+    for user_id, context in calls:
+        game = active_games.peek(user_id)
+        pacer = active_games.pacer(user_id)
+        if game is None or pacer is None or game.game_over:
+            continue
+        if not frame_delay(user_id, game, pacer, now):
+            games.append(game)
     
-    # Проверяем, не слишком ли часто обновляем сообщение
-    current_time = time.time()
-    if user_id in last_update_time and current_time - last_update_time[user_id] < UPDATE_INTERVAL:
-        # Если прошло меньше UPDATE_INTERVAL секунд с последнего обновления,
-        # просто обновляем положение блина без отправки сообщения
-        game.update_moving_pancake()
-        
-        # Планируем следующее обновление
-        if user_id in animation_threads and animation_threads[user_id].is_alive():
-            animation_threads[user_id] = threading.Timer(0.2, start_animation, args=[user_id, context])
-            animation_threads[user_id].daemon = True
-            animation_threads[user_id].start()
+    # Кадры ложатся в кэш кадров, и start_animation берет их оттуда
+    if games:
+        render_frames(games, now=now)
+
+def start_animation(user_id, context, now=None):
+    """Запускает анимацию движения блина для конкретного пользователя
+    
+    now - время шага планировщика: кадр на этот момент уже отрисован
+    вместе с кадрами других игр шага (render_due_frames).
+    """
+    # Анимация не продлевает сессию: брошенная игра удаляется по времени простоя
+    game = active_games.peek(user_id)
+    pacer = active_games.pacer(user_id)
+    if game is None or pacer is None or game.game_over:
         return
     
-    # Обновляем положение блина
-    game.update_moving_pancake()
+    # Проверяем, не слишком ли часто обновляем сообщение. Если кадр
+    # отправлять рано, откладываем отправку: положение блина вычисляется
+    # по времени при отрисовке, поэтому до тех пор делать ничего не нужно
+    current_time = time.time() if now is None else now
+    delay = frame_delay(user_id, game, pacer, current_time)
+    if delay:
+        if active_games.timer_running(user_id):
+            schedule_animation(user_id, context, delay)
+        return
     
-    # Генерируем новое изображение
-    image_path = game.generate_game_image()
+    # Вычисляем положение блина на текущий момент
+    game.update_moving_pancake(current_time)
     
-    # Обновляем сообщение с новым изображением
+    # Обновляем сообщение с новым изображением. Кадр анимации не ждет
+    # бюджета чата: если он исчерпан, кадр пропускается
     try:
-        with open(image_path, 'rb') as photo:
-            context.bot.edit_message_media(
-                chat_id=game.chat_id,
-                message_id=game.message_id,
-                media=InputMediaPhoto(
-                    media=photo,
-                    caption=f"Счёт: {game.score}"
-                ),
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("Играть", callback_data="play_game")]
-                ])
-            )
-        # Обновляем время последнего обновления
-        last_update_time[user_id] = current_time
+        edit_game_message(
+            context, game,
+            f"Счёт: {game.score}",
+            InlineKeyboardMarkup([
+                [InlineKeyboardButton("Играть", callback_data="play_game")]
+            ]),
+            block=False,
+            pacer=pacer
+        )
+        # Обновляем время последнего обновления: момент кадра, к которому
+        # отсчитывается следующий кадр
+        active_games.mark_update(user_id, game.animation_frame_time(pacer.interval, current_time))
+    except RateLimited as e:
+        # Отказ по бюджету или 429: кадры игры становятся реже, а следующий -
+        # не раньше, чем бюджет чата позволит его отправить
+        pacer.backoff(e.wait)
+        if active_games.timer_running(user_id):
+            schedule_animation(user_id, context, max(e.wait, pacer.interval))
+        return
     except Exception as e:
         logger.error(f"Ошибка при обновлении сообщения: {e}")
     
-    # Удаляем временное изображение
-    try:
-        os.remove(image_path)
-    except:
-        pass
-    
-    # Планируем следующее обновление через 0.2 секунды
-    if user_id in animation_threads and animation_threads[user_id].is_alive():
-        animation_threads[user_id] = threading.Timer(0.2, start_animation, args=[user_id, context])
-        animation_threads[user_id].daemon = True
-        animation_threads[user_id].start()
+    # Планируем следующий кадр через подобранный интервал
+    if active_games.timer_running(user_id):
+        schedule_animation(user_id, context)
+
+# Обновления игр, наступившие в одном шаге планировщика, отрисовываются пачкой
+animation_scheduler.batch(start_animation, render_due_frames)
 
 def start(update: Update, context: CallbackContext) -> None:
     """Отправляет сообщение при команде /start."""
     user = update.effective_user
-    update.message.reply_text(
+    rate_limiter.call(
+        update.effective_chat.id, update.message.reply_text,
         f"Привет, {user.first_name}! 👋\n\n"
         f"Добро пожаловать в игру 'Блинная башня'!\n\n"
         f"Нажми /play, чтобы начать игру."
@@ -103,46 +208,55 @@ def play_command(update: Update, context: CallbackContext) -> None:
     stop_animation(user_id)
     
     # Создаем новую игру для этого пользователя
-    active_games[user_id] = PancakeGame()
+    active_games[user_id] = PancakeGame(precompute_cycle=PRECOMPUTE_CYCLE and ANIMATION_MODE == "edits")
     game = active_games[user_id]
     
-    # Генерируем начальное изображение игры
-    image_path = game.generate_game_image()
-    
     # Создаем клавиатуру с кнопкой "Играть"
     keyboard = [
         [InlineKeyboardButton("Играть", callback_data="play_game")]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    # Отправляем начальное состояние игры
-    with open(image_path, 'rb') as photo:
-        message = update.message.reply_photo(
+    if ANIMATION_MODE == "gif":
+        # Отправляем колебания блина одной зацикленной анимацией
+        animation_key, animation = animation_for(game)
+        message = rate_limiter.call(
+            update.effective_chat.id, update.message.reply_animation,
+            animation=animation,
+            caption=f"Счёт: {game.score}",
+            reply_markup=reply_markup
+        )
+        remember_animation(animation_key, message)
+        game.start_animation_clock()
+    else:
+        # Генерируем начальное изображение игры
+        # (или берем file_id такого же кадра, уже загруженного в Telegram)
+        frame_key, photo = photo_for(game)
+        
+        # Отправляем начальное состояние игры
+        message = rate_limiter.call(
+            update.effective_chat.id, update.message.reply_photo,
             photo=photo,
             caption=f"Счёт: {game.score}",
             reply_markup=reply_markup
         )
+        remember_photo(frame_key, message)
     
     # Сохраняем ID сообщения для будущих обновлений
     game.message_id = message.message_id
     game.chat_id = update.effective_chat.id
-    
-    # Удаляем временное изображение
-    os.remove(image_path)
+    active_games.save(user_id)
     
     # Инициализируем время последнего обновления
-    last_update_time[user_id] = time.time()
+    active_games.mark_update(user_id)
     
     # Запускаем анимацию
-    animation_threads[user_id] = threading.Timer(0.2, start_animation, args=[user_id, context])
-    animation_threads[user_id].daemon = True
-    animation_threads[user_id].start()
+    if ANIMATION_MODE == "edits":
+        schedule_animation(user_id, context)
 
 def stop_animation(user_id):
     """Останавливает анимацию для конкретного пользователя"""
-    if user_id in animation_threads and animation_threads[user_id].is_alive():
-        animation_threads[user_id].cancel()
-        del animation_threads[user_id]
+    active_games.cancel_timer(user_id)
 
 def button_callback(update: Update, context: CallbackContext) -> None:
     """Обрабатывает нажатия кнопок."""
@@ -158,12 +272,10 @@ def button_callback(update: Update, context: CallbackContext) -> None:
             # Останавливаем анимацию
             stop_animation(user_id)
             
-            # Опускаем блин
+            # Опускаем блин: его положение в момент нажатия вычисляется
+            # по времени, в режиме gif - по кругу проигрываемой анимации
             game_over = game.drop_pancake()
             
-            # Генерируем обновленное изображение игры
-            image_path = game.generate_game_image()
-            
             # Обновляем клавиатуру в зависимости от состояния игры
             keyboard = [
                 [InlineKeyboardButton("Играть", callback_data="play_game")]
@@ -178,40 +290,31 @@ def button_callback(update: Update, context: CallbackContext) -> None:
                 caption = f"Счёт: {game.score}"
                 
                 # Инициализируем время последнего обновления
-                last_update_time[user_id] = time.time()
+                active_games.mark_update(user_id)
                 
                 # Запускаем анимацию снова, если игра не окончена
-                animation_threads[user_id] = threading.Timer(0.2, start_animation, args=[user_id, context])
-                animation_threads[user_id].daemon = True
-                animation_threads[user_id].start()
+                if ANIMATION_MODE == "edits":
+                    schedule_animation(user_id, context)
             
             reply_markup = InlineKeyboardMarkup(keyboard)
             
             # Обновляем сообщение с новым состоянием игры
-            with open(image_path, 'rb') as photo:
-                context.bot.edit_message_media(
-                    chat_id=game.chat_id,
-                    message_id=game.message_id,
-                    media=InputMediaPhoto(
-                        media=photo,
-                        caption=caption
-                    ),
-                    reply_markup=reply_markup
-                )
+            edit_game_message(context, game, caption, reply_markup)
             
-            # Удаляем временное изображение
-            os.remove(image_path)
+            # Сохраняем игру после броска (в базу - со следующей пачкой)
+            active_games.save(user_id)
     
     elif query.data == "new_game":
         # Останавливаем предыдущую анимацию
         stop_animation(user_id)
         
         # Начинаем новую игру
-        active_games[user_id] = PancakeGame()
+        active_games[user_id] = PancakeGame(precompute_cycle=PRECOMPUTE_CYCLE and ANIMATION_MODE == "edits")
         game = active_games[user_id]
         
-        # Генерируем начальное изображение игры
-        image_path = game.generate_game_image()
+        # Сохраняем ID сообщения для будущих обновлений
+        game.message_id = query.message.message_id
+        game.chat_id = update.effective_chat.id
         
         # Создаем клавиатуру с кнопкой "Играть"
         keyboard = [
@@ -220,31 +323,25 @@ def button_callback(update: Update, context: CallbackContext) -> None:
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         # Обновляем сообщение с новым состоянием игры
-        with open(image_path, 'rb') as photo:
-            context.bot.edit_message_media(
-                chat_id=update.effective_chat.id,
-                message_id=query.message.message_id,
-                media=InputMediaPhoto(
-                    media=photo,
-                    caption=f"Счёт: {game.score}"
-                ),
-                reply_markup=reply_markup
-            )
-        
-        # Сохраняем ID сообщения для будущих обновлений
-        game.message_id = query.message.message_id
-        game.chat_id = update.effective_chat.id
-        
-        # Удаляем временное изображение
-        os.remove(image_path)
+        edit_game_message(context, game, f"Счёт: {game.score}", reply_markup)
+        active_games.save(user_id)
         
         # Инициализируем время последнего обновления
-        last_update_time[user_id] = time.time()
+        active_games.mark_update(user_id)
         
         # Запускаем анимацию
-        animation_threads[user_id] = threading.Timer(0.2, start_animation, args=[user_id, context])
-        animation_threads[user_id].daemon = True
-        animation_threads[user_id].start()
+        if ANIMATION_MODE == "edits":
+            schedule_animation(user_id, context)
+
+def register_handlers(dispatcher):
+    """Добавляет обработчики команд бота в диспетчер"""
+    dispatcher.add_handler(CommandHandler("start", start))
+    dispatcher.add_handler(CommandHandler("play", play_command))
+    dispatcher.add_handler(CallbackQueryHandler(button_callback))
+
+def session_stats():
+    """Возвращает статистику сессий и планировщика анимации процесса (для шардированного запуска)"""
+    return dict(active_games.stats(), animation=animation_scheduler.stats(), rate_limit=rate_limiter.stats())
 
 def main():
     """Запускает бота."""
@@ -257,26 +354,23 @@ def main():
         logger.error("Токен бота не найден в переменных окружения!")
         exit(1)
     
-    # Создаем директорию для временных файлов, если её нет
-    os.makedirs("temp", exist_ok=True)
-    
-    # Создаем Updater и передаем ему токен бота
-    updater = Updater(token)
-    
-    # Получаем диспетчер для регистрации обработчиков
-    dispatcher = updater.dispatcher
-    
-    # Добавляем обработчики команд
-    dispatcher.add_handler(CommandHandler("start", start))
-    dispatcher.add_handler(CommandHandler("play", play_command))
-    dispatcher.add_handler(CallbackQueryHandler(button_callback))
-    
     # Запускаем бота
     print("=" * 50)
     print("Запуск Telegram бота 'Блинная башня' с анимацией")
     print("=" * 50)
     print("\nБот запущен! Нажмите Ctrl+C для остановки.")
     
+    # С BOT_SHARDS > 1 пользователи распределяются между процессами-обработчиками
+    if BOT_SHARDS > 1:
+        run_sharded(token, register_handlers, BOT_SHARDS, session_stats)
+        return
+    
+    # Создаем Updater и передаем ему токен бота
+    updater = Updater(token)
+    
+    # Добавляем обработчики команд
+    register_handlers(updater.dispatcher)
+    
     # Запускаем бота
     updater.start_polling()
     
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Планировщик кадров анимации "Блинной башни"
+
+Вместо отдельного threading.Timer на каждый кадр каждой игры все сроки
+лежат в одной куче, которую разбирает один поток планировщика. Наступившие
+задачи выполняются в небольшом пуле потоков: обновление сообщения ждет
+Telegram, и медленный ответ одной игры не должен задерживать остальные.
+Постановка задачи стоит O(log n), отмена - O(1): отмененная задача
+остается в куче и пропускается, когда до нее доходит очередь.
+Задачи одной функции, наступившие в одном шаге, можно объединить
+(batch): общая работа шага, например отрисовка кадров всех игр,
+выполняется для них один раз.
+"""
+
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Потоки, в которых выполняются наступившие задачи
+ANIMATION_WORKERS = int(os.getenv("ANIMATION_WORKERS", "8"))
+
+# Наступившая задача ждет еще до ANIMATION_TICK секунд, и задачи со сроками
+# в этом окне выполняются в одном шаге планировщика: так объединенные
+# задачи (batch) разных игр попадают в общий шаг. Раньше срока задачи
+# не выполняются
+ANIMATION_TICK = float(os.getenv("ANIMATION_TICK", "0.01"))
+
+# Сколько последних опозданий задач хранится для перцентилей
+JITTER_WINDOW = 1024
+
+logger = logging.getLogger(__name__)
+
+class ScheduledCall:
+    """Задача планировщика; как и threading.Timer, поддерживает cancel() и is_alive()"""
+
+    __slots__ = ("delay", "deadline", "callback", "args", "cancelled", "finished", "queued", "_scheduler")
+
+    def __init__(self, scheduler, delay, callback, args):
+        """Создает задачу; срок отсчитывается от start()"""
+        self.delay = delay
+        self.deadline = None
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+        self.finished = False
+        self.queued = False
+        self._scheduler = scheduler
+
+    def start(self):
+        """Ставит задачу в очередь планировщика: она выполнится через delay секунд"""
+        self._scheduler._push(self)
+        return self
+
+    def cancel(self):
+        """Отменяет задачу, если она еще не выполнялась"""
+        if not self.cancelled and not self.finished:
+            self.cancelled = True
+            self._scheduler._cancelled(self)
+
+    def is_alive(self):
+        """Проверяет, ждет ли задача срока или выполняется прямо сейчас"""
+        return not self.cancelled and not self.finished
+
+class AnimationScheduler:
+    """Куча сроков с одним потоком планировщика и пулом исполнителей"""
+
+    def __init__(self, workers=ANIMATION_WORKERS, tick=ANIMATION_TICK):
+        """Создает планировщик; поток запускается при первой задаче"""
+        self.workers = workers
+        self.tick = tick
+        self.fired = 0
+        self.cancelled = 0
+        self.late_ms_max = 0.0
+        self._late_ms_total = 0.0
+        self._late_ms = deque(maxlen=JITTER_WINDOW)
+        self._heap = []
+        self._counter = itertools.count()
+        self._heap_cancelled = 0
+        self._batches = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._executor = None
+
+    def timer(self, delay, callback, *args):
+        """Создает задачу callback(*args) через delay секунд, как threading.Timer - ее нужно запустить"""
+        return ScheduledCall(self, delay, callback, args)
+
+    def call_later(self, delay, callback, *args):
+        """Выполняет callback(*args) через delay секунд, возвращает задачу"""
+        return self.timer(delay, callback, *args).start()
+
+    def batch(self, callback, prepare):
+        """Объединяет задачи callback, наступившие в одном шаге планировщика
+
+        Перед такими задачами prepare(now, [args, ...]) один раз получает
+        аргументы всех задач шага, а сами задачи вызываются как
+        callback(*args, now=now) с тем же временем шага now (time.time()).
+        """
+        with self._condition:
+            self._batches[callback] = prepare
+
+    def _push(self, call):
+        """Кладет задачу в кучу и будит планировщик, если ее срок ближайший"""
+        with self._condition:
+            if call.cancelled:
+                return
+
+            call.deadline = time.monotonic() + call.delay
+            call.queued = True
+
+            if self._thread is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="animation")
+                self._thread = threading.Thread(target=self._run, name="animation-scheduler", daemon=True)
+                self._thread.start()
+
+            # Номер задачи разводит равные сроки, не сравнивая сами задачи
+            heapq.heappush(self._heap, (call.deadline, next(self._counter), call))
+
+            # Будим планировщик, только если новая задача стала ближайшей
+            if self._heap[0][2] is call:
+                self._condition.notify()
+
+    def _cancelled(self, call):
+        """Учитывает отмененную задачу и чистит кучу, если отмененных в ней большинство"""
+        with self._condition:
+            self.cancelled += 1
+            if not call.queued:
+                return
+
+            self._heap_cancelled += 1
+            if self._heap_cancelled > 64 and self._heap_cancelled * 2 > len(self._heap):
+                self._heap = [entry for entry in self._heap if not entry[2].cancelled]
+                heapq.heapify(self._heap)
+                self._heap_cancelled = 0
+
+    def _run(self):
+        """Поток планировщика: ждет ближайший срок и отдает наступившие задачи в пул"""
+        while True:
+            with self._condition:
+                while not self._heap:
+                    self._condition.wait()
+
+                now = time.monotonic()
+                wait = self._heap[0][0] + self.tick - now
+                if wait > 0:
+                    self._condition.wait(wait)
+                    continue
+
+                due = []
+                batches = {}
+                while self._heap and self._heap[0][0] <= now:
+                    _, _, call = heapq.heappop(self._heap)
+                    call.queued = False
+                    if call.cancelled:
+                        self._heap_cancelled -= 1
+                    elif call.callback in self._batches:
+                        batches.setdefault(call.callback, []).append(call)
+                    else:
+                        due.append(call)
+                prepares = {callback: self._batches[callback] for callback in batches}
+
+            tick = time.time()
+            try:
+                for call in due:
+                    self._executor.submit(self._execute, call)
+                for callback, calls in batches.items():
+                    self._executor.submit(self._execute_batch, prepares[callback], calls, tick)
+            except RuntimeError:
+                # Интерпретатор завершается: пул уже не принимает задачи
+                return
+
+    def _execute_batch(self, prepare, calls, now):
+        """Выполняет общую работу шага, затем раздает задачи шага пулу"""
+        calls = [call for call in calls if not call.cancelled]
+        if not calls:
+            return
+
+        try:
+            prepare(now, [call.args for call in calls])
+        except Exception:
+            logger.exception("Ошибка при подготовке шага анимации")
+
+        try:
+            for call in calls[1:]:
+                self._executor.submit(self._execute, call, now)
+        except RuntimeError:
+            return
+        self._execute(calls[0], now)
+
+    def _execute(self, call, now=None):
+        """Выполняет задачу в пуле и учитывает ее опоздание; now - время шага объединенных задач"""
+        if call.cancelled:
+            return
+
+        late_ms = max(0.0, (time.monotonic() - call.deadline) * 1000)
+        with self._condition:
+            self.fired += 1
+            self._late_ms.append(late_ms)
+            self._late_ms_total += late_ms
+            self.late_ms_max = max(self.late_ms_max, late_ms)
+
+        try:
+            if now is None:
+                call.callback(*call.args)
+            else:
+                call.callback(*call.args, now=now)
+        except Exception:
+            logger.exception("Ошибка в задаче анимации")
+        finally:
+            call.finished = True
+
+    def stats(self):
+        """Возвращает число задач и опоздание выполнения (мс): среднее, перцентили, максимум"""
+        with self._condition:
+            late = sorted(self._late_ms)
+            pending = len(self._heap) - self._heap_cancelled
+            fired = self.fired
+            total = self._late_ms_total
+
+        def percentile(share):
+            """Возвращает перцентиль опоздания по последним задачам"""
+            return late[min(len(late) - 1, int(len(late) * share))] if late else None
+
+        return {
+            "pending": pending,
+            "fired": fired,
+            "cancelled": self.cancelled,
+            "late_ms_mean": total / fired if fired else None,
+            "late_ms_p50": percentile(0.5),
+            "late_ms_p95": percentile(0.95),
+            "late_ms_p99": percentile(0.99),
+            "late_ms_max": self.late_ms_max,
+        }
+
+# Планировщик, общий для всех игр процесса
+animation_scheduler = AnimationScheduler()
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Асинхронный Telegram бот "Блинная башня" с анимированной игрой
+
+Та же игра, что в animated_bot.py в режиме edits, но на асинхронном
+Application: шаги анимации - корутины в одном цикле событий
+(async_animation), кадры отрисовываются в пуле (render_pool), а обновления
+сообщений отправляются через await, не занимая поток на время ответа
+Telegram.
+
+Бот написан на API python-telegram-bot 20+ (Application, ContextTypes),
+а requirements.txt закрепляет версию 13 для остальных ботов: зависимости
+этого бота ставятся из requirements-async.txt.
+"""
+
+import os
+import logging
+import time
+from dotenv import load_dotenv
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
+from telegram.error import TelegramError
+try:
+    from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
+except ImportError as e:
+    raise ImportError(
+        "Асинхронному боту нужен python-telegram-bot 20+: pip install -r requirements-async.txt"
+    ) from e
+
+from async_animation import AsyncAnimator
+from pancake_game import PRECOMPUTE_CYCLE, PancakeGame, animation_frame_interval
+from rate_limit import RateLimited, rate_limiter
+from session_db import open_session_database
+from session_store import SessionStore
+from telegram_media import photo_for_async, remember_photo
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Сессии игр и время последнего обновления сообщения.
+# С SESSION_DB игры сохраняются в базу и переживают перезапуск
+active_games = SessionStore(database=open_session_database())
+
+async def edit_game_message(bot, game, caption, reply_markup, block=True, pacer=None):
+    """Обновляет фото кадра в сообщении игры, соблюдая ограничение одновременных отправок
+
+    Отправка идет через общий ограничитель частоты: с block=False, когда
+    бюджет чата исчерпан, выбрасывается RateLimited вместо ожидания.
+    Время отрисовки и ответа Telegram учитывается в pacer (frame_pacing).
+    """
+    # Кадр отрисовывается в пуле (или берется file_id такого же кадра)
+    started = time.perf_counter()
+    frame_key, photo = await photo_for_async(game)
+    rendered = time.perf_counter()
+
+    # InputFile читает поток при создании, поэтому медиа собирается один раз:
+    # повтор после RetryAfter отправит те же байты, а не пустой поток
+    media = InputMediaPhoto(media=photo, caption=caption)
+
+    async def send():
+        """Отправляет кадр, заняв место среди одновременных отправок"""
+        async with animator.send_slot():
+            return await bot.edit_message_media(
+                chat_id=game.chat_id,
+                message_id=game.message_id,
+                media=media,
+                reply_markup=reply_markup
+            )
+
+    # Жетоны берутся до места среди отправок: ожидающий бюджета чат его не занимает
+    message = await rate_limiter.call_async(game.chat_id, send, block=block)
+    if pacer is not None:
+        pacer.observe(time.perf_counter() - rendered, rendered - started, rate_limiter.load())
+    remember_photo(frame_key, message)
+    return message
+
+async def animation_tick(user_id, bot):
+    """Шаг анимации: обновляет кадр игры и возвращает, через сколько секунд следующий шаг"""
+    # Анимация не продлевает сессию: брошенная игра удаляется по времени простоя
+    game = active_games.peek(user_id)
+    pacer = active_games.pacer(user_id)
+    if game is None or pacer is None or game.game_over:
+        return None
+
+    # Сообщение недавно обновлялось (например, после броска) - ждем остаток
+    # интервала кадров, подобранного для игры
+    current_time = time.time()
+    last_update = active_games.last_update(user_id)
+    if last_update is not None and current_time - last_update < pacer.interval:
+        return pacer.interval - (current_time - last_update)
+
+    # Бюджет отправки в чат исчерпан - не отрисовываем кадр, который не отправить
+    wait = rate_limiter.wait_time(game.chat_id)
+    if wait:
+        return wait
+
+    # Вычисляем положение блина на текущий момент
+    game.update_moving_pancake(current_time)
+
+    # Кадр анимации не ждет бюджета чата: если он исчерпан, кадр пропускается
+    try:
+        await edit_game_message(
+            bot, game,
+            f"Счёт: {game.score}",
+            InlineKeyboardMarkup([
+                [InlineKeyboardButton("Играть", callback_data="play_game")]
+            ]),
+            block=False,
+            pacer=pacer
+        )
+        active_games.mark_update(user_id, game.animation_frame_time(pacer.interval, current_time))
+    except RateLimited as e:
+        # Отказ по бюджету или 429: кадры игры становятся реже
+        pacer.backoff(e.wait)
+        return max(e.wait, pacer.interval)
+    except TelegramError as e:
+        logger.error(f"Ошибка при обновлении сообщения: {e}")
+
+    # Следующий шаг - в момент следующего кадра анимации: положения блина
+    # в эти моменты отрисовываются заранее (PancakeGame.animation_frame_time)
+    frame_time = game.animation_frame_time(pacer.interval, current_time)
+    return max(0.0, frame_time + animation_frame_interval(pacer.interval) - time.time())
+
+# Анимации всех игр процесса
+animator = AsyncAnimator(animation_tick)
+
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Отправляет сообщение при команде /start."""
+    user = update.effective_user
+    await rate_limiter.call_async(
+        update.effective_chat.id, update.message.reply_text,
+        f"Привет, {user.first_name}! 👋\n\n"
+        f"Добро пожаловать в игру 'Блинная башня'!\n\n"
+        f"Нажми /play, чтобы начать игру."
+    )
+
+async def play_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Начинает новую игру при команде /play."""
+    user_id = update.effective_user.id
+
+    # Останавливаем предыдущую анимацию, если она была
+    animator.stop(user_id)
+
+    # Создаем новую игру для этого пользователя
+    active_games[user_id] = PancakeGame(precompute_cycle=PRECOMPUTE_CYCLE)
+    game = active_games[user_id]
+
+    # Генерируем начальное изображение игры, не блокируя цикл событий
+    frame_key, photo = await photo_for_async(game)
+
+    # Отправляем начальное состояние игры
+    message = await rate_limiter.call_async(
+        update.effective_chat.id, update.message.reply_photo,
+        photo=photo,
+        caption=f"Счёт: {game.score}",
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("Играть", callback_data="play_game")]
+        ])
+    )
+    remember_photo(frame_key, message)
+
+    # Сохраняем ID сообщения для будущих обновлений
+    game.message_id = message.message_id
+    game.chat_id = update.effective_chat.id
+    active_games.save(user_id)
+    active_games.mark_update(user_id)
+
+    # Запускаем анимацию
+    animator.start(user_id, active_games.pacer(user_id).interval, context.bot)
+
+async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обрабатывает нажатия кнопок."""
+    query = update.callback_query
+    await query.answer()
+
+    user_id = update.effective_user.id
+
+    if query.data == "play_game":
+        if user_id in active_games:
+            game = active_games[user_id]
+
+            # Останавливаем анимацию: кадр после броска отправляется здесь
+            animator.stop(user_id)
+
+            # Опускаем блин: его положение в момент нажатия вычисляется по времени
+            game_over = game.drop_pancake()
+            active_games.save(user_id)
+
+            if game_over:
+                keyboard = [
+                    [InlineKeyboardButton("Новая игра", callback_data="new_game")]
+                ]
+                caption = f"Игра окончена! Финальный счёт: {game.score}"
+            else:
+                keyboard = [
+                    [InlineKeyboardButton("Играть", callback_data="play_game")]
+                ]
+                caption = f"Счёт: {game.score}"
+
+            # Обновляем сообщение с новым состоянием игры
+            await edit_game_message(context.bot, game, caption, InlineKeyboardMarkup(keyboard))
+            active_games.mark_update(user_id)
+
+            # Запускаем анимацию снова, если игра не окончена
+            if not game_over:
+                animator.start(user_id, active_games.pacer(user_id).interval, context.bot)
+
+    elif query.data == "new_game":
+        # Останавливаем предыдущую анимацию
+        animator.stop(user_id)
+
+        # Начинаем новую игру
+        active_games[user_id] = PancakeGame(precompute_cycle=PRECOMPUTE_CYCLE)
+        game = active_games[user_id]
+
+        # Сохраняем ID сообщения для будущих обновлений
+        game.message_id = query.message.message_id
+        game.chat_id = update.effective_chat.id
+
+        # Обновляем сообщение с новым состоянием игры
+        await edit_game_message(
+            context.bot, game,
+            f"Счёт: {game.score}",
+            InlineKeyboardMarkup([
+                [InlineKeyboardButton("Играть", callback_data="play_game")]
+            ])
+        )
+        active_games.save(user_id)
+        active_games.mark_update(user_id)
+
+        # Запускаем анимацию
+        animator.start(user_id, active_games.pacer(user_id).interval, context.bot)
+
+def session_stats():
+    """Возвращает статистику сессий, анимаций и ограничителя частоты процесса"""
+    return dict(active_games.stats(), animation=animator.stats(), rate_limit=rate_limiter.stats())
+
+def main():
+    """Запускает бота."""
+    # Загружаем переменные окружения
+    load_dotenv()
+
+    # Получаем токен бота
+    token = os.getenv("BOT_TOKEN")
+    if not token:
+        logger.error("Токен бота не найден в переменных окружения!")
+        exit(1)
+
+    # Запускаем бота
+    print("=" * 50)
+    print("Запуск асинхронного Telegram бота 'Блинная башня' с анимацией")
+    print("=" * 50)
+    print("\nБот запущен! Нажмите Ctrl+C для остановки.")
+
+    # Обработчики нажатий выполняются параллельно: пока один ждет Telegram,
+    # цикл событий обслуживает других пользователей
+    application = Application.builder().token(token).concurrent_updates(True).build()
+
+    # Добавляем обработчики команд
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("play", play_command))
+    application.add_handler(CallbackQueryHandler(button_callback))
+
+    # Запускаем бота
+    application.run_polling(allowed_updates=Update.ALL_TYPES)
+
+if __name__ == "__main__":
+    main()
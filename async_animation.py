@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Анимация игр "Блинная башня" на asyncio
+
+Анимация каждой игры - задача asyncio в цикле событий бота: шаг анимации
+(корутина) отрисовывает кадр в пуле и отправляет его через await, а сроки
+шагов ведет сам цикл событий. Пока запрос к Telegram ждет ответа, поток
+не занят, поэтому тысячи анимаций идут в одном потоке. Одновременно
+отправляется не больше ANIMATION_IN_FLIGHT обновлений сообщений:
+остальные ждут своей очереди, а не копятся в пуле соединений.
+"""
+
+import asyncio
+import logging
+import os
+from collections import deque
+from contextlib import asynccontextmanager
+
+# Сколько обновлений сообщений анимации отправляется одновременно
+ANIMATION_IN_FLIGHT = int(os.getenv("ANIMATION_IN_FLIGHT", "32"))
+
+# Сколько последних опозданий шагов хранится для перцентилей
+JITTER_WINDOW = 1024
+
+logger = logging.getLogger(__name__)
+
+class AsyncAnimator:
+    """Задачи анимации игр с общим ограничением одновременных отправок"""
+
+    def __init__(self, tick, in_flight=ANIMATION_IN_FLIGHT):
+        """Создает аниматор
+
+        tick(key, *args) - корутина одного шага анимации: возвращает, через
+        сколько секунд выполнить следующий шаг, или None, чтобы остановиться.
+        """
+        self.tick = tick
+        self.in_flight = in_flight
+        self.ticks = 0
+        self.sending = 0
+        self.waiting = 0
+        self.late_ms_max = 0.0
+        self._late_ms = deque(maxlen=JITTER_WINDOW)
+        self._tasks = {}
+        self._semaphore = None
+
+    def start(self, key, delay, *args):
+        """Запускает анимацию игры key с первым шагом через delay секунд, заменяя прежнюю"""
+        self.stop(key)
+        task = asyncio.get_running_loop().create_task(self._run(key, delay, args))
+        self._tasks[key] = task
+        return task
+
+    def stop(self, key):
+        """Останавливает анимацию игры key, даже посреди отправки кадра"""
+        task = self._tasks.pop(key, None)
+        if task is not None:
+            task.cancel()
+
+    def running(self, key):
+        """Проверяет, идет ли анимация игры key"""
+        return key in self._tasks
+
+    async def _run(self, key, delay, args):
+        """Задача анимации: выполняет шаги, пока tick не вернет None"""
+        loop = asyncio.get_running_loop()
+        try:
+            while delay is not None:
+                deadline = loop.time() + delay
+                await asyncio.sleep(delay)
+
+                late_ms = max(0.0, (loop.time() - deadline) * 1000)
+                self._late_ms.append(late_ms)
+                self.late_ms_max = max(self.late_ms_max, late_ms)
+                self.ticks += 1
+
+                try:
+                    delay = await self.tick(key, *args)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    logger.exception(f"Ошибка в анимации игры {key}")
+                    delay = None
+        finally:
+            # Задачу могли уже заменить новой анимацией той же игры
+            if self._tasks.get(key) is asyncio.current_task():
+                del self._tasks[key]
+
+    @asynccontextmanager
+    async def send_slot(self):
+        """Место для отправки обновления: не больше in_flight одновременно"""
+        if self._semaphore is None:
+            # Семафор создается в цикле событий бота, а не при импорте модуля
+            self._semaphore = asyncio.Semaphore(self.in_flight)
+
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.sending += 1
+        try:
+            yield
+        finally:
+            self.sending -= 1
+            self._semaphore.release()
+
+    def stats(self):
+        """Возвращает число анимаций, отправок и опоздание шагов (мс): перцентили и максимум"""
+        late = sorted(self._late_ms)
+
+        def percentile(share):
+            """Возвращает перцентиль опоздания по последним шагам"""
+            return late[min(len(late) - 1, int(len(late) * share))] if late else None
+
+        return {
+            "running": len(self._tasks),
+            "ticks": self.ticks,
+            "sending": self.sending,
+            "waiting": self.waiting,
+            "late_ms_p50": percentile(0.5),
+            "late_ms_p99": percentile(0.99),
+            "late_ms_max": self.late_ms_max,
+        }
@@ -0,0 +1,400 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Замеры производительности отрисовки игры "Блинная башня"
+
+Запуск: python benchmark.py <замер>, список замеров - python benchmark.py --help
+"""
+
+import argparse
+import random
+import threading
+import time
+import timeit
+import tracemalloc
+from PIL import Image, ImageChops, ImageDraw, ImageFont
+
+from animation_scheduler import AnimationScheduler
+from frame_encoding import ENCODERS, measure_encoders, select_encoder
+from frame_rendering import NUMPY_AVAILABLE
+from frame_cache import extend_digest, frame_cache
+from pancake_game import STEP_INTERVAL, PancakeGame
+from render_cache import get_score_glyphs, image_bytes
+from render_pool import RENDER_EXECUTOR, RENDER_WORKERS, render_frame, render_frames
+from resolution import PROFILES, scale_frame
+
+# Высоты башни для замеров на реалистичных состояниях игры
+TOWER_HEIGHTS = [0, 5, 10, 20, 29]
+
+def _measure(func, number):
+    """Возвращает среднее время одного вызова в миллисекундах"""
+    func()  # Прогрев кэшей
+    return timeit.timeit(func, number=number) / number * 1000
+
+def build_game(tower_height, seed=0):
+    """Создает игру с башней заданной высоты, как после реальных бросков"""
+    rng = random.Random(seed)
+    state = random.getstate()
+    random.seed(seed)
+
+    try:
+        game = PancakeGame()
+        while len(game.pancakes) < tower_height and not game.game_over:
+            # Бросаем блин с небольшим промахом относительно предыдущего
+            if game.pancakes:
+                target_x = game.pancakes[-1]["x"] + rng.randint(-4, 4)
+                game.current_pancake["start_x"] = max(0, min(target_x, game.width - game.current_pancake["width"]))
+            # Бросок в момент появления блина - он еще в начальной точке
+            game.drop_pancake(now=game.current_pancake["spawn_time"])
+
+        # Движущийся блин в случайной точке своего пути
+        game.current_pancake["x"] = rng.randint(0, game.width - game.current_pancake["width"])
+    finally:
+        random.setstate(state)
+
+    return game
+
+def _legacy_draw_score(draw, width, score):
+    """Отрисовка счета так, как она выполнялась до кэширования шрифта и цифр"""
+    circle_radius = 50
+    circle_center = (width // 2, 200)
+    draw.ellipse(
+        [(circle_center[0] - circle_radius, circle_center[1] - circle_radius),
+         (circle_center[0] + circle_radius, circle_center[1] + circle_radius)],
+        outline=(200, 220, 255),
+        fill=(255, 255, 255),
+        width=2
+    )
+
+    try:
+        font = ImageFont.truetype("arial.ttf", 36)
+    except IOError:
+        font = ImageFont.load_default()
+
+    text = str(score)
+    text_bbox = font.getbbox(text)
+    text_width = text_bbox[2] - text_bbox[0]
+    text_position = (circle_center[0] - text_width // 2, circle_center[1] - 18)
+
+    draw.text(text_position, text, fill=(0, 0, 0), font=font)
+
+def bench_score(args):
+    """Сравнивает отрисовку счета до и после кэширования шрифта и цифр"""
+    game = PancakeGame()
+    game.score = args.score
+    image = Image.new("RGB", (game.width, game.height), game.bg_color)
+    draw = ImageDraw.Draw(image)
+    get_score_glyphs()
+
+    legacy = _measure(lambda: _legacy_draw_score(draw, game.width, game.score), args.number)
+    cached = _measure(lambda: game._draw_score(image), args.number)
+
+    print(f"Счет {game.score}, {args.number} кадров")
+    print(f"  truetype + draw.text: {legacy:.4f} мс/кадр")
+    print(f"  кэш шрифта и цифр:    {cached:.4f} мс/кадр")
+    print(f"  экономия:             {legacy - cached:.4f} мс/кадр ({legacy / cached:.1f}x)")
+
+def bench_encoders(args):
+    """Сравнивает кодировщики кадров по размеру и времени на реалистичных состояниях"""
+    games = [build_game(height, seed) for height in TOWER_HEIGHTS for seed in range(args.seeds)]
+    images = [game.render_image() for game in games]
+
+    # Кадр после окончания игры
+    finished = build_game(TOWER_HEIGHTS[-1])
+    finished.game_over = True
+    images.append(finished.render_image())
+
+    measurements = measure_encoders(images, ENCODERS["auto"].candidates, args.repeat)
+
+    print(f"{len(images)} кадров, {args.repeat} повтора на кадр")
+    print(f"  {'кодировщик':<14} {'байт':>8} {'мс/кадр':>9}")
+    for measurement in measurements:
+        print(f"  {measurement['encoder'].name:<14} {measurement['size']:>8.0f} {measurement['time_ms']:>9.2f}")
+
+    selected = select_encoder(measurements, args.budget)
+    print(f"Режим auto с бюджетом {args.budget} мс выберет: {selected.name}")
+
+def _different_pixels(first, second):
+    """Возвращает число пикселей, которыми различаются два изображения"""
+    red, green, blue = ImageChops.difference(first, second).split()
+    difference = ImageChops.lighter(ImageChops.lighter(red, green), blue)
+    return difference.width * difference.height - difference.histogram()[0]
+
+def bench_renderers(args):
+    """Сравнивает отрисовку кадра через PIL и через NumPy по высоте башни"""
+    if not NUMPY_AVAILABLE:
+        print("NumPy не установлен, сравнивать не с чем")
+        return
+
+    print(f"{args.number} кадров на высоту башни")
+    print(f"  {'башня':>5} {'PIL мс':>8} {'NumPy мс':>9} {'массив мс':>10} {'различий':>9}")
+    for height in TOWER_HEIGHTS:
+        game = build_game(height)
+
+        pil = _measure(lambda: game.render_image(renderer="pil"), args.number)
+        numpy = _measure(lambda: game.render_image(renderer="numpy"), args.number)
+        array = _measure(game.render_array, args.number)
+        different = _different_pixels(game.render_image(renderer="pil"), game.render_image(renderer="numpy"))
+
+        print(f"  {height:>5} {pil:>8.3f} {numpy:>9.3f} {array:>10.3f} {different:>9}")
+
+def bench_batch(args):
+    """Сравнивает пропускную способность отрисовки кадров по одному и пачками шага планировщика"""
+    games = [build_game(TOWER_HEIGHTS[i % len(TOWER_HEIGHTS)], seed=i) for i in range(args.games)]
+    started = time.time()
+
+    def run(batch_size):
+        """Отрисовывает все игры за args.rounds шагов и возвращает кадров в секунду"""
+        frame_cache.clear()
+        elapsed = 0.0
+
+        for step in range(args.rounds):
+            # Каждый раунд блины сдвигаются, поэтому кадры не берутся из кэша
+            now = started + (step + 1) * STEP_INTERVAL
+            begin = time.perf_counter()
+            if batch_size is None:
+                for game in games:
+                    game.update_moving_pancake(now)
+                    render_frame(game)
+            else:
+                for first in range(0, len(games), batch_size):
+                    render_frames(games[first:first + batch_size], now=now)
+            elapsed += time.perf_counter() - begin
+
+        return len(games) * args.rounds / elapsed
+
+    print(f"{args.games} игр, {args.rounds} шагов, пул {RENDER_EXECUTOR}: {RENDER_WORKERS}")
+    print(f"  по одному кадру: {run(None):8.1f} кадров/с")
+    for batch_size in args.sizes:
+        print(f"  пачка {batch_size:>4}:      {run(batch_size):8.1f} кадров/с")
+
+def bench_profiles(args):
+    """Сравнивает время и размер кадра в разных профилях разрешения"""
+    games = [build_game(height) for height in TOWER_HEIGHTS]
+    images = [game.render_image() for game in games]
+    encoder = ENCODERS[args.encoder]
+
+    print(f"{len(images)} кадров, кодировщик {encoder.name}")
+    print(f"  {'профиль':<10} {'размер':>9} {'мс/кадр':>9} {'байт':>8}")
+    for profile in PROFILES:
+        def render():
+            """Уменьшает и кодирует все кадры, возвращает их суммарный размер"""
+            return sum(len(encoder.encode(scale_frame(image, profile))) for image in images)
+
+        time_ms = _measure(render, args.number) / len(images)
+        width, height = scale_frame(images[0], profile).size
+        print(f"  {profile:<10} {f'{width}x{height}':>9} {time_ms:>9.2f} {render() / len(images):>8.0f}")
+
+def bench_band(args):
+    """Сравнивает сборку полного кадра и перерисовку полосы движущегося блина"""
+    print(f"{args.number} кадров на высоту башни, без кодирования")
+    print(f"  {'башня':>5} {'полный мс':>10} {'полоса мс':>10}")
+    for height in TOWER_HEIGHTS:
+        game = build_game(height)
+        positions = [x for x, _ in game.oscillation_states()]
+        steps = iter(range(10 ** 9))
+
+        def move():
+            """Переносит блин в следующее положение цикла колебаний"""
+            game.current_pancake["x"] = positions[next(steps) % len(positions)]
+
+        full = _measure(lambda: (move(), game.render_image()), args.number)
+        band = _measure(lambda: (move(), game._update_last_frame(game.current_pancake)), args.number)
+        print(f"  {height:>5} {full:>10.3f} {band:>10.3f}")
+
+class _LegacyGameState:
+    """Состояние игры в прежнем виде: атрибуты в __dict__, блины - словари"""
+
+    def __init__(self):
+        """Заполняет те же поля, что заполнял прежний PancakeGame.__init__"""
+        self.score = 0
+        self.game_over = False
+        self.message_id = None
+        self.chat_id = None
+        self.width = 600
+        self.height = 800
+        self.bg_color = (255, 255, 255)
+        self.pancakes = []
+        self.plate_y = self.height - 100
+        self.plate_width = 300
+        self.plate_height = 30
+        self.plate_color = (255, 150, 120)
+        self.current_pancake = {
+            "x": 0, "y": 200, "width": 280, "height": 20, "direction": 1, "speed": 5,
+            "color": (255, 220, 50), "start_x": 0, "start_direction": 1, "spawn_time": time.time(),
+        }
+        self.pancake_colors = [
+            (255, 220, 50), (255, 200, 50), (255, 180, 50), (255, 160, 50), (255, 140, 50),
+        ]
+        self._tower_layer = None
+        self._tower_mask = None
+        self._tower_digest = b""
+        self._tower_arrays = None
+        self._tower_version = 0
+        self._last_frame = None
+        self._last_frame_key = None
+        self._static_band = None
+        self._frame_lock = threading.Lock()
+        self._animation_loop = None
+        self.precompute_cycle = False
+
+    def _add_to_tower_layer(self, pancake):
+        """Дополняет хэш башни, как игра (слой не рисуется ни в одном варианте)"""
+        self._tower_digest = extend_digest(
+            self._tower_digest,
+            pancake["x"], pancake["y"], pancake["width"], pancake["height"], pancake["color"]
+        )
+
+def _build_game(factory, index, tower_height):
+    """Создает игру с башней из tower_height блинов, сдвинутых в зависимости от index"""
+    game = factory()
+    for level in range(tower_height):
+        pancake = {
+            "x": (index + level) % 320, "y": 680 - 20 * level, "width": 280 - level,
+            "height": 20, "color": game.pancake_colors[level % len(game.pancake_colors)],
+        }
+        game.pancakes.append(pancake)
+        game._add_to_tower_layer(pancake)
+        game.score += 1
+    return game
+
+def _games_memory(factory, games, tower_height):
+    """Возвращает число байт на игру для games игр с башней tower_height"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+
+    created = [_build_game(factory, index, tower_height) for index in range(games)]
+
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used / len(created)
+
+def _frame_memory(game):
+    """Возвращает байты слоя башни и последнего кадра игры
+
+    Это буферы Pillow вне кучи Python, tracemalloc их не видит.
+    """
+    tower = game._tower_layer
+    layer = 0 if tower is None else tower.nbytes
+    return layer, image_bytes(game._last_frame) + image_bytes(game._static_band)
+
+def bench_memory(args):
+    """Сравнивает память на игру в компактном и в прежнем представлении состояния
+
+    Отдельно измеряет кадры, которые держат отрисованные игры, до и после release_frames.
+    """
+    print(f"{args.games} игр, башня из {args.tower} блинов, состояние без кадров")
+    for name, factory in (("прежнее", _LegacyGameState), ("компактное", PancakeGame)):
+        per_game = _games_memory(factory, args.games, args.tower)
+        print(f"  {name:<11} {per_game:8.0f} байт/игру, {per_game * args.games / 2 ** 20:8.1f} МБ всего")
+
+    games = [_build_game(PancakeGame, index, args.tower) for index in range(args.rendered)]
+    for game in games:
+        game.encode_frame()
+    layer, last_frame = (sum(sizes) / len(games) for sizes in zip(*map(_frame_memory, games)))
+    # Слой и маска во весь холст: 4 байта на пиксель RGB и 1 байт маски
+    canvas = games[0].width * games[0].height * 5
+
+    print(f"{len(games)} игр с отрисованным кадром")
+    print(f"  слой башни     {layer / 1024:8.0f} КБ/игру (во весь холст было бы {canvas / 1024:.0f} КБ)")
+    print(f"  последний кадр {last_frame / 1024:8.0f} КБ/игру")
+
+    for game in games:
+        game.release_frames()
+    released = sum(sum(_frame_memory(game)) for game in games) / len(games)
+    print(f"  после release_frames {released:8.0f} байт/игру")
+
+def _timer_chains(start_timer, games, interval, duration):
+    """Гоняет цепочки перезапускаемых таймеров игр, возвращает опоздания (мс) и пик потоков"""
+    late_ms = []
+    peak_threads = [threading.active_count()]
+    stop_at = time.monotonic() + duration
+
+    def tick(deadline):
+        """Кадр игры: учитывает опоздание и планирует следующий"""
+        now = time.monotonic()
+        late_ms.append((now - deadline) * 1000)
+        peak_threads[0] = max(peak_threads[0], threading.active_count())
+        if now < stop_at:
+            start_timer(interval, tick, now + interval)
+
+    for game in range(games):
+        # Игры начинают анимацию вразброс, как нажатия пользователей
+        delay = interval * game / games
+        start_timer(delay, tick, time.monotonic() + delay)
+
+    time.sleep(duration + interval * 2)
+    return sorted(late_ms), peak_threads[0]
+
+def bench_scheduler(args):
+    """Сравнивает цепочки threading.Timer и общий планировщик анимации"""
+    def thread_timer(delay, callback, deadline):
+        """Прежний способ: отдельный поток на каждый кадр"""
+        timer = threading.Timer(delay, callback, args=[deadline])
+        timer.daemon = True
+        timer.start()
+
+    scheduler = AnimationScheduler()
+    print(f"{args.games} игр, кадр каждые {args.interval} с, {args.duration} с")
+    for name, start_timer in (("threading.Timer", thread_timer), ("планировщик", scheduler.call_later)):
+        late_ms, peak_threads = _timer_chains(start_timer, args.games, args.interval, args.duration)
+        p50 = late_ms[len(late_ms) // 2]
+        p99 = late_ms[min(len(late_ms) - 1, int(len(late_ms) * 0.99))]
+        print(
+            f"  {name:<16} кадров {len(late_ms):6d}, опоздание p50 {p50:6.2f} мс, "
+            f"p99 {p99:6.2f} мс, макс {late_ms[-1]:7.2f} мс, потоков до {peak_threads}"
+        )
+
+def main():
+    """Разбирает аргументы командной строки и запускает выбранный замер"""
+    parser = argparse.ArgumentParser(description="Замеры производительности 'Блинной башни'")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    score_parser = subparsers.add_parser("score", help="отрисовка счета")
+    score_parser.add_argument("--score", type=int, default=42)
+    score_parser.add_argument("--number", type=int, default=2000)
+    score_parser.set_defaults(func=bench_score)
+
+    encoders_parser = subparsers.add_parser("encoders", help="кодировщики кадров")
+    encoders_parser.add_argument("--seeds", type=int, default=3)
+    encoders_parser.add_argument("--repeat", type=int, default=3)
+    encoders_parser.add_argument("--budget", type=float, default=ENCODERS["auto"].budget_ms)
+    encoders_parser.set_defaults(func=bench_encoders)
+
+    renderers_parser = subparsers.add_parser("renderers", help="отрисовка через PIL и через NumPy")
+    renderers_parser.add_argument("--number", type=int, default=500)
+    renderers_parser.set_defaults(func=bench_renderers)
+
+    batch_parser = subparsers.add_parser("batch", help="отрисовка кадров многих игр пачками")
+    batch_parser.add_argument("--games", type=int, default=200)
+    batch_parser.add_argument("--rounds", type=int, default=5)
+    batch_parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 50, 200])
+    batch_parser.set_defaults(func=bench_batch)
+
+    profiles_parser = subparsers.add_parser("profiles", help="профили разрешения кадров")
+    profiles_parser.add_argument("--encoder", default="png", choices=[name for name in ENCODERS if name != "auto"])
+    profiles_parser.add_argument("--number", type=int, default=10)
+    profiles_parser.set_defaults(func=bench_profiles)
+
+    band_parser = subparsers.add_parser("band", help="перерисовка только полосы движущегося блина")
+    band_parser.add_argument("--number", type=int, default=2000)
+    band_parser.set_defaults(func=bench_band)
+
+    memory_parser = subparsers.add_parser("memory", help="память на состояние игры")
+    memory_parser.add_argument("--games", type=int, default=100000)
+    memory_parser.add_argument("--tower", type=int, default=10)
+    memory_parser.add_argument("--rendered", type=int, default=200)
+    memory_parser.set_defaults(func=bench_memory)
+
+    scheduler_parser = subparsers.add_parser("scheduler", help="таймеры анимации многих игр")
+    scheduler_parser.add_argument("--games", type=int, default=1000)
+    scheduler_parser.add_argument("--interval", type=float, default=0.2)
+    scheduler_parser.add_argument("--duration", type=float, default=3.0)
+    scheduler_parser.set_defaults(func=bench_scheduler)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
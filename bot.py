@@ -6,6 +6,10 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMe
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
 
 from game import PancakeGame
+from rate_limit import rate_limiter
+from session_db import open_session_database
+from session_store import SessionStore
+from telegram_media import photo_for_async, remember_photo
 
 # Load environment variables
 load_dotenv()
@@ -17,13 +21,14 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Store active games
-active_games = {}
+# Store active games, evicting idle and finished ones (persisted with SESSION_DB)
+active_games = SessionStore(database=open_session_database())
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message when the command /start is issued."""
     user = update.effective_user
-    await update.message.reply_text(
+    await rate_limiter.call_async(
+        update.effective_chat.id, update.message.reply_text,
         f"Привет, {user.first_name}! 👋\n\n"
         f"Добро пожаловать в игру 'Блинная башня'!\n\n"
         f"Нажми /play, чтобы начать игру."
@@ -37,8 +42,9 @@ async def play_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     active_games[user_id] = PancakeGame()
     game = active_games[user_id]
     
-    # Generate initial game image
-    image_path = await game.generate_game_image()
+    # Generate initial game image without blocking the event loop
+    # (or reuse the file_id of an identical frame already uploaded to Telegram)
+    frame_key, photo = await photo_for_async(game)
     
     # Create keyboard with play button
     keyboard = [
@@ -47,19 +53,18 @@ async def play_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     reply_markup = InlineKeyboardMarkup(keyboard)
     
     # Send initial game state
-    with open(image_path, 'rb') as photo:
-        message = await update.message.reply_photo(
-            photo=photo,
-            caption=f"Счёт: {game.score}",
-            reply_markup=reply_markup
-        )
+    message = await rate_limiter.call_async(
+        update.effective_chat.id, update.message.reply_photo,
+        photo=photo,
+        caption=f"Счёт: {game.score}",
+        reply_markup=reply_markup
+    )
+    remember_photo(frame_key, message)
     
     # Store message ID for future updates
     game.message_id = message.message_id
     game.chat_id = update.effective_chat.id
-    
-    # Clean up temporary image
-    os.remove(image_path)
+    active_games.save(user_id)
 
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle button presses."""
@@ -72,11 +77,13 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         if user_id in active_games:
             game = active_games[user_id]
             
-            # Drop a pancake
-            game_over = await game.drop_pancake()
+            # Drop a pancake and persist the game (written with the next batch)
+            game_over = game.drop_pancake()
+            active_games.save(user_id)
             
-            # Generate updated game image
-            image_path = await game.generate_game_image()
+            # Generate updated game image without blocking the event loop
+            # (or reuse the file_id of an identical frame already uploaded to Telegram)
+            frame_key, photo = await photo_for_async(game)
             
             # Update keyboard based on game state
             keyboard = [
@@ -93,28 +100,27 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             
             reply_markup = InlineKeyboardMarkup(keyboard)
             
-            # Update the message with new game state
-            with open(image_path, 'rb') as photo:
-                await context.bot.edit_message_media(
-                    chat_id=game.chat_id,
-                    message_id=game.message_id,
-                    media=InputMediaPhoto(
-                        media=photo,
-                        caption=caption
-                    ),
-                    reply_markup=reply_markup
-                )
-            
-            # Clean up temporary image
-            os.remove(image_path)
+            # Update the message with new game state within the chat's rate budget
+            message = await rate_limiter.call_async(
+                game.chat_id, context.bot.edit_message_media,
+                chat_id=game.chat_id,
+                message_id=game.message_id,
+                media=InputMediaPhoto(
+                    media=photo,
+                    caption=caption
+                ),
+                reply_markup=reply_markup
+            )
+            remember_photo(frame_key, message)
     
     elif query.data == "new_game":
         # Start a new game
         active_games[user_id] = PancakeGame()
         game = active_games[user_id]
         
-        # Generate initial game image
-        image_path = await game.generate_game_image()
+        # Generate initial game image without blocking the event loop
+        # (or reuse the file_id of an identical frame already uploaded to Telegram)
+        frame_key, photo = await photo_for_async(game)
         
         # Create keyboard with play button
         keyboard = [
@@ -122,24 +128,23 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        # Update the message with new game state
-        with open(image_path, 'rb') as photo:
-            await context.bot.edit_message_media(
-                chat_id=update.effective_chat.id,
-                message_id=query.message.message_id,
-                media=InputMediaPhoto(
-                    media=photo,
-                    caption=f"Счёт: {game.score}"
-                ),
-                reply_markup=reply_markup
-            )
+        # Update the message with new game state within the chat's rate budget
+        message = await rate_limiter.call_async(
+            update.effective_chat.id, context.bot.edit_message_media,
+            chat_id=update.effective_chat.id,
+            message_id=query.message.message_id,
+            media=InputMediaPhoto(
+                media=photo,
+                caption=f"Счёт: {game.score}"
+            ),
+            reply_markup=reply_markup
+        )
+        remember_photo(frame_key, message)
         
         # Store message ID for future updates
         game.message_id = query.message.message_id
         game.chat_id = update.effective_chat.id
-        
-        # Clean up temporary image
-        os.remove(image_path)
+        active_games.save(user_id)
 
 def main() -> None:
     """Start the bot."""
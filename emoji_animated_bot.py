@@ -9,11 +9,18 @@ import os
 import logging
 import time
 import random
-import threading
 from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Updater, CommandHandler, CallbackQueryHandler, CallbackContext
 
+from animation_scheduler import animation_scheduler
+from frame_pacing import ANIMATION_MIN_INTERVAL
+from motion import pancake_position
+from rate_limit import RateLimited, rate_limiter
+from session_db import open_session_database
+from session_store import SessionStore
+from sharding import BOT_SHARDS, run_sharded
+
 # Настройка логирования
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -21,9 +28,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Хранилище активных игр и их потоков анимации
-active_games = {}
-animation_threads = {}
+# Сессии игр: игра и таймер анимации.
+# С SESSION_DB игры сохраняются в базу и переживают перезапуск
+active_games = SessionStore(database=open_session_database())
 
 # Эмодзи для визуализации
 PANCAKE_EMOJI = "🥞"
@@ -31,6 +38,9 @@ PLATE_EMOJI = "🍽️"
 ARROW_LEFT = "⬅️"
 ARROW_RIGHT = "➡️"
 
+# Через сколько секунд движущийся блин сдвигается на одну клетку
+STEP_INTERVAL = 0.5
+
 class EmojiPancakeGame:
     """Класс для игры 'Блинная башня' с эмодзи"""
     
@@ -52,32 +62,38 @@ class EmojiPancakeGame:
         self.current_pancake = {
             "x": 0,  # Текущая позиция X
             "width": 5,  # Начальная ширина блина (в символах)
-            "direction": 1  # 1 - вправо, -1 - влево
+            "direction": 1,  # 1 - вправо, -1 - влево
+            "start_x": 0,  # Позиция X в момент появления
+            "start_direction": 1,  # Направление в момент появления
+            "spawn_time": time.time()  # Момент появления
         }
     
-    def update_moving_pancake(self):
-        """Обновляет положение движущегося блина"""
+    def update_moving_pancake(self, now=None):
+        """Обновляет положение движущегося блина на момент now
+        
+        Положение вычисляется по времени с момента появления блина,
+        поэтому вызывать метод нужно только перед отрисовкой или броском.
+        """
         # Если игра окончена, ничего не делаем
         if self.game_over:
             return
         
-        # Обновляем позицию блина
-        self.current_pancake["x"] += self.current_pancake["direction"]
-        
-        # Проверяем, не достиг ли блин края экрана
-        if self.current_pancake["x"] <= 0:
-            self.current_pancake["x"] = 0
-            self.current_pancake["direction"] = 1  # Меняем направление на вправо
-        elif self.current_pancake["x"] + self.current_pancake["width"] >= self.width:
-            self.current_pancake["x"] = self.width - self.current_pancake["width"]
-            self.current_pancake["direction"] = -1  # Меняем направление на влево
+        pancake = self.current_pancake
+        pancake["x"], pancake["direction"] = pancake_position(
+            pancake["spawn_time"], pancake["start_x"], pancake["start_direction"],
+            1, pancake["width"], self.width,
+            time.time() if now is None else now, STEP_INTERVAL
+        )
     
-    def drop_pancake(self):
-        """Опускает текущий блин на башню"""
+    def drop_pancake(self, now=None):
+        """Опускает текущий блин на башню в момент now"""
         # Если игра уже окончена, ничего не делаем
         if self.game_over:
             return True
         
+        # Блин падает из того места, где он находится в момент броска
+        self.update_moving_pancake(now)
+        
         # Определяем параметры для нового блина
         if not self.pancakes:
             # Первый блин
@@ -123,10 +139,15 @@ class EmojiPancakeGame:
         self.score += 1
         
         # Создаем новый движущийся блин
+        start_x = random.randint(0, self.width - pancake_width)
+        start_direction = random.choice([-1, 1])  # Случайное начальное направление
         self.current_pancake = {
-            "x": random.randint(0, self.width - pancake_width),
+            "x": start_x,
             "width": pancake_width,  # Ширина равна ширине предыдущего уложенного блина
-            "direction": random.choice([-1, 1])  # Случайное начальное направление
+            "direction": start_direction,
+            "start_x": start_x,
+            "start_direction": start_direction,
+            "spawn_time": time.time() if now is None else now
         }
         
         # Проверяем, не достигла ли башня максимальной высоты
@@ -171,22 +192,41 @@ class EmojiPancakeGame:
         # Объединяем все строки
         return "\n".join(field)
 
+def schedule_animation(user_id, context, delay=None):
+    """Планирует следующее обновление анимации пользователя через delay секунд
+
+    Без delay - через интервал кадров, подобранный для игры пользователя,
+    но не раньше следующего шага блина: чаще текст все равно не меняется.
+    """
+    if delay is None:
+        pacer = active_games.pacer(user_id)
+        delay = max(STEP_INTERVAL, ANIMATION_MIN_INTERVAL if pacer is None else pacer.interval)
+    
+    timer = animation_scheduler.timer(delay, start_animation, user_id, context)
+    active_games.set_timer(user_id, timer)
+    timer.start()
+
 def start_animation(user_id, context):
     """Запускает анимацию движения блина для конкретного пользователя"""
-    if user_id not in active_games or active_games[user_id].game_over:
+    # Анимация не продлевает сессию: брошенная игра удаляется по времени простоя
+    game = active_games.peek(user_id)
+    pacer = active_games.pacer(user_id)
+    if game is None or pacer is None or game.game_over:
         return
     
-    game = active_games[user_id]
-    
-    # Обновляем положение блина
+    # Вычисляем положение блина на текущий момент
+    started = time.perf_counter()
     game.update_moving_pancake()
     
     # Генерируем новое текстовое представление
     game_text = game.generate_game_text()
+    rendered = time.perf_counter()
     
-    # Обновляем сообщение с новым текстом
+    # Обновляем сообщение с новым текстом. Шаг анимации не ждет бюджета
+    # чата: если он исчерпан, шаг пропускается
     try:
-        context.bot.edit_message_text(
+        rate_limiter.call(
+            game.chat_id, context.bot.edit_message_text, block=False,
             chat_id=game.chat_id,
             message_id=game.message_id,
             text=f"{game_text}\n\nСчёт: {game.score}",
@@ -194,19 +234,27 @@ def start_animation(user_id, context):
                 [InlineKeyboardButton("Играть", callback_data="play_game")]
             ])
         )
+        # Интервал кадров подстраивается под задержки Telegram
+        pacer.observe(time.perf_counter() - rendered, rendered - started, rate_limiter.load())
+    except RateLimited as e:
+        # Отказ по бюджету или 429: шаги игры становятся реже, а следующий -
+        # не раньше, чем бюджет чата позволит его отправить
+        pacer.backoff(e.wait)
+        if active_games.timer_running(user_id):
+            schedule_animation(user_id, context, max(e.wait, pacer.interval, STEP_INTERVAL))
+        return
     except Exception as e:
         logger.error(f"Ошибка при обновлении сообщения: {e}")
     
-    # Планируем следующее обновление через 0.5 секунды
-    if user_id in animation_threads and animation_threads[user_id].is_alive():
-        animation_threads[user_id] = threading.Timer(0.5, start_animation, args=[user_id, context])
-        animation_threads[user_id].daemon = True
-        animation_threads[user_id].start()
+    # Планируем следующее обновление через подобранный интервал
+    if active_games.timer_running(user_id):
+        schedule_animation(user_id, context)
 
 def start(update: Update, context: CallbackContext) -> None:
     """Отправляет сообщение при команде /start."""
     user = update.effective_user
-    update.message.reply_text(
+    rate_limiter.call(
+        update.effective_chat.id, update.message.reply_text,
         f"Привет, {user.first_name}! 👋\n\n"
         f"Добро пожаловать в игру 'Блинная башня'!\n\n"
         f"Нажми /play, чтобы начать игру."
@@ -233,7 +281,8 @@ def play_command(update: Update, context: CallbackContext) -> None:
     reply_markup = InlineKeyboardMarkup(keyboard)
     
     # Отправляем начальное состояние игры
-    message = update.message.reply_text(
+    message = rate_limiter.call(
+        update.effective_chat.id, update.message.reply_text,
         f"{game_text}\n\nСчёт: {game.score}",
         reply_markup=reply_markup
     )
@@ -241,17 +290,14 @@ def play_command(update: Update, context: CallbackContext) -> None:
     # Сохраняем ID сообщения для будущих обновлений
     game.message_id = message.message_id
     game.chat_id = update.effective_chat.id
+    active_games.save(user_id)
     
     # Запускаем анимацию
-    animation_threads[user_id] = threading.Timer(0.5, start_animation, args=[user_id, context])
-    animation_threads[user_id].daemon = True
-    animation_threads[user_id].start()
+    schedule_animation(user_id, context)
 
 def stop_animation(user_id):
     """Останавливает анимацию для конкретного пользователя"""
-    if user_id in animation_threads and animation_threads[user_id].is_alive():
-        animation_threads[user_id].cancel()
-        del animation_threads[user_id]
+    active_games.cancel_timer(user_id)
 
 def button_callback(update: Update, context: CallbackContext) -> None:
     """Обрабатывает нажатия кнопок."""
@@ -267,8 +313,9 @@ def button_callback(update: Update, context: CallbackContext) -> None:
             # Останавливаем анимацию
             stop_animation(user_id)
             
-            # Опускаем блин
+            # Опускаем блин и сохраняем игру (в базу - со следующей пачкой)
             game_over = game.drop_pancake()
+            active_games.save(user_id)
             
             # Генерируем обновленное текстовое представление
             game_text = game.generate_game_text()
@@ -287,14 +334,13 @@ def button_callback(update: Update, context: CallbackContext) -> None:
                 caption = f"{game_text}\n\nСчёт: {game.score}"
                 
                 # Запускаем анимацию снова, если игра не окончена
-                animation_threads[user_id] = threading.Timer(0.5, start_animation, args=[user_id, context])
-                animation_threads[user_id].daemon = True
-                animation_threads[user_id].start()
+                schedule_animation(user_id, context)
             
             reply_markup = InlineKeyboardMarkup(keyboard)
             
             # Обновляем сообщение с новым состоянием игры
-            context.bot.edit_message_text(
+            rate_limiter.call(
+                game.chat_id, context.bot.edit_message_text,
                 chat_id=game.chat_id,
                 message_id=game.message_id,
                 text=caption,
@@ -319,7 +365,8 @@ def button_callback(update: Update, context: CallbackContext) -> None:
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         # Обновляем сообщение с новым состоянием игры
-        context.bot.edit_message_text(
+        rate_limiter.call(
+            update.effective_chat.id, context.bot.edit_message_text,
             chat_id=update.effective_chat.id,
             message_id=query.message.message_id,
             text=f"{game_text}\n\nСчёт: {game.score}",
@@ -329,11 +376,20 @@ def button_callback(update: Update, context: CallbackContext) -> None:
         # Сохраняем ID сообщения для будущих обновлений
         game.message_id = query.message.message_id
         game.chat_id = update.effective_chat.id
+        active_games.save(user_id)
         
         # Запускаем анимацию
-        animation_threads[user_id] = threading.Timer(0.5, start_animation, args=[user_id, context])
-        animation_threads[user_id].daemon = True
-        animation_threads[user_id].start()
+        schedule_animation(user_id, context)
+
+def register_handlers(dispatcher):
+    """Добавляет обработчики команд бота в диспетчер"""
+    dispatcher.add_handler(CommandHandler("start", start))
+    dispatcher.add_handler(CommandHandler("play", play_command))
+    dispatcher.add_handler(CallbackQueryHandler(button_callback))
+
+def session_stats():
+    """Возвращает статистику сессий и планировщика анимации процесса (для шардированного запуска)"""
+    return dict(active_games.stats(), animation=animation_scheduler.stats(), rate_limit=rate_limiter.stats())
 
 def main():
     """Запускает бота."""
@@ -346,23 +402,23 @@ def main():
         logger.error("Токен бота не найден в переменных окружения!")
         exit(1)
     
-    # Создаем Updater и передаем ему токен бота
-    updater = Updater(token)
-    
-    # Получаем диспетчер для регистрации обработчиков
-    dispatcher = updater.dispatcher
-    
-    # Добавляем обработчики команд
-    dispatcher.add_handler(CommandHandler("start", start))
-    dispatcher.add_handler(CommandHandler("play", play_command))
-    dispatcher.add_handler(CallbackQueryHandler(button_callback))
-    
     # Запускаем бота
     print("=" * 50)
     print("Запуск Telegram бота 'Блинная башня' с анимацией на основе эмодзи")
     print("=" * 50)
     print("\nБот запущен! Нажмите Ctrl+C для остановки.")
     
+    # С BOT_SHARDS > 1 пользователи распределяются между процессами-обработчиками
+    if BOT_SHARDS > 1:
+        run_sharded(token, register_handlers, BOT_SHARDS, session_stats)
+        return
+    
+    # Создаем Updater и передаем ему токен бота
+    updater = Updater(token)
+    
+    # Добавляем обработчики команд
+    register_handlers(updater.dispatcher)
+    
     # Запускаем бота
     updater.start_polling()
     
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Общий для всех игр кэш закодированных кадров "Блинной башни"
+
+Кадры адресуются хэшем состояния, от которого зависит картинка, поэтому
+одинаковые кадры разных игр (пустое поле, первый блин, конец игры с
+одинаковым счетом) кодируются один раз на процесс.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+# Ограничение памяти под закодированные кадры
+FRAME_CACHE_MAX_BYTES = int(os.getenv("FRAME_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+def state_key(*values):
+    """Возвращает канонический хэш набора значений состояния"""
+    return hashlib.blake2b(repr(values).encode(), digest_size=16).hexdigest()
+
+def extend_digest(digest, *values):
+    """Дополняет цепочку хэшей башни очередным блином"""
+    return hashlib.blake2b(digest + repr(values).encode(), digest_size=16).digest()
+
+class FrameCache:
+    """LRU-кэш закодированных кадров с ограничением по памяти"""
+
+    def __init__(self, max_bytes=FRAME_CACHE_MAX_BYTES):
+        """Создает пустой кэш на max_bytes байт"""
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Возвращает байты кадра по ключу или None"""
+        with self._lock:
+            data = self._frames.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+
+            self._frames.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def __contains__(self, key):
+        """Проверяет наличие кадра, не влияя на счетчики и порядок вытеснения"""
+        with self._lock:
+            return key in self._frames
+
+    def put(self, key, data):
+        """Сохраняет кадр, вытесняя самые давно использованные"""
+        # Кадр больше всего кэша не сохраняем
+        if len(data) > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._frames.pop(key, None)
+            if previous is not None:
+                self.size_bytes -= len(previous)
+
+            self._frames[key] = data
+            self.size_bytes += len(data)
+
+            while self.size_bytes > self.max_bytes:
+                _, evicted = self._frames.popitem(last=False)
+                self.size_bytes -= len(evicted)
+                self.evictions += 1
+
+    def get_or_render(self, key, render):
+        """Возвращает кадр из кэша или кодирует его через render() и сохраняет"""
+        data = self.get(key)
+        if data is None:
+            data = render()
+            self.put(key, data)
+
+        return data
+
+    def stats(self):
+        """Возвращает заполненность кэша и долю попаданий"""
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "frames": len(self._frames),
+                "size_bytes": self.size_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / requests if requests else 0.0,
+            }
+
+    def clear(self):
+        """Очищает кэш и сбрасывает счетчики"""
+        with self._lock:
+            self._frames.clear()
+            self.size_bytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+# Кэш кадров, общий для всех игр процесса
+frame_cache = FrameCache()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Кодирование кадров игры "Блинная башня" в памяти
+"""
+
+import io
+import os
+import threading
+import time
+from datetime import datetime
+from PIL import Image
+
+# Настройки кодирования кадров (можно переопределить переменными окружения)
+DEFAULT_ENCODER = os.getenv("FRAME_ENCODER", "png")
+PNG_COMPRESS_LEVEL = int(os.getenv("FRAME_PNG_COMPRESS_LEVEL", "6"))
+PALETTE_COLORS = int(os.getenv("FRAME_PALETTE_COLORS", "64"))
+JPEG_QUALITY = int(os.getenv("FRAME_JPEG_QUALITY", "85"))
+ENCODE_BUDGET_MS = float(os.getenv("FRAME_ENCODE_BUDGET_MS", "20"))
+
+class FrameEncoder:
+    """Кодировщик кадров в один из форматов Pillow"""
+
+    def __init__(self, name, image_format, extension, palette_colors=None, **options):
+        """Создает кодировщик с заданным форматом и параметрами сохранения"""
+        self.name = name
+        self.image_format = image_format
+        self.extension = extension
+        self.palette_colors = palette_colors
+        self.options = options
+
+    def encode(self, image):
+        """Кодирует кадр и возвращает байты"""
+        # Кадр состоит из нескольких плоских цветов, поэтому палитра
+        # почти не теряет качества, но заметно уменьшает размер и время сжатия
+        if self.palette_colors:
+            image = image.quantize(colors=self.palette_colors, method=Image.Quantize.FASTOCTREE)
+
+        buffer = io.BytesIO()
+        image.save(buffer, format=self.image_format, **self.options)
+        return buffer.getvalue()
+
+class AutoFrameEncoder:
+    """Выбирает кодировщик с наименьшим размером кадра в пределах бюджета времени
+
+    Выбор делается один раз, на образцовых кадрах sample_frames() (их
+    задает модуль игры), и дальше get_encoder("auto") возвращает выбранный
+    кодировщик: его имя попадает в ключи кэша кадров вместо "auto".
+    """
+
+    name = "auto"
+
+    def __init__(self, candidates, budget_ms=ENCODE_BUDGET_MS, repeat=3):
+        """Создает автоматический кодировщик из списка кандидатов"""
+        self.candidates = candidates
+        self.budget_ms = budget_ms
+        self.repeat = repeat
+        self.selected = None
+        self.measurements = None
+        self.sample_frames = None
+        self._lock = threading.Lock()
+
+    @property
+    def extension(self):
+        """Расширение файла выбранного кодировщика"""
+        return self.resolve().extension
+
+    def _calibrate(self, images):
+        """Замеряет кандидатов и запоминает лучший; вызывается под блокировкой"""
+        self.measurements = measure_encoders(images, self.candidates, self.repeat)
+        self.selected = select_encoder(self.measurements, self.budget_ms)
+
+    def calibrate(self, images):
+        """Замеряет кандидатов на переданных кадрах и выбирает лучший"""
+        with self._lock:
+            self._calibrate(images)
+            return self.selected
+
+    def resolve(self, images=None):
+        """Возвращает выбранный кодировщик, при первом вызове выбирая его
+
+        Выбор идет под блокировкой: одновременные первые кадры ждут один
+        замер, а не замеряют кандидатов каждый по-своему. Кадры для замера -
+        images, иначе sample_frames(); без них берется первый кандидат.
+        """
+        if self.selected is None:
+            with self._lock:
+                if self.selected is None:
+                    if images is None and self.sample_frames is not None:
+                        images = self.sample_frames()
+                    if not images:
+                        return self.candidates[0]
+                    self._calibrate(images)
+
+        return self.selected
+
+    def encode(self, image):
+        """Кодирует кадр выбранным кодировщиком; без образцовых кадров выбирает по этому кадру"""
+        return self.resolve([image] if self.sample_frames is None else None).encode(image)
+
+def measure_encoders(images, encoders, repeat=3):
+    """Возвращает средний размер (байт) и время (мс) кодирования для каждого кодировщика"""
+    measurements = []
+
+    for encoder in encoders:
+        total_size = 0
+        total_time = 0.0
+
+        for image in images:
+            for _ in range(repeat):
+                started = time.perf_counter()
+                data = encoder.encode(image)
+                total_time += time.perf_counter() - started
+                total_size += len(data)
+
+        count = len(images) * repeat
+        measurements.append({
+            "encoder": encoder,
+            "size": total_size / count,
+            "time_ms": total_time / count * 1000,
+        })
+
+    return measurements
+
+def select_encoder(measurements, budget_ms):
+    """Выбирает самый компактный кодировщик, укладывающийся в бюджет времени"""
+    within_budget = [m for m in measurements if m["time_ms"] <= budget_ms]
+
+    if within_budget:
+        return min(within_budget, key=lambda m: m["size"])["encoder"]
+
+    # Если в бюджет не укладывается никто, берем самый быстрый
+    return min(measurements, key=lambda m: m["time_ms"])["encoder"]
+
+# Доступные кодировщики кадров
+ENCODERS = {
+    "png": FrameEncoder("png", "PNG", "png", compress_level=PNG_COMPRESS_LEVEL),
+    "png-palette": FrameEncoder(
+        "png-palette", "PNG", "png",
+        palette_colors=PALETTE_COLORS, compress_level=PNG_COMPRESS_LEVEL
+    ),
+    "webp": FrameEncoder("webp", "WEBP", "webp", lossless=True),
+    "jpeg": FrameEncoder("jpeg", "JPEG", "jpg", quality=JPEG_QUALITY),
+}
+ENCODERS["auto"] = AutoFrameEncoder(list(ENCODERS.values()))
+
+def get_encoder(encoder=None):
+    """Возвращает кодировщик по имени или кодировщик по умолчанию (для auto - выбранный)"""
+    if encoder is None:
+        encoder = DEFAULT_ENCODER
+
+    if isinstance(encoder, str):
+        if encoder not in ENCODERS:
+            raise ValueError(f"Неизвестный кодировщик кадров: {encoder}")
+        encoder = ENCODERS[encoder]
+
+    # В режиме auto возвращается уже выбранный кодировщик
+    if isinstance(encoder, AutoFrameEncoder):
+        return encoder.resolve()
+
+    return encoder
+
+def encode_frame(image, encoder=None):
+    """Кодирует кадр выбранным кодировщиком и возвращает байты"""
+    return get_encoder(encoder).encode(image)
+
+def frame_stream(data, name="game.png"):
+    """Оборачивает байты кадра в BytesIO для InputMediaPhoto / reply_photo"""
+    # Telegram определяет тип файла по содержимому, а имя берет из атрибута name.
+    # Поток можно отправлять повторно, вернув позицию в начало через seek(0)
+    stream = io.BytesIO(data)
+    stream.name = name
+    return stream
+
+def save_frame(data, directory="temp", extension="png"):
+    """Сохраняет байты кадра во временный файл и возвращает путь к нему"""
+    os.makedirs(directory, exist_ok=True)
+
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S%f")
+    image_path = os.path.join(directory, f"game_{timestamp}.{extension}")
+    with open(image_path, "wb") as f:
+        f.write(data)
+
+    return image_path
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Подстройка частоты кадров анимации "Блинной башни"
+
+У каждой игры свой интервал между кадрами. Он не меньше, чем занимают
+отрисовка кадра и ответ Telegram на обновление сообщения (с запасом),
+и держится в границах ANIMATION_MIN_INTERVAL..ANIMATION_MAX_INTERVAL.
+Нижняя граница не меньше интервала, который выдерживает бюджет чата в
+rate_limit: чаще кадры все равно не ушли бы.
+Пока кадры уходят быстро, интервал понемногу сокращается; отказ по
+бюджету чата или ответ 429 увеличивает его вдвое, а когда общий бюджет
+бота почти израсходован, интервалы всех игр растут заранее, не дожидаясь
+отказов.
+"""
+
+import os
+
+from rate_limit import TELEGRAM_CHAT_RATE
+
+# Границы интервала между кадрами одной игры (секунды)
+ANIMATION_MIN_INTERVAL = max(float(os.getenv("ANIMATION_MIN_INTERVAL", "0.2")), 1 / TELEGRAM_CHAT_RATE)
+ANIMATION_MAX_INTERVAL = float(os.getenv("ANIMATION_MAX_INTERVAL", "5.0"))
+
+# Во сколько раз интервал больше времени отрисовки и ответа Telegram
+LATENCY_HEADROOM = 1.5
+
+# Вес нового замера в сглаженных задержках
+LATENCY_SMOOTHING = 0.3
+
+# На сколько секунд интервал сокращается после каждого удачного кадра
+RECOVERY_STEP = 0.1
+
+# Доля израсходованного общего бюджета, с которой интервалы начинают расти,
+# и во сколько раз они растут за кадр
+LOAD_THRESHOLD = 0.5
+LOAD_BACKOFF = 1.25
+
+class FramePacer:
+    """Интервал между кадрами одной игры по задержкам и отказам Telegram"""
+
+    __slots__ = ("interval", "latency", "render", "min_interval", "max_interval")
+
+    def __init__(self, min_interval=ANIMATION_MIN_INTERVAL, max_interval=ANIMATION_MAX_INTERVAL):
+        """Создает подстройщик с наименьшим интервалом"""
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.latency = None
+        self.render = None
+
+    def _clamp(self, interval):
+        """Возвращает интервал в границах"""
+        return min(self.max_interval, max(self.min_interval, interval))
+
+    def observe(self, latency, render=0.0, load=0.0):
+        """Учитывает отправленный кадр: время ответа Telegram, отрисовки и загрузку общего бюджета"""
+        if self.latency is None:
+            self.latency, self.render = latency, render
+        else:
+            self.latency += (latency - self.latency) * LATENCY_SMOOTHING
+            self.render += (render - self.render) * LATENCY_SMOOTHING
+
+        if load >= LOAD_THRESHOLD:
+            interval = self.interval * LOAD_BACKOFF
+        else:
+            interval = self.interval - RECOVERY_STEP
+
+        # Новый кадр не отправляется, пока предыдущий еще в пути
+        floor = (self.latency + self.render) * LATENCY_HEADROOM
+        self.interval = self._clamp(max(interval, floor))
+
+    def backoff(self, wait=0.0):
+        """Учитывает отказ по бюджету или ответ 429: интервал растет вдвое, но не меньше wait"""
+        self.interval = self._clamp(max(self.interval * 2, wait))
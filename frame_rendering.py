@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Способы отрисовки кадров игры "Блинная башня": PIL и NumPy
+
+Все элементы кадра - готовые слои и маски, поэтому кадр можно собрать
+срезами массива (высота, ширина, 3) вместо вставок PIL. Кадры обоих
+способов совпадают попиксельно. NumPy необязателен: без него доступна
+только отрисовка через PIL.
+"""
+
+import os
+import threading
+from PIL import Image
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from render_cache import (
+    PANCAKE_WAVE_HALF_WIDTH, PANCAKE_WAVE_HEIGHT, get_base_layer, get_score_glyphs, pancake_sprites
+)
+
+# Способ отрисовки по умолчанию (можно переопределить переменной окружения)
+DEFAULT_RENDERER = os.getenv("FRAME_RENDERER", "pil")
+
+# Доступные способы отрисовки
+RENDERERS = ("pil", "numpy")
+
+NUMPY_AVAILABLE = np is not None
+
+def get_renderer(renderer=None):
+    """Возвращает имя способа отрисовки или способ по умолчанию"""
+    if renderer is None:
+        renderer = DEFAULT_RENDERER
+
+    if renderer not in RENDERERS:
+        raise ValueError(f"Неизвестный способ отрисовки кадров: {renderer}")
+    if renderer == "numpy" and not NUMPY_AVAILABLE:
+        raise RuntimeError("Для отрисовки кадров через NumPy установите пакет numpy")
+
+    return renderer
+
+# Базовые кадры и маски цифр в виде массивов, общие для всех игр процесса
+_base_arrays = {}
+_glyph_arrays = {}
+_arrays_lock = threading.Lock()
+
+def _base_array(game):
+    """Возвращает базовый кадр игры массивом, который только копируется"""
+    key = game._base_layer_key()
+    frame = _base_arrays.get(key)
+    if frame is None:
+        frame = np.array(get_base_layer(key, game._render_base_layer))
+        frame.flags.writeable = False
+        with _arrays_lock:
+            _base_arrays[key] = frame
+
+    return frame
+
+def _glyph_array(glyphs, digit):
+    """Возвращает маску цифры массивом uint16 для смешивания без переполнения"""
+    mask = _glyph_arrays.get(digit)
+    if mask is None:
+        mask = np.asarray(glyphs.digits[digit][0], dtype=np.uint16)
+        with _arrays_lock:
+            _glyph_arrays[digit] = mask
+
+    return mask
+
+def _clip(frame, mask, position):
+    """Возвращает срезы кадра и маски, вставленной в position, по их пересечению"""
+    x, y = position
+    height, width = mask.shape
+    left, top = max(x, 0), max(y, 0)
+    right, bottom = min(x + width, frame.shape[1]), min(y + height, frame.shape[0])
+
+    if left >= right or top >= bottom:
+        return None, None
+
+    return (slice(top, bottom), slice(left, right)), (slice(top - y, bottom - y), slice(left - x, right - x))
+
+def blend_mask(frame, mask, position, color, keep=None):
+    """Закрашивает кадр цветом через маску 0-255 так же, как Image.paste(color, position, mask)
+
+    keep - логическая маска размером с кадр: пиксели, которые не меняются.
+    """
+    area, part = _clip(frame, mask, position)
+    if area is None:
+        return
+
+    # Та же целочисленная формула смешивания, что и в Pillow
+    region = frame[area]
+    weights = mask[part][..., None]
+    blended = region * (255 - weights) + np.array(color, dtype=np.uint16) * weights + 128
+    blended = ((blended >> 8) + blended) >> 8
+
+    if keep is None:
+        region[...] = blended
+    else:
+        np.copyto(region, blended, where=~keep[area][..., None], casting="unsafe")
+
+def fill_mask(frame, mask, position, color):
+    """Закрашивает кадр цветом там, где логическая маска истинна"""
+    area, part = _clip(frame, mask, position)
+    if area is not None:
+        frame[area][mask[part]] = color
+
+def paste_pancake(frame, x, y, width, height, color, wave_count):
+    """Рисует блин с волнистыми краями по маске из атласа спрайтов"""
+    mask = np.asarray(pancake_sprites.get(x, width, height, wave_count))
+    fill_mask(frame, mask, (x - PANCAKE_WAVE_HALF_WIDTH, y - PANCAKE_WAVE_HEIGHT), color)
+
+def _static_frame(game):
+    """Возвращает базовый кадр с башней и маску башни
+
+    Башня меняется только при броске, поэтому кадр собирается один раз
+    после каждого броска и дальше только копируется.
+    """
+    tower = game._ensure_tower_layer()
+    if tower is None:
+        return _base_array(game), None
+
+    # Слой не меняется после сохранения в игре, поэтому число его блинов
+    # однозначно определяет собранный по нему кадр
+    cached = game._tower_arrays
+    if cached is not None and cached[0] == tower.count:
+        return cached[1], cached[2]
+
+    # Слой занимает только прямоугольник башни: переносим его на кадр целиком
+    left, top, right, bottom = tower.box
+    mask = np.zeros((game.height, game.width), dtype=bool)
+    mask[top:bottom, left:right] = np.asarray(tower.mask)
+    frame = _base_array(game).copy()
+    np.copyto(frame[top:bottom, left:right], np.asarray(tower.image), where=mask[top:bottom, left:right, None])
+
+    game._tower_arrays = (tower.count, frame, mask)
+    return frame, mask
+
+def to_image(frame):
+    """Превращает массив кадра в изображение PIL для кодировщиков"""
+    # Pillow хранит RGB по 4 байта на пиксель, поэтому копия здесь неизбежна
+    return Image.fromarray(frame)
+
+def render_static_array(game):
+    """Отрисовывает фон, счет и башню игры в массив (высота, ширина, 3)"""
+    static, tower_mask = _static_frame(game)
+    frame = static.copy()
+
+    # Счет: цифры смешиваются с кругом по своим маскам сглаживания.
+    # Башня рисуется поверх счета, поэтому ее пиксели не трогаем
+    glyphs = get_score_glyphs()
+    text = str(game.score)
+    for digit, position in glyphs.layout(text, game._score_position(glyphs, text)):
+        blend_mask(frame, _glyph_array(glyphs, digit), position, (0, 0, 0), keep=tower_mask)
+
+    return frame
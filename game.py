@@ -1,11 +1,36 @@
-import os
 import random
-from PIL import Image, ImageDraw, ImageFont
-from datetime import datetime
+from PIL import Image, ImageDraw
+
+from frame_cache import extend_digest, frame_cache, state_key
+from frame_encoding import ENCODERS, frame_stream, get_encoder, save_frame
+from frame_rendering import get_renderer, render_static_array, to_image
+from game_state import PANCAKE_COLORS, Tower
+from render_cache import TowerLayer, get_base_layer, get_score_glyphs, pancake_sprites
+from resolution import get_profile, scale_frame
 
 class PancakeGame:
     """Класс для игры 'Блинная башня'"""
     
+    # Параметры игрового поля, общие для всех игр
+    width = 600
+    height = 800
+    bg_color = (255, 255, 255)
+    
+    # Параметры тарелки
+    plate_y = height - 100  # Позиция тарелки
+    plate_width = 300
+    plate_height = 30
+    plate_color = (255, 150, 120)  # Цвет тарелки (розовый)
+    
+    # Цвета блинов (от светлого к темному)
+    pancake_colors = PANCAKE_COLORS
+    
+    __slots__ = (
+        "score", "game_over", "message_id", "chat_id", "pancakes",
+        "current_pancake_x", "current_pancake_width",
+        "_tower_layer", "_tower_digest", "_tower_arrays",
+    )
+    
     def __init__(self):
         """Инициализация новой игры"""
         # Базовые параметры игры
@@ -14,33 +39,24 @@ class PancakeGame:
         self.message_id = None
         self.chat_id = None
         
-        # Параметры игрового поля
-        self.width = 600
-        self.height = 800
-        self.bg_color = (255, 255, 255)
-        
-        # Параметры блинов
-        self.pancakes = []
-        self.plate_y = self.height - 100  # Позиция тарелки
-        self.plate_width = 300
-        self.plate_height = 30
-        self.plate_color = (255, 150, 120)  # Цвет тарелки (розовый)
+        # Уложенные блины, хранящиеся столбцами
+        self.pancakes = Tower()
         
         # Параметры для падающего блина
         self.current_pancake_x = None
         self.current_pancake_width = None
         
-        # Цвета блинов (от светлого к темному)
-        self.pancake_colors = [
-            (255, 220, 50),   # Светло-желтый
-            (255, 200, 50),   # Желтый
-            (255, 180, 50),   # Темно-желтый
-            (255, 160, 50),   # Оранжево-желтый
-            (255, 140, 50),   # Светло-оранжевый
-        ]
+        # Слой башни (render_cache.TowerLayer): уложенные блины и их маска
+        # размером с башню. Слой создается при первой отрисовке и заменяется
+        # расширенным, когда появляются блины, уложенные после прошлой
+        self._tower_layer = None
         
-        # Создаем директорию для временных файлов, если её нет
-        os.makedirs("temp", exist_ok=True)
+        # Цепочка хэшей уложенных блинов для ключа в кэше кадров
+        self._tower_digest = b""
+        
+        # Кадр с башней без счета и маска башни для отрисовки через NumPy
+        # вместе с числом блинов слоя, по которому они собраны
+        self._tower_arrays = None
     
     def drop_pancake(self):
         """Добавляет новый блин в башню"""
@@ -114,6 +130,9 @@ class PancakeGame:
             "color": pancake_color
         })
         
+        # Дополняем хэш башни новым блином
+        self._add_to_tower_layer(self.pancakes[-1])
+        
         # Увеличиваем счет
         self.score += 1
         
@@ -124,17 +143,80 @@ class PancakeGame:
         
         return False
     
-    def generate_game_image(self):
-        """Генерирует изображение текущего состояния игры"""
-        # Создаем новое изображение
+    def generate_game_image(self, to_file=False, encoder=None, profile=None):
+        """Генерирует изображение текущего состояния игры
+        
+        По умолчанию возвращает BytesIO с кадром, который можно сразу передать
+        в InputMediaPhoto или reply_photo. С to_file=True сохраняет кадр
+        в директорию temp/ и возвращает путь к файлу. encoder - имя
+        кодировщика из frame_encoding.ENCODERS, по умолчанию FRAME_ENCODER.
+        profile - профиль разрешения из resolution.PROFILES или auto,
+        по умолчанию FRAME_PROFILE.
+        """
+        encoder = get_encoder(encoder)
+        profile = get_profile(profile)
+        
+        # Одинаковые кадры разных игр кодируются один раз на процесс
+        data = frame_cache.get_or_render(
+            self.frame_key(encoder, profile=profile),
+            lambda: self.encode_frame(encoder, profile)
+        )
+        
+        if to_file:
+            return save_frame(data, extension=encoder.extension)
+        
+        return frame_stream(data, name=f"game.{encoder.extension}")
+    
+    def encode_frame(self, encoder=None, profile=None):
+        """Отрисовывает и кодирует текущий кадр"""
+        return get_encoder(encoder).encode(scale_frame(self.render_image(), get_profile(profile)))
+    
+    def frame_key(self, encoder=None, profile=None):
+        """Возвращает хэш всего, что влияет на закодированный кадр"""
+        return state_key(
+            type(self).__module__, self.width, self.height, self._tower_digest,
+            self.score, self.game_over, get_encoder(encoder).name, get_profile(profile)
+        )
+    
+    def render_image(self, renderer=None):
+        """Отрисовывает текущее состояние игры и возвращает изображение PIL
+        
+        renderer - способ отрисовки из frame_rendering.RENDERERS,
+        по умолчанию FRAME_RENDERER.
+        """
+        if get_renderer(renderer) == "numpy":
+            return to_image(render_static_array(self))
+        
+        # Начинаем с копии заранее отрисованного фона с кругом для счета и тарелкой
+        image = get_base_layer(self._base_layer_key(), self._render_base_layer).copy()
+        
+        # Рисуем счет в центре верхней части
+        self._draw_score(image)
+        
+        # Накладываем слой башни одной операцией, независимо от её высоты
+        tower = self._ensure_tower_layer()
+        if tower is not None:
+            tower.paste_onto(image)
+        
+        return image
+    
+    def _base_layer_key(self):
+        """Возвращает ключ базового кадра: размер холста и палитра"""
+        return (
+            self.width, self.height, self.bg_color,
+            self.plate_y, self.plate_width, self.plate_height, self.plate_color
+        )
+    
+    def _render_base_layer(self):
+        """Отрисовывает фон, круг для счета и тарелку, которые не меняются в течение игры"""
         image = Image.new("RGB", (self.width, self.height), self.bg_color)
         draw = ImageDraw.Draw(image)
         
         # Добавляем декоративные элементы фона (как на скриншотах)
         self._draw_background(draw)
         
-        # Рисуем счет в центре верхней части
-        self._draw_score(draw)
+        # Рисуем круг для счета
+        self._draw_score_circle(draw)
         
         # Рисуем тарелку
         plate_x = (self.width - self.plate_width) // 2
@@ -144,16 +226,7 @@ class PancakeGame:
             outline=None
         )
         
-        # Рисуем все блины в башне
-        for pancake in self.pancakes:
-            self._draw_pancake(draw, pancake)
-        
-        # Сохраняем изображение во временный файл
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S%f")
-        image_path = f"temp/game_{timestamp}.png"
-        image.save(image_path)
-        
-        return image_path
+        return image
     
     def _draw_background(self, draw):
         """Рисует декоративные элементы фона"""
@@ -183,9 +256,8 @@ class PancakeGame:
         for i in range(len(points) - 1):
             draw.line([points[i], points[i+1]], fill=light_blue, width=3)
     
-    def _draw_score(self, draw):
-        """Рисует счет в центре верхней части экрана"""
-        # Создаем круг для счета
+    def _draw_score_circle(self, draw):
+        """Рисует круг для счета в центре верхней части экрана"""
         circle_radius = 50
         circle_center = (self.width // 2, 200)
         draw.ellipse(
@@ -195,53 +267,70 @@ class PancakeGame:
             fill=(255, 255, 255),
             width=2
         )
-        
-        # Рисуем текст счета
-        # Примечание: в реальном приложении нужно установить шрифт
-        # Здесь используем стандартный шрифт
-        try:
-            font = ImageFont.truetype("arial.ttf", 36)
-        except IOError:
-            font = ImageFont.load_default()
-        
-        # Центрируем текст
+    
+    def _draw_score(self, image):
+        """Рисует счет в центре верхней части экрана"""
+        # Круг уже есть на базовом кадре, остается наложить готовые цифры
+        glyphs = get_score_glyphs()
         text = str(self.score)
-        
-        # В новых версиях Pillow используем get_text_width вместо textlength
-        try:
-            # Для новых версий Pillow
-            text_bbox = font.getbbox(text)
-            text_width = text_bbox[2] - text_bbox[0]
-        except AttributeError:
-            try:
-                # Для более старых версий Pillow
-                text_width = draw.textlength(text, font=font)
-            except AttributeError:
-                # Для еще более старых версий
-                text_width = font.getsize(text)[0]
-        
-        text_position = (circle_center[0] - text_width // 2, circle_center[1] - 18)
-        
-        draw.text(text_position, text, fill=(0, 0, 0), font=font)
+        glyphs.paste(image, text, self._score_position(glyphs, text), (0, 0, 0))
     
-    def _draw_pancake(self, draw, pancake):
-        """Рисует блин с волнистыми краями"""
-        x, y, width, height, color = pancake["x"], pancake["y"], pancake["width"], pancake["height"], pancake["color"]
+    def _score_position(self, glyphs, text):
+        """Возвращает позицию текста счета, отцентрированного в круге"""
+        circle_center = (self.width // 2, 200)
+        text_width = glyphs.text_width(text)
+        return (circle_center[0] - text_width // 2, circle_center[1] - 18)
+    
+    def _add_to_tower_layer(self, pancake):
+        """Дополняет хэш башни уложенным блином; на слой он попадет при отрисовке"""
+        self._tower_digest = extend_digest(
+            self._tower_digest,
+            pancake["x"], pancake["y"], pancake["width"], pancake["height"], pancake["color"]
+        )
+    
+    def _ensure_tower_layer(self):
+        """Возвращает слой башни размером с башню, дорисовав блины, уложенные после прошлой отрисовки"""
+        tower = self._tower_layer
+        count = len(self.pancakes)
+        drawn = 0 if tower is None else tower.count
+        if drawn >= count:
+            return tower
+        
+        pancakes = self.pancakes[drawn:count]
+        tower = TowerLayer.extend(tower, pancakes, (self.width, self.height))
+        for pancake in pancakes:
+            self._draw_pancake(tower.image, pancake, mask_image=tower.mask, origin=tower.origin)
+        tower.count = count
+        
+        self._tower_layer = tower
+        return tower
+    
+    def release_frames(self):
+        """Освобождает слой башни; он восстановится при следующей отрисовке"""
+        self._tower_layer = self._tower_arrays = None
+    
+    def frame_memory(self):
+        """Возвращает, сколько байт занимают кадры и слои, которые держит игра"""
+        tower, arrays = self._tower_layer, self._tower_arrays
+        tower_bytes = 0 if tower is None else tower.nbytes
+        arrays_bytes = 0 if arrays is None else arrays[1].nbytes + arrays[2].nbytes
+        return tower_bytes + arrays_bytes
+    
+    def _draw_pancake(self, image, pancake, mask_image=None, origin=(0, 0)):
+        """Рисует блин с волнистыми краями одной вставкой готового спрайта
         
-        # Основная форма блина
-        draw.rectangle([(x, y), (x + width, y + height)], fill=color)
+        origin - положение левого верхнего угла image на кадре (для слоя башни).
+        """
+        x, y, width, height = pancake["x"], pancake["y"], pancake["width"], pancake["height"]
+        color = pancake["color"]
         
-        # Добавляем волнистые края (верхний и нижний)
-        wave_height = 4
-        wave_count = width // 20  # Количество волн зависит от ширины блина
+        # Количество волн зависит от ширины блина
+        wave_count = width // 20
         
-        for i in range(wave_count + 1):
-            wave_x = x + (width / wave_count) * i
-            
-            # Верхняя волна
-            if i % 2 == 0:
-                draw.rectangle([(wave_x - 5, y - wave_height), (wave_x + 5, y)], fill=color)
-            
-            # Нижняя волна
-            if i % 2 == 1:
-                draw.rectangle([(wave_x - 5, y + height), (wave_x + 5, y + height + wave_height)], fill=color) 
\ No newline at end of file
+        pancake_sprites.paste(
+            image, x, y, width, height, color, wave_count, mask_image=mask_image, origin=origin
+        )
+
+# Кодировщик auto выбирается по начальному кадру игры, один раз на процесс
+if ENCODERS["auto"].sample_frames is None:
+    ENCODERS["auto"].sample_frames = lambda: [PancakeGame().render_image()]
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Двоичные снимки игр "Блинная башня"
+
+Снимок - несколько десятков байт, упакованных struct: заголовок с версией
+формата и видом игры, общие поля (чат, сообщение, счет), движущийся блин
+вместе с фазой его движения и блины башни записями фиксированной длины.
+По снимку игру можно сохранить, передать в другой процесс или восстановить
+для отрисовки кадра. Хэш башни при загрузке пересчитывается, а слои
+дорисовываются при первой отрисовке.
+"""
+
+import importlib
+import os
+import struct
+import sys
+
+# Версия формата: при изменении записей она увеличивается, а чтение
+# прежних версий остается в _READERS
+SNAPSHOT_VERSION = 1
+
+# Метка снимка, версия формата и вид игры
+_HEADER = struct.Struct("<2sBB")
+_MAGIC = b"PT"
+
+# Чат, сообщение, счет, флаги и число блинов в башне
+_COMMON = struct.Struct("<qqIBH")
+
+# Флаги общих полей
+_GAME_OVER = 1
+_HAS_CHAT = 2
+_HAS_MESSAGE = 4
+_PRECOMPUTE_CYCLE = 8
+
+# Движущийся и уложенный блин игры с картинками: координаты, размеры, цвет,
+# а у движущегося еще скорость, начальное положение, момент появления
+# и число шагов зацикленной анимации (0 - анимации нет)
+_MOVING = struct.Struct("<hhhhbB3BhbdH")
+_PANCAKE = struct.Struct("<hhhh3B")
+
+# Движущийся и уложенный блин игры на эмодзи
+_EMOJI_MOVING = struct.Struct("<hhbhbd")
+_EMOJI_PANCAKE = struct.Struct("<hh")
+
+# Виды игр: номер в снимке, модуль и класс. Модуль импортируется только
+# при загрузке снимка, поэтому для отрисовки не нужен модуль бота
+GAME_KINDS = {
+    1: ("pancake_game", "PancakeGame"),
+    2: ("emoji_animated_bot", "EmojiPancakeGame"),
+    3: ("game", "PancakeGame"),
+}
+_KIND_NUMBERS = {location: kind for kind, location in GAME_KINDS.items()}
+
+def _dump_common(game, flags=0):
+    """Упаковывает поля, общие для всех видов игр"""
+    if game.game_over:
+        flags |= _GAME_OVER
+    if game.chat_id is not None:
+        flags |= _HAS_CHAT
+    if game.message_id is not None:
+        flags |= _HAS_MESSAGE
+
+    return _COMMON.pack(
+        game.chat_id or 0, game.message_id or 0, game.score, flags, len(game.pancakes)
+    )
+
+def _load_common(game, data, offset):
+    """Читает общие поля в игру, возвращает флаги, число блинов и смещение"""
+    chat_id, message_id, score, flags, count = _COMMON.unpack_from(data, offset)
+    game.chat_id = chat_id if flags & _HAS_CHAT else None
+    game.message_id = message_id if flags & _HAS_MESSAGE else None
+    game.score = score
+    game.game_over = bool(flags & _GAME_OVER)
+    return flags, count, offset + _COMMON.size
+
+def _load_tower(game, data, offset, count):
+    """Читает блины башни игры с картинками и дополняет ими хэш башни"""
+    end = offset + count * _PANCAKE.size
+    for x, y, width, height, red, green, blue in _PANCAKE.iter_unpack(data[offset:end]):
+        pancake = {"x": x, "y": y, "width": width, "height": height, "color": (red, green, blue)}
+        game.pancakes.append(pancake)
+        game._add_to_tower_layer(pancake)
+
+    return end
+
+def _dump_tower(game):
+    """Упаковывает блины башни игры с картинками"""
+    return b"".join(
+        _PANCAKE.pack(pancake["x"], pancake["y"], pancake["width"], pancake["height"], *pancake["color"])
+        for pancake in game.pancakes
+    )
+
+def _dump_pancake_game(game):
+    """Упаковывает игру с движущимся блином (pancake_game.PancakeGame)"""
+    flags = _PRECOMPUTE_CYCLE if game.precompute_cycle else 0
+    pancake = game.current_pancake
+    moving = _MOVING.pack(
+        pancake["x"], pancake["y"], pancake["width"], pancake["height"],
+        pancake["direction"], pancake["speed"], *pancake["color"],
+        pancake["start_x"], pancake["start_direction"], pancake["spawn_time"],
+        game._animation_loop or 0,
+    )
+    return _dump_common(game, flags) + moving + _dump_tower(game)
+
+def _load_pancake_game(game, data, offset):
+    """Читает игру с движущимся блином (pancake_game.PancakeGame)"""
+    flags, count, offset = _load_common(game, data, offset)
+    (x, y, width, height, direction, speed, red, green, blue,
+     start_x, start_direction, spawn_time, animation_loop) = _MOVING.unpack_from(data, offset)
+
+    game.current_pancake.update(
+        x=x, y=y, width=width, height=height, direction=direction, speed=speed,
+        color=(red, green, blue), start_x=start_x, start_direction=start_direction,
+        spawn_time=spawn_time,
+    )
+    game._animation_loop = animation_loop or None
+    game.precompute_cycle = bool(flags & _PRECOMPUTE_CYCLE)
+
+    return _load_tower(game, data, offset + _MOVING.size, count)
+
+def _dump_emoji_game(game):
+    """Упаковывает игру на эмодзи"""
+    pancake = game.current_pancake
+    moving = _EMOJI_MOVING.pack(
+        pancake["x"], pancake["width"], pancake["direction"],
+        pancake["start_x"], pancake["start_direction"], pancake["spawn_time"],
+    )
+    tower = b"".join(_EMOJI_PANCAKE.pack(pancake["x"], pancake["width"]) for pancake in game.pancakes)
+    return _dump_common(game) + moving + tower
+
+def _load_emoji_game(game, data, offset):
+    """Читает игру на эмодзи"""
+    _, count, offset = _load_common(game, data, offset)
+    x, width, direction, start_x, start_direction, spawn_time = _EMOJI_MOVING.unpack_from(data, offset)
+    game.current_pancake = {
+        "x": x, "width": width, "direction": direction,
+        "start_x": start_x, "start_direction": start_direction, "spawn_time": spawn_time,
+    }
+
+    offset += _EMOJI_MOVING.size
+    end = offset + count * _EMOJI_PANCAKE.size
+    game.pancakes = [
+        {"x": x, "width": width} for x, width in _EMOJI_PANCAKE.iter_unpack(data[offset:end])
+    ]
+    return end
+
+def _dump_static_game(game):
+    """Упаковывает игру без движущегося блина (game.PancakeGame)"""
+    return _dump_common(game) + _dump_tower(game)
+
+def _load_static_game(game, data, offset):
+    """Читает игру без движущегося блина (game.PancakeGame)"""
+    _, count, offset = _load_common(game, data, offset)
+    return _load_tower(game, data, offset, count)
+
+# Упаковка и чтение по видам игр; чтение - по версии формата и виду
+_WRITERS = {1: _dump_pancake_game, 2: _dump_emoji_game, 3: _dump_static_game}
+_READERS = {
+    (1, 1): _load_pancake_game,
+    (1, 2): _load_emoji_game,
+    (1, 3): _load_static_game,
+}
+
+# Имена, под которыми живет модуль, запущенный как скрипт: в процессах,
+# запущенных через spawn (sharding), он импортируется как __mp_main__
+_MAIN_MODULES = ("__main__", "__mp_main__")
+
+def _main_module_name():
+    """Возвращает имя модуля, запущенного как скрипт: бот может держать игры в __main__"""
+    path = getattr(sys.modules["__main__"], "__file__", None)
+    return os.path.splitext(os.path.basename(path))[0] if path else None
+
+def _import_game_module(module):
+    """Импортирует модуль игры, не загружая второй раз модуль, запущенный как скрипт"""
+    if module == _main_module_name():
+        return sys.modules["__main__"]
+    return importlib.import_module(module)
+
+def dump_game(game):
+    """Возвращает двоичный снимок игры"""
+    module = type(game).__module__
+    if module in _MAIN_MODULES:
+        module = _main_module_name()
+
+    kind = _KIND_NUMBERS.get((module, type(game).__name__))
+    if kind is None:
+        raise TypeError(f"Снимок игры {type(game).__name__} не поддерживается")
+
+    return _HEADER.pack(_MAGIC, SNAPSHOT_VERSION, kind) + _WRITERS[kind](game)
+
+def load_game(data):
+    """Восстанавливает игру из двоичного снимка"""
+    data = memoryview(data)
+    if len(data) < _HEADER.size:
+        raise ValueError("Снимок игры обрезан")
+
+    magic, version, kind = _HEADER.unpack_from(data)
+    if magic != _MAGIC:
+        raise ValueError("Это не снимок игры")
+
+    reader = _READERS.get((version, kind))
+    if reader is None:
+        raise ValueError(f"Неизвестная версия {version} или вид {kind} снимка игры")
+
+    module, class_name = GAME_KINDS[kind]
+    game = getattr(_import_game_module(module), class_name)()
+    try:
+        end = reader(game, data, _HEADER.size)
+    except struct.error as error:
+        raise ValueError("Снимок игры обрезан") from error
+
+    if end != len(data):
+        raise ValueError("Снимок игры обрезан")
+
+    return game
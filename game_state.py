@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Компактное состояние игры "Блинная башня"
+
+Десятки тысяч одновременных игр держат в памяти в основном свои блины.
+Здесь башня хранится столбцами в массивах array('h') с индексом цвета
+в общей палитре, а движущийся блин - объектом со __slots__. Снаружи и то,
+и другое выглядит как прежде: блин башни - словарь, движущийся блин
+поддерживает pancake["x"], get(), update() и dict(pancake).
+"""
+
+import threading
+from array import array
+
+# Цвета блинов (от светлого к темному), общие для всех игр
+PANCAKE_COLORS = (
+    (255, 220, 50),   # Светло-желтый
+    (255, 200, 50),   # Желтый
+    (255, 180, 50),   # Темно-желтый
+    (255, 160, 50),   # Оранжево-желтый
+    (255, 140, 50),   # Светло-оранжевый
+)
+
+# Палитра, по индексам которой башня хранит цвета. Незнакомый цвет
+# (например, из снимка состояния) добавляется в конец
+_palette = list(PANCAKE_COLORS)
+_palette_indices = {color: index for index, color in enumerate(_palette)}
+_palette_lock = threading.Lock()
+
+def palette_index(color):
+    """Возвращает индекс цвета в общей палитре, добавляя новый цвет при необходимости"""
+    color = tuple(color)
+    index = _palette_indices.get(color)
+    if index is None:
+        with _palette_lock:
+            index = _palette_indices.get(color)
+            if index is None:
+                if len(_palette) > 255:
+                    raise ValueError("В палитре блинов не больше 256 цветов")
+                index = len(_palette)
+                _palette.append(color)
+                _palette_indices[color] = index
+
+    return index
+
+def palette_color(index):
+    """Возвращает цвет по индексу в общей палитре"""
+    return _palette[index]
+
+class Tower:
+    """Уложенные блины, хранящиеся столбцами
+
+    Индексация и перебор возвращают блины словарями с ключами
+    x, y, width, height и color, как раньше возвращал список словарей.
+    """
+
+    __slots__ = ("x", "y", "width", "height", "color")
+
+    def __init__(self):
+        """Создает пустую башню"""
+        self.x = array("h")
+        self.y = array("h")
+        self.width = array("h")
+        self.height = array("h")
+        self.color = array("B")
+
+    def __len__(self):
+        """Возвращает число блинов в башне"""
+        return len(self.x)
+
+    def __getitem__(self, index):
+        """Возвращает блин словарем, а для среза - список словарей"""
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        return {
+            "x": self.x[index],
+            "y": self.y[index],
+            "width": self.width[index],
+            "height": self.height[index],
+            "color": _palette[self.color[index]],
+        }
+
+    def __iter__(self):
+        """Перебирает блины снизу вверх"""
+        for index in range(len(self)):
+            yield self[index]
+
+    def append(self, pancake):
+        """Кладет блин на верх башни"""
+        self.x.append(pancake["x"])
+        self.y.append(pancake["y"])
+        self.width.append(pancake["width"])
+        self.height.append(pancake["height"])
+        self.color.append(palette_index(pancake["color"]))
+
+class MovingPancake:
+    """Движущийся блин: поля в __slots__, доступ как к словарю"""
+
+    FIELDS = (
+        "x", "y", "width", "height", "direction", "speed", "color",
+        "start_x", "start_direction", "spawn_time",
+    )
+    __slots__ = FIELDS
+
+    def __init__(self, **fields):
+        """Создает блин из полей FIELDS"""
+        self.update(fields)
+
+    def __getitem__(self, key):
+        """Возвращает поле блина"""
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        """Меняет поле блина"""
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __iter__(self):
+        """Перебирает имена полей, как словарь"""
+        return iter(self.FIELDS)
+
+    def __len__(self):
+        """Возвращает число полей"""
+        return len(self.FIELDS)
+
+    def keys(self):
+        """Возвращает имена полей, чтобы работал dict(pancake)"""
+        return self.FIELDS
+
+    def get(self, key, default=None):
+        """Возвращает поле блина или default"""
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def update(self, fields=(), **more):
+        """Меняет поля блина из словаря или пар (поле, значение)"""
+        items = fields.items() if hasattr(fields, "items") else fields
+        for key, value in items:
+            self[key] = value
+        for key, value in more.items():
+            self[key] = value
+
+    def __repr__(self):
+        """Показывает блин как словарь"""
+        return repr(dict(self))
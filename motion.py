@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Движение блина "Блинной башни" как чистая функция времени
+
+Блин сдвигается на speed каждый шаг и, упершись в край поля, встает
+вплотную к нему и разворачивается. Такое движение вычисляется по номеру шага
+без пошагового моделирования, поэтому положение блина не нужно обновлять
+по таймеру: оно считается в момент отрисовки или броска.
+"""
+
+def _steps_to_wall(start_x, direction, speed, travel):
+    """Возвращает номер шага, на котором блин впервые упирается в край поля"""
+    distance = travel - start_x if direction > 0 else start_x
+    # Блин, уже стоящий у края, все равно тратит шаг на разворот
+    return max(1, -(-distance // speed))
+
+def _steps_per_leg(speed, travel):
+    """Возвращает число шагов на путь от одного края поля до другого"""
+    return max(1, -(-travel // speed))
+
+def bounce_state(start_x, direction, speed, travel, steps):
+    """Возвращает положение и направление блина через steps шагов
+
+    travel - наибольшая координата блина: ширина поля минус ширина блина.
+    """
+    if speed <= 0:
+        return start_x, direction
+
+    first_wall = _steps_to_wall(start_x, direction, speed, travel)
+    if steps < first_wall:
+        return start_x + direction * steps * speed, direction
+
+    # Дальше блин ходит от края до края: на четных отрезках - обратно
+    # исходному направлению, на нечетных - в исходном
+    leg, step = divmod(steps - first_wall, _steps_per_leg(speed, travel))
+    if leg % 2 == 0:
+        direction = -direction
+
+    wall_x = travel if direction < 0 else 0
+    return wall_x + direction * step * speed, direction
+
+def loop_steps(start_x, direction, speed, travel):
+    """Возвращает число шагов, после которого движение повторяется с конца разгона
+
+    Это путь до первого края и полный круг от края до края и обратно.
+    """
+    if speed <= 0:
+        return 1
+
+    return _steps_to_wall(start_x, direction, speed, travel) + 2 * _steps_per_leg(speed, travel)
+
+def pancake_position(spawn_time, start_x, direction, speed, width, board_width, now,
+                     step_interval, loop=None):
+    """Возвращает положение и направление движущегося блина в момент now
+
+    Блин появился в точке start_x в момент spawn_time и сдвигается на speed
+    каждые step_interval секунд. loop - число шагов зацикленной анимации,
+    если движение показывается ею и начинается заново после каждого круга.
+    """
+    steps = int(max(0.0, now - spawn_time) / step_interval)
+    if loop:
+        steps %= loop
+
+    return bounce_state(start_x, direction, speed, board_width - width, steps)
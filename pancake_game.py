@@ -5,81 +5,249 @@
 Игра "Блинная башня" с правильной механикой движения блинов
 """
 
+import io
 import os
 import random
 import math
-from PIL import Image, ImageDraw, ImageFont
-from datetime import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageDraw
+
+from frame_cache import extend_digest, frame_cache, state_key
+from frame_encoding import ENCODERS, frame_stream, get_encoder, save_frame
+from frame_rendering import get_renderer, paste_pancake, render_static_array, to_image
+from frame_pacing import ANIMATION_MIN_INTERVAL
+from game_state import PANCAKE_COLORS, MovingPancake, Tower
+from motion import bounce_state, loop_steps, pancake_position
+from render_cache import (
+    PANCAKE_WAVE_HEIGHT, TowerLayer, get_base_layer, get_score_glyphs, image_bytes, pancake_sprites
+)
+from resolution import get_profile, scale_frame
+
+# Предварительная отрисовка кадров после броска: боты включают ее только
+# с PRECOMPUTE_CYCLE=1 и для первых PRECOMPUTE_CYCLE_FRAMES кадров анимации,
+# то есть положений блина в моменты кадров (animation_frame_time).
+# Весь цикл колебаний - десятки кадров и секунда процессора на бросок, и
+# он вытесняет из кэша кадров кадры, общие для многих игр
+PRECOMPUTE_CYCLE = os.getenv("PRECOMPUTE_CYCLE", "0") == "1"
+PRECOMPUTE_CYCLE_FRAMES = int(os.getenv("PRECOMPUTE_CYCLE_FRAMES", "8"))
+
+# Фоновый поток для предварительной отрисовки цикла кадров, общий для всех игр
+_cycle_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="frame-cycle")
+
+# Через сколько секунд движущийся блин сдвигается на один шаг. Это же
+# длительность кадра, когда колебания блина отправляются GIF-анимацией
+STEP_INTERVAL = float(os.getenv("PANCAKE_STEP_INTERVAL", "0.2"))
+
+# Число блокировок, между которыми распределяются последние кадры игр
+FRAME_LOCK_STRIPES = 64
+
+def animation_frame_interval(interval):
+    """Возвращает интервал кадров анимации, округленный вверх до целого числа шагов блина"""
+    # Запас на погрешность деления, чтобы 1.0 / 0.2 не стало шестью шагами
+    return max(1, math.ceil(interval / STEP_INTERVAL - 1e-9)) * STEP_INTERVAL
 
 class PancakeGame:
     """Класс для игры 'Блинная башня'"""
     
-    def __init__(self):
-        """Инициализация новой игры"""
+    # Параметры игрового поля, общие для всех игр
+    width = 600
+    height = 800
+    bg_color = (255, 255, 255)
+    
+    # Параметры тарелки
+    plate_y = height - 100  # Позиция тарелки
+    plate_width = 300
+    plate_height = 30
+    plate_color = (255, 150, 120)  # Цвет тарелки (розовый)
+    
+    # Цвета блинов (от светлого к темному)
+    pancake_colors = PANCAKE_COLORS
+    
+    # Блокировки последнего кадра: кадр меняется на месте и кодируется
+    # под блокировкой, а полоса блокировок не хранит замок в каждой игре
+    _frame_locks = tuple(threading.Lock() for _ in range(FRAME_LOCK_STRIPES))
+    
+    # Десятки тысяч игр в памяти: без __dict__ у каждой
+    __slots__ = (
+        "score", "game_over", "message_id", "chat_id", "pancakes", "current_pancake",
+        "_tower_layer", "_tower_digest", "_tower_arrays",
+        "_last_frame", "_last_frame_key", "_static_band", "_animation_loop", "precompute_cycle",
+    )
+    
+    def __init__(self, precompute_cycle=False):
+        """Инициализация новой игры
+        
+        С precompute_cycle=True после каждого броска в фоне отрисовываются
+        первые PRECOMPUTE_CYCLE_FRAMES кадров анимации нового блина, и анимация
+        берет их из кэша кадров.
+        """
         # Базовые параметры игры
         self.score = 0
         self.game_over = False
         self.message_id = None
         self.chat_id = None
         
-        # Параметры игрового поля
-        self.width = 600
-        self.height = 800
-        self.bg_color = (255, 255, 255)
-        
-        # Параметры блинов
-        self.pancakes = []  # Уложенные блины
-        self.plate_y = self.height - 100  # Позиция тарелки
-        self.plate_width = 300
-        self.plate_height = 30
-        self.plate_color = (255, 150, 120)  # Цвет тарелки (розовый)
+        # Уложенные блины, хранящиеся столбцами
+        self.pancakes = Tower()
         
         # Параметры для движущегося блина
-        self.current_pancake = {
-            "x": 0,  # Текущая позиция X
-            "y": 200,  # Высота, на которой движется блин
-            "width": self.plate_width - 20,  # Начальная ширина блина
-            "height": 20,  # Высота блина
-            "direction": 1,  # 1 - вправо, -1 - влево
-            "speed": 5,  # Скорость движения
-            "color": (255, 220, 50)  # Цвет блина
-        }
-        
-        # Цвета блинов (от светлого к темному)
-        self.pancake_colors = [
-            (255, 220, 50),   # Светло-желтый
-            (255, 200, 50),   # Желтый
-            (255, 180, 50),   # Темно-желтый
-            (255, 160, 50),   # Оранжево-желтый
-            (255, 140, 50),   # Светло-оранжевый
-        ]
+        self.current_pancake = MovingPancake(
+            x=0,  # Текущая позиция X
+            y=200,  # Высота, на которой движется блин
+            width=self.plate_width - 20,  # Начальная ширина блина
+            height=20,  # Высота блина
+            direction=1,  # 1 - вправо, -1 - влево
+            speed=5,  # Скорость движения
+            color=(255, 220, 50),  # Цвет блина
+            start_x=0,  # Позиция X в момент появления
+            start_direction=1,  # Направление в момент появления
+            spawn_time=time.time()  # Момент появления
+        )
         
-        # Создаем директорию для временных файлов, если её нет
-        os.makedirs("temp", exist_ok=True)
+        # Слой башни (render_cache.TowerLayer): уложенные блины и их маска
+        # размером с башню. Слой создается при первой отрисовке и заменяется
+        # расширенным, когда появляются блины, уложенные после прошлой
+        self._tower_layer = None
+        
+        # Цепочка хэшей уложенных блинов для ключа в кэше кадров
+        self._tower_digest = b""
+        
+        # Кадр с башней без счета и маска башни для отрисовки через NumPy
+        # вместе с числом блинов слоя, по которому они собраны
+        self._tower_arrays = None
+        
+        # Последний кадр игры: пока башня и счет те же, между кадрами
+        # перерисовывается только полоса движущегося блина. Хранятся ключ
+        # неподвижной части, сам кадр и неподвижная полоса под блином
+        self._last_frame = None
+        self._last_frame_key = None
+        self._static_band = None
+        
+        # Число шагов в GIF с колебаниями блина, пока клиент ее проигрывает:
+        # тогда движение начинается заново с каждым кругом анимации
+        self._animation_loop = None
+        
+        # Предварительная отрисовка кадров колебаний движущегося блина
+        self.precompute_cycle = precompute_cycle
+        if self.precompute_cycle:
+            self.start_cycle_precompute()
     
-    def update_moving_pancake(self):
-        """Обновляет положение движущегося блина"""
+    def update_moving_pancake(self, now=None):
+        """Обновляет положение движущегося блина на момент now
+        
+        Положение вычисляется по времени с момента появления блина,
+        поэтому вызывать метод нужно только перед отрисовкой или броском.
+        """
         # Если игра окончена, ничего не делаем
         if self.game_over:
             return
         
-        # Обновляем позицию блина
-        self.current_pancake["x"] += self.current_pancake["direction"] * self.current_pancake["speed"]
+        self.current_pancake["x"], self.current_pancake["direction"] = self.moving_position(now)
+    
+    def moving_position(self, now=None):
+        """Возвращает положение и направление движущегося блина в момент now"""
+        pancake = self.current_pancake
+        return pancake_position(
+            pancake["spawn_time"], pancake["start_x"], pancake["start_direction"],
+            pancake["speed"], pancake["width"], self.width,
+            time.time() if now is None else now, STEP_INTERVAL, self._animation_loop
+        )
+    
+    def oscillation_states(self):
+        """Возвращает положения и направления движущегося блина по шагам с момента появления
+        
+        Блин движется детерминированно: после пути до первого края
+        набор возможных кадров повторяется по кругу.
+        """
+        pancake = self.current_pancake
+        travel = self.width - pancake["width"]
+        return [
+            bounce_state(pancake["start_x"], pancake["start_direction"], pancake["speed"], travel, step)
+            for step in range(loop_steps(pancake["start_x"], pancake["start_direction"], pancake["speed"], travel))
+        ]
+    
+    def oscillation_positions(self):
+        """Возвращает все различные положения движущегося блина до повторения"""
+        # Положение без учета направления дает один и тот же кадр
+        return list(dict.fromkeys(x for x, _ in self.oscillation_states()))
+    
+    def animation_frame_time(self, interval, now=None):
+        """Возвращает момент последнего кадра анимации не позже now
+        
+        Кадры анимации идут от появления блина через interval, округленный
+        вверх до целого числа шагов блина, поэтому положения блина в кадрах
+        известны заранее и их можно отрисовать до того, как они понадобятся.
+        """
+        spawn_time = self.current_pancake["spawn_time"]
+        frame_interval = animation_frame_interval(interval)
+        now = time.time() if now is None else now
+        return spawn_time + max(0, (now - spawn_time) // frame_interval) * frame_interval
+    
+    def start_cycle_precompute(self, encoder=None, frames=PRECOMPUTE_CYCLE_FRAMES, interval=ANIMATION_MIN_INTERVAL):
+        """Запускает фоновую отрисовку первых frames кадров анимации блина для текущей башни
         
-        # Проверяем, не достиг ли блин края экрана
-        if self.current_pancake["x"] <= 0:
-            self.current_pancake["x"] = 0
-            self.current_pancake["direction"] = 1  # Меняем направление на вправо
-        elif self.current_pancake["x"] + self.current_pancake["width"] >= self.width:
-            self.current_pancake["x"] = self.width - self.current_pancake["width"]
-            self.current_pancake["direction"] = -1  # Меняем направление на влево
+        Кадры берутся в моменты animation_frame_time с интервалом interval.
+        Кадр в момент появления блина не нужен - его отрисовывает обработчик
+        броска. frames=None - все положения цикла колебаний.
+        """
+        if self.game_over:
+            return None
+        
+        if frames is None:
+            positions = self.oscillation_positions()
+        else:
+            # Кадр приходит чуть позже своего момента, но в пределах того же
+            # шага блина: положение берется с середины шага
+            spawn_time = self.current_pancake["spawn_time"] + STEP_INTERVAL / 2
+            frame_interval = animation_frame_interval(interval)
+            positions = list(dict.fromkeys(
+                self.moving_position(spawn_time + frame * frame_interval)[0] for frame in range(1, frames + 1)
+            ))
+        
+        return _cycle_executor.submit(
+            self._precompute_cycle_frames,
+            self._tower_digest, dict(self.current_pancake), positions, encoder, get_profile()
+        )
     
-    def drop_pancake(self):
-        """Опускает текущий блин на башню"""
+    def _precompute_cycle_frames(self, tower_digest, pancake, positions, encoder, profile):
+        """Кодирует кадры для каждого положения блина и кладет их в кэш кадров
+        
+        Кадры рисуются целиком, а не на последнем кадре игры: так фоновая
+        отрисовка не занимает блокировку кадра, которую ждет обработчик.
+        """
+        encoder = get_encoder(encoder)
+        
+        for x in positions:
+            # Башня уже изменилась - эти кадры больше не понадобятся
+            if self._tower_digest != tower_digest:
+                return
+            
+            moving = dict(pancake, x=x)
+            key = self.frame_key(encoder, moving=moving, profile=profile)
+            if key in frame_cache:
+                continue
+            
+            data = encoder.encode(scale_frame(self.render_image(moving), profile))
+            
+            # Хэш башни меняется до того, как на слой башни начинает рисоваться
+            # новый блин, поэтому совпадение хэша гарантирует целый кадр.
+            # Если игра закончилась во время отрисовки, кадр тоже не сохраняем
+            if self._tower_digest != tower_digest or self.game_over:
+                return
+            
+            frame_cache.put(key, data)
+    
+    def drop_pancake(self, now=None):
+        """Опускает текущий блин на башню в момент now"""
         # Если игра уже окончена, ничего не делаем
         if self.game_over:
             return True
         
+        # Блин падает из того места, где он находится в момент броска
+        self.update_moving_pancake(now)
+        
         # Определяем Y-координату для нового блина
         if not self.pancakes:
             # Первый блин на тарелке
@@ -126,38 +294,249 @@ class PancakeGame:
             "color": self.current_pancake["color"]
         })
         
+        # Дополняем хэш башни новым блином
+        self._add_to_tower_layer(self.pancakes[-1])
+        
         # Увеличиваем счет
         self.score += 1
         
         # Создаем новый движущийся блин
-        self.current_pancake = {
-            "x": random.randint(0, self.width - pancake_width),
-            "y": 200,  # Высота, на которой движется блин
-            "width": pancake_width,  # Ширина равна ширине предыдущего уложенного блина
-            "height": 20,  # Высота блина
-            "direction": random.choice([-1, 1]),  # Случайное начальное направление
-            "speed": 5 + min(self.score // 5, 10),  # Скорость увеличивается с ростом счета
-            "color": random.choice(self.pancake_colors)  # Случайный цвет из палитры
-        }
+        start_x = random.randint(0, self.width - pancake_width)
+        start_direction = random.choice([-1, 1])  # Случайное начальное направление
+        self.current_pancake = MovingPancake(
+            x=start_x,
+            y=200,  # Высота, на которой движется блин
+            width=pancake_width,  # Ширина равна ширине предыдущего уложенного блина
+            height=20,  # Высота блина
+            direction=start_direction,
+            speed=5 + min(self.score // 5, 10),  # Скорость увеличивается с ростом счета
+            color=random.choice(self.pancake_colors),  # Случайный цвет из палитры
+            start_x=start_x,
+            start_direction=start_direction,
+            spawn_time=time.time() if now is None else now
+        )
         
         # Проверяем, не достигла ли башня верха экрана
         if pancake_y < 100:
             self.game_over = True
             return True
         
+        # Анимация колебаний прежнего блина больше не действует
+        self._animation_loop = None
+        
+        # Заранее готовим кадры колебаний нового блина
+        if self.precompute_cycle:
+            self.start_cycle_precompute()
+        
         return False
     
-    def generate_game_image(self):
-        """Генерирует изображение текущего состояния игры"""
-        # Создаем новое изображение
+    def generate_game_image(self, to_file=False, encoder=None, profile=None):
+        """Генерирует изображение текущего состояния игры
+        
+        По умолчанию возвращает BytesIO с кадром, который можно сразу передать
+        в InputMediaPhoto или reply_photo. С to_file=True сохраняет кадр
+        в директорию temp/ и возвращает путь к файлу. encoder - имя
+        кодировщика из frame_encoding.ENCODERS, по умолчанию FRAME_ENCODER.
+        profile - профиль разрешения из resolution.PROFILES или auto,
+        по умолчанию FRAME_PROFILE.
+        """
+        encoder = get_encoder(encoder)
+        profile = get_profile(profile)
+        
+        # Одинаковые кадры разных игр кодируются один раз на процесс
+        data = frame_cache.get_or_render(
+            self.frame_key(encoder, profile=profile),
+            lambda: self.encode_frame(encoder, profile)
+        )
+        
+        if to_file:
+            return save_frame(data, extension=encoder.extension)
+        
+        return frame_stream(data, name=f"game.{encoder.extension}")
+    
+    def generate_game_animation(self):
+        """Генерирует зацикленную GIF-анимацию колебаний движущегося блина
+        
+        Анимация начинается с места появления блина и проходит все шаги
+        до повторения состояния. Возвращает BytesIO для send_animation
+        или InputMediaAnimation.
+        """
+        data = frame_cache.get_or_render(
+            self.animation_key(),
+            lambda: self._encode_animation(self.oscillation_states(), STEP_INTERVAL)
+        )
+        
+        return frame_stream(data, name="game.gif")
+    
+    def animation_key(self):
+        """Возвращает хэш всего, что влияет на GIF-анимацию колебаний"""
+        pancake = self.current_pancake
+        start = dict(pancake, x=pancake["start_x"])
+        return state_key(
+            self.frame_key(moving=start, profile="full"), "gif",
+            pancake["start_direction"], pancake["speed"], STEP_INTERVAL
+        )
+    
+    def _encode_animation(self, states, frame_duration):
+        """Кодирует кадры колебаний блина в GIF"""
+        # Палитру берем из кадра с движущимся блином, чтобы в ней был его цвет.
+        # В центре блина гарантированно его цвет - оттуда берем индекс
+        pancake = dict(self.current_pancake, x=self.current_pancake["start_x"])
+        probe = self.render_image(moving=pancake).quantize(colors=64, method=Image.Quantize.FASTOCTREE)
+        color_index = probe.getpixel(
+            (pancake["x"] + pancake["width"] // 2, pancake["y"] + pancake["height"] // 2)
+        )
+        
+        # Неподвижная часть кадра одна на всю анимацию, в каждом кадре
+        # дорисовывается только блин индексом палитры
+        static = self._render_static_image().quantize(palette=probe, dither=Image.Dither.NONE)
+        frames = []
+        for x, _ in states:
+            frame = static.copy()
+            self._draw_pancake(frame, dict(pancake, x=x, color=color_index))
+            frames.append(frame)
+        
+        buffer = io.BytesIO()
+        frames[0].save(
+            buffer, format="GIF", save_all=True, append_images=frames[1:],
+            duration=int(frame_duration * 1000), loop=0, optimize=False
+        )
+        return buffer.getvalue()
+    
+    def start_animation_clock(self, now=None):
+        """Отсчитывает движение блина от момента, когда клиент начал проигрывать анимацию
+        
+        Анимация начинается с места появления блина и повторяется по кругу,
+        поэтому и движение блина зацикливается вместе с ней.
+        """
+        pancake = self.current_pancake
+        pancake["spawn_time"] = time.time() if now is None else now
+        self._animation_loop = len(self.oscillation_states())
+        self.update_moving_pancake(pancake["spawn_time"])
+    
+    def frame_key(self, encoder=None, moving=None, profile=None):
+        """Возвращает хэш всего, что влияет на закодированный кадр
+        
+        moving позволяет подставить другое положение движущегося блина
+        вместо current_pancake, например при предварительной отрисовке.
+        В режиме auto профиль нужно выбрать заранее через get_profile()
+        и передать тот же профиль при отрисовке.
+        """
+        # Движущийся блин виден только пока игра не окончена
+        moving_state = None
+        if not self.game_over:
+            pancake = moving or self.current_pancake
+            moving_state = (pancake["x"], pancake["y"], pancake["width"], pancake["height"], pancake["color"])
+        
+        return state_key(
+            type(self).__module__, self.width, self.height, self._tower_digest,
+            moving_state, self.score, self.game_over, get_encoder(encoder).name, get_profile(profile)
+        )
+    
+    def encode_frame(self, encoder=None, profile=None, moving=None, renderer=None):
+        """Отрисовывает и кодирует кадр, перерисовывая на прошлом кадре только полосу блина
+        
+        Между кадрами анимации меняется только полоса с движущимся блином:
+        она восстанавливается из неподвижной части кадра, и блин рисуется
+        заново. Полный кадр собирается только после броска или смены счета.
+        """
+        encoder = get_encoder(encoder)
+        profile = get_profile(profile)
+        
+        if self.game_over or get_renderer(renderer) == "numpy":
+            self._last_frame = self._static_band = None
+            frame = encoder.encode(scale_frame(self.render_image(moving, renderer), profile))
+            if self.game_over:
+                # Оконченная игра больше не анимируется: слой башни ей не нужен
+                self.release_frames()
+            return frame
+        
+        # Кадр меняется на месте, поэтому кодируется, пока его никто не трогает
+        with self._frame_locks[hash(self) % FRAME_LOCK_STRIPES]:
+            return encoder.encode(scale_frame(self._update_last_frame(moving or self.current_pancake), profile))
+    
+    def _update_last_frame(self, pancake):
+        """Переносит движущийся блин на последнем кадре в новое положение"""
+        band_top = pancake["y"] - PANCAKE_WAVE_HEIGHT
+        band_bottom = pancake["y"] + pancake["height"] + PANCAKE_WAVE_HEIGHT + 1
+        
+        # Версия слоя башни меняется, только когда блин дорисован до конца,
+        # поэтому кадр с недорисованной башней не переживет следующий бросок
+        tower = self._ensure_tower_layer()
+        frame_key = (0 if tower is None else tower.count, self.score, band_top, band_bottom)
+        
+        if self._last_frame is None or self._last_frame_key != frame_key:
+            self._last_frame = self._render_static_image()
+            self._static_band = self._last_frame.crop((0, band_top, self.width, band_bottom))
+            self._last_frame_key = frame_key
+        else:
+            self._last_frame.paste(self._static_band, (0, band_top))
+        
+        self._draw_pancake(self._last_frame, pancake)
+        return self._last_frame
+    
+    def render_image(self, moving=None, renderer=None):
+        """Отрисовывает текущее состояние игры и возвращает изображение PIL
+        
+        renderer - способ отрисовки из frame_rendering.RENDERERS,
+        по умолчанию FRAME_RENDERER.
+        """
+        if get_renderer(renderer) == "numpy":
+            return to_image(self.render_array(moving))
+        
+        image = self._render_static_image()
+        
+        # Рисуем движущийся блин, если игра не окончена
+        if not self.game_over:
+            self._draw_pancake(image, moving or self.current_pancake)
+        
+        return image
+    
+    def render_array(self, moving=None):
+        """Отрисовывает текущее состояние игры в массив NumPy (высота, ширина, 3)"""
+        frame = render_static_array(self)
+        
+        if not self.game_over:
+            pancake = moving or self.current_pancake
+            paste_pancake(
+                frame, pancake["x"], pancake["y"], pancake["width"], pancake["height"],
+                pancake.get("color", (255, 220, 50)), self._wave_count(pancake["width"])
+            )
+        
+        return frame
+    
+    def _render_static_image(self):
+        """Отрисовывает все, кроме движущегося блина: фон, счет и башню"""
+        # Начинаем с копии заранее отрисованного фона с кругом для счета и тарелкой
+        image = get_base_layer(self._base_layer_key(), self._render_base_layer).copy()
+        
+        # Рисуем счет в центре верхней части
+        self._draw_score(image)
+        
+        # Накладываем слой башни одной операцией, независимо от её высоты
+        tower = self._ensure_tower_layer()
+        if tower is not None:
+            tower.paste_onto(image)
+        
+        return image
+    
+    def _base_layer_key(self):
+        """Возвращает ключ базового кадра: размер холста и палитра"""
+        return (
+            self.width, self.height, self.bg_color,
+            self.plate_y, self.plate_width, self.plate_height, self.plate_color
+        )
+    
+    def _render_base_layer(self):
+        """Отрисовывает фон, круг для счета и тарелку, которые не меняются в течение игры"""
         image = Image.new("RGB", (self.width, self.height), self.bg_color)
         draw = ImageDraw.Draw(image)
         
         # Добавляем декоративные элементы фона
         self._draw_background(draw)
         
-        # Рисуем счет в центре верхней части
-        self._draw_score(draw)
+        # Рисуем круг для счета
+        self._draw_score_circle(draw)
         
         # Рисуем тарелку
         plate_x = (self.width - self.plate_width) // 2
@@ -167,20 +546,7 @@ class PancakeGame:
             outline=None
         )
         
-        # Рисуем все блины в башне
-        for pancake in self.pancakes:
-            self._draw_pancake(draw, pancake)
-        
-        # Рисуем движущийся блин, если игра не окончена
-        if not self.game_over:
-            self._draw_pancake(draw, self.current_pancake)
-        
-        # Сохраняем изображение во временный файл
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S%f")
-        image_path = f"temp/game_{timestamp}.png"
-        image.save(image_path)
-        
-        return image_path
+        return image
     
     def _draw_background(self, draw):
         """Рисует декоративные элементы фона"""
@@ -210,9 +576,8 @@ class PancakeGame:
         for i in range(len(points) - 1):
             draw.line([points[i], points[i+1]], fill=light_blue, width=3)
     
-    def _draw_score(self, draw):
-        """Рисует счет в центре верхней части экрана"""
-        # Создаем круг для счета
+    def _draw_score_circle(self, draw):
+        """Рисует круг для счета в центре верхней части экрана"""
         circle_radius = 50
         circle_center = (self.width // 2, 200)
         draw.ellipse(
@@ -222,54 +587,88 @@ class PancakeGame:
             fill=(255, 255, 255),
             width=2
         )
-        
-        # Рисуем текст счета
-        # Примечание: в реальном приложении нужно установить шрифт
-        # Здесь используем стандартный шрифт
-        try:
-            font = ImageFont.truetype("arial.ttf", 36)
-        except IOError:
-            font = ImageFont.load_default()
-        
-        # Центрируем текст
+    
+    def _draw_score(self, image):
+        """Рисует счет в центре верхней части экрана"""
+        # Круг уже есть на базовом кадре, остается наложить готовые цифры
+        glyphs = get_score_glyphs()
         text = str(self.score)
+        glyphs.paste(image, text, self._score_position(glyphs, text), (0, 0, 0))
+    
+    def _score_position(self, glyphs, text):
+        """Возвращает позицию текста счета, отцентрированного в круге"""
+        circle_center = (self.width // 2, 200)
+        text_width = glyphs.text_width(text)
+        return (circle_center[0] - text_width // 2, circle_center[1] - 18)
+    
+    def _add_to_tower_layer(self, pancake):
+        """Дополняет хэш башни уложенным блином; на слой он попадет при отрисовке"""
+        self._tower_digest = extend_digest(
+            self._tower_digest,
+            pancake["x"], pancake["y"], pancake["width"], pancake["height"], pancake["color"]
+        )
+    
+    def _ensure_tower_layer(self):
+        """Возвращает слой башни, дорисовав блины, уложенные после прошлой отрисовки
+        
+        Игры, которые не отрисовываются, не держат слоев в памяти. Слой
+        занимает только прямоугольник башни, а не весь кадр; новые блины
+        рисуются на его расширенной копии, поэтому отрисовка из другого
+        потока всегда получает целый слой.
+        """
+        tower = self._tower_layer
+        count = len(self.pancakes)
+        drawn = 0 if tower is None else tower.count
+        if drawn >= count:
+            return tower
+        
+        pancakes = self.pancakes[drawn:count]
+        tower = TowerLayer.extend(tower, pancakes, (self.width, self.height))
+        for pancake in pancakes:
+            self._draw_pancake(tower.image, pancake, mask_image=tower.mask, origin=tower.origin)
+        tower.count = count
+        
+        self._tower_layer = tower
+        return tower
+    
+    def release_frames(self):
+        """Освобождает слой башни и последний кадр; они восстановятся при отрисовке
+        
+        Для простаивающих, остановленных и оконченных игр: каждая отрисованная
+        игра иначе держит последний кадр размером с холст.
+        """
+        # Последний кадр меняется на месте под той же блокировкой
+        with self._frame_locks[hash(self) % FRAME_LOCK_STRIPES]:
+            self._tower_layer = self._tower_arrays = None
+            self._last_frame = self._last_frame_key = self._static_band = None
+    
+    def frame_memory(self):
+        """Возвращает, сколько байт занимают кадры и слои, которые держит игра"""
+        tower, arrays = self._tower_layer, self._tower_arrays
+        tower_bytes = 0 if tower is None else tower.nbytes
+        arrays_bytes = 0 if arrays is None else arrays[1].nbytes + arrays[2].nbytes
+        return (
+            tower_bytes + arrays_bytes
+            + image_bytes(self._last_frame) + image_bytes(self._static_band)
+        )
+    
+    def _draw_pancake(self, image, pancake, mask_image=None, origin=(0, 0)):
+        """Рисует блин с волнистыми краями одной вставкой готового спрайта
         
-        # В новых версиях Pillow используем get_text_width вместо textlength
-        try:
-            # Для новых версий Pillow
-            text_bbox = font.getbbox(text)
-            text_width = text_bbox[2] - text_bbox[0]
-        except AttributeError:
-            try:
-                # Для более старых версий Pillow
-                text_width = draw.textlength(text, font=font)
-            except AttributeError:
-                # Для еще более старых версий
-                text_width = font.getsize(text)[0]
-        
-        text_position = (circle_center[0] - text_width // 2, circle_center[1] - 18)
-        
-        draw.text(text_position, text, fill=(0, 0, 0), font=font)
-    
-    def _draw_pancake(self, draw, pancake):
-        """Рисует блин с волнистыми краями"""
+        origin - положение левого верхнего угла image на кадре (для слоя башни).
+        """
         x, y, width, height = pancake["x"], pancake["y"], pancake["width"], pancake["height"]
         color = pancake.get("color", (255, 220, 50))  # Используем цвет блина или значение по умолчанию
         
-        # Основная форма блина
-        draw.rectangle([(x, y), (x + width, y + height)], fill=color)
-        
-        # Добавляем волнистые края (верхний и нижний)
-        wave_height = 4
-        wave_count = max(3, width // 20)  # Количество волн зависит от ширины блина
-        
-        for i in range(wave_count + 1):
-            wave_x = x + (width / wave_count) * i
-            
-            # Верхняя волна
-            if i % 2 == 0:
-                draw.rectangle([(wave_x - 5, y - wave_height), (wave_x + 5, y)], fill=color)
-            
-            # Нижняя волна
-            if i % 2 == 1:
-                draw.rectangle([(wave_x - 5, y + height), (wave_x + 5, y + height + wave_height)], fill=color) 
\ No newline at end of file
+        pancake_sprites.paste(
+            image, x, y, width, height, color, self._wave_count(width),
+            mask_image=mask_image, origin=origin
+        )
+    
+    def _wave_count(self, width):
+        """Возвращает количество волн на краях блина: оно зависит от ширины блина"""
+        return max(3, width // 20)
+
+# Кодировщик auto выбирается по начальному кадру игры, один раз на процесс
+if ENCODERS["auto"].sample_frames is None:
+    ENCODERS["auto"].sample_frames = lambda: [PancakeGame().render_image()]
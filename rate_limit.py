@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Ограничение частоты исходящих запросов ботов "Блинная башня" к Telegram
+
+Telegram ограничивает и общее число сообщений бота в секунду, и число
+сообщений в один чат; при превышении он отвечает ошибкой RetryAfter
+(429) с временем, на которое нужно прекратить отправку. Перед каждой
+отправкой берется жетон из общего ведра и из ведра чата; ошибка
+RetryAfter приостанавливает отправку в чат на указанное время.
+
+Обработчики нажатий ждут своей очереди (block=True), а кадры анимации не
+ждут: вместо этого выбрасывается RateLimited со временем ожидания,
+и следующий кадр планируется не раньше, чем это время пройдет.
+
+Ведра живут в памяти процесса. В шардированном запуске (sharding) каждый
+процесс-обработчик получает 1/N общего бюджета и бюджетов групповых чатов:
+пользователи одной группы могут попасть в разные процессы. Личный чат
+совпадает с пользователем и всегда обслуживается одним процессом, поэтому
+его бюджет не делится.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from telegram.error import RetryAfter
+
+# Общий бюджет бота: сообщений в секунду и запас для коротких всплесков
+TELEGRAM_RATE = float(os.getenv("TELEGRAM_RATE", "30"))
+TELEGRAM_BURST = float(os.getenv("TELEGRAM_BURST", "30"))
+
+# Бюджет одного чата. Интервал кадров анимации не опускается ниже
+# 1 / TELEGRAM_CHAT_RATE (frame_pacing), поэтому частые кадры включаются
+# увеличением этого бюджета
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_CHAT_BURST = float(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+
+# Для скольких чатов хранятся ведра: давно не писавшие забываются,
+# их ведра все равно успели бы наполниться
+RATE_LIMIT_CHATS = int(os.getenv("RATE_LIMIT_CHATS", "10000"))
+
+# Сколько раз ждущая отправка повторяется после RetryAfter
+RATE_LIMIT_RETRIES = 2
+
+class RateLimited(Exception):
+    """Отправка не выполнена: бюджет исчерпан или чат приостановлен"""
+
+    def __init__(self, chat_id, wait):
+        """Запоминает чат и через сколько секунд отправку можно повторить"""
+        super().__init__(f"Отправка в чат {chat_id} отложена на {wait:.2f} с")
+        self.chat_id = chat_id
+        self.wait = wait
+
+def _seconds(retry_after):
+    """Возвращает retry_after из RetryAfter в секундах (число или timedelta)"""
+    total_seconds = getattr(retry_after, "total_seconds", None)
+    return float(total_seconds() if total_seconds is not None else retry_after)
+
+def _rewind(args, kwargs):
+    """Перематывает в начало файлы среди аргументов: повторная отправка читает их заново"""
+    for value in (*args, *kwargs.values()):
+        if hasattr(value, "read") and hasattr(value, "seek"):
+            value.seek(0)
+
+class TokenBucket:
+    """Ведро жетонов: rate жетонов в секунду, не больше burst про запас"""
+
+    __slots__ = ("rate", "burst", "tokens", "updated_at", "paused_until")
+
+    def __init__(self, rate, burst, now):
+        """Создает полное ведро"""
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = now
+        self.paused_until = 0.0
+
+    def wait_time(self, now):
+        """Возвращает, через сколько секунд в ведре будет жетон (0 - уже есть)"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.paused_until - now)
+
+    def take(self):
+        """Забирает жетон"""
+        self.tokens -= 1
+
+class RateLimiter:
+    """Общий бюджет и бюджеты чатов для исходящих запросов к Telegram"""
+
+    def __init__(self, rate=TELEGRAM_RATE, burst=TELEGRAM_BURST, chat_rate=TELEGRAM_CHAT_RATE,
+                 chat_burst=TELEGRAM_CHAT_BURST, max_chats=RATE_LIMIT_CHATS):
+        """Создает ограничитель с полными ведрами"""
+        self.rate = rate
+        self.burst = burst
+        self.shares = 1
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_chats = max_chats
+        self.granted = 0
+        self.delayed = 0
+        self.limited = 0
+        self.retry_afters = 0
+        self._global = TokenBucket(rate, burst, time.monotonic())
+        self._chats = OrderedDict()
+        self._lock = threading.Lock()
+
+    def set_shares(self, shares):
+        """Оставляет процессу 1/shares общего бюджета и бюджетов групповых чатов"""
+        with self._lock:
+            self.shares = shares
+            self._global = TokenBucket(self.rate / shares, max(1.0, self.burst / shares), time.monotonic())
+            self._chats.clear()
+
+    def _chat_bucket(self, chat_id, now):
+        """Возвращает ведро чата, создавая его и забывая самые давние при переполнении"""
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # У групп и каналов id отрицательные: их пользователи бывают в разных процессах
+            shares = self.shares if chat_id < 0 else 1
+            bucket = self._chats[chat_id] = TokenBucket(
+                self.chat_rate / shares, max(1.0, self.chat_burst / shares), now
+            )
+            while len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    def wait_time(self, chat_id):
+        """Возвращает, через сколько секунд можно отправить в чат, не забирая жетонов"""
+        now = time.monotonic()
+        with self._lock:
+            wait = self._global.wait_time(now)
+            bucket = None if chat_id is None else self._chats.get(chat_id)
+            if bucket is not None:
+                wait = max(wait, bucket.wait_time(now))
+            return wait
+
+    def load(self):
+        """Возвращает долю общего бюджета, израсходованную сейчас (0 - ведро полное)"""
+        now = time.monotonic()
+        with self._lock:
+            self._global.wait_time(now)
+            return max(0.0, 1 - self._global.tokens / self._global.burst)
+
+    def try_acquire(self, chat_id):
+        """Берет жетоны общего бюджета и бюджета чата; возвращает 0 или сколько секунд ждать"""
+        now = time.monotonic()
+        with self._lock:
+            chat = None if chat_id is None else self._chat_bucket(chat_id, now)
+            wait = self._global.wait_time(now)
+            if chat is not None:
+                wait = max(wait, chat.wait_time(now))
+
+            # Жетоны берутся из обоих ведер сразу или ни из одного
+            if wait > 0:
+                return wait
+
+            self._global.take()
+            if chat is not None:
+                chat.take()
+            self.granted += 1
+            return 0.0
+
+    def acquire(self, chat_id):
+        """Ждет и берет жетоны для отправки в чат"""
+        wait = self.try_acquire(chat_id)
+        if wait:
+            self.delayed += 1
+        while wait:
+            time.sleep(wait)
+            wait = self.try_acquire(chat_id)
+
+    async def acquire_async(self, chat_id):
+        """Асинхронный acquire: ждет жетоны, не блокируя цикл событий"""
+        wait = self.try_acquire(chat_id)
+        if wait:
+            self.delayed += 1
+        while wait:
+            await asyncio.sleep(wait)
+            wait = self.try_acquire(chat_id)
+
+    def retry_after(self, chat_id, seconds):
+        """Приостанавливает отправку в чат (без чата - всю отправку) после ответа 429"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._global if chat_id is None else self._chat_bucket(chat_id, now)
+            bucket.paused_until = max(bucket.paused_until, now + seconds)
+            self.retry_afters += 1
+
+    def _reserve(self, chat_id):
+        """Для неждущей отправки: берет жетоны или выбрасывает RateLimited"""
+        wait = self.try_acquire(chat_id)
+        if wait:
+            self.limited += 1
+            raise RateLimited(chat_id, wait)
+
+    def _on_retry_after(self, chat_id, error, block, attempt):
+        """Учитывает RetryAfter; выбрасывает исключение, если отправку не повторять"""
+        seconds = _seconds(error.retry_after)
+        self.retry_after(chat_id, seconds)
+        if not block:
+            raise RateLimited(chat_id, seconds) from error
+        if attempt == RATE_LIMIT_RETRIES:
+            raise error
+
+    def call(self, chat_id, method, /, *args, block=True, **kwargs):
+        """Вызывает метод бота method(*args, **kwargs) для чата в пределах бюджета
+
+        С block=True ждет жетоны, а после RetryAfter ждет паузу и повторяет
+        запрос. С block=False не ждет: выбрасывает RateLimited.
+        """
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            if block:
+                self.acquire(chat_id)
+            else:
+                self._reserve(chat_id)
+
+            _rewind(args, kwargs)
+            try:
+                return method(*args, **kwargs)
+            except RetryAfter as error:
+                self._on_retry_after(chat_id, error, block, attempt)
+
+    async def call_async(self, chat_id, method, /, *args, block=True, **kwargs):
+        """Асинхронный call для корутинных методов бота"""
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            if block:
+                await self.acquire_async(chat_id)
+            else:
+                self._reserve(chat_id)
+
+            _rewind(args, kwargs)
+            try:
+                return await method(*args, **kwargs)
+            except RetryAfter as error:
+                self._on_retry_after(chat_id, error, block, attempt)
+
+    def stats(self):
+        """Возвращает число отправок: разрешенных, ждавших, отложенных, получивших 429"""
+        now = time.monotonic()
+        with self._lock:
+            paused = sum(1 for bucket in self._chats.values() if bucket.paused_until > now)
+            chats = len(self._chats)
+
+        return {
+            "granted": self.granted,
+            "delayed": self.delayed,
+            "limited": self.limited,
+            "retry_after": self.retry_afters,
+            "chats": chats,
+            "paused_chats": paused,
+        }
+
+# Ограничитель, общий для всех ботов процесса
+rate_limiter = RateLimiter()
@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Общие для всего процесса кэши отрисовки игры "Блинная башня"
+"""
+
+import threading
+from collections import OrderedDict
+from PIL import Image, ImageDraw, ImageFont
+
+# Заранее отрисованные базовые кадры (фон, круг для счета, тарелка).
+# Ключ - размер холста и палитра, значение - готовое изображение,
+# которое игры только копируют и никогда не изменяют.
+_base_layers = {}
+_base_layers_lock = threading.Lock()
+
+def get_base_layer(key, render):
+    """Возвращает базовый кадр по ключу, отрисовывая его при первом обращении"""
+    layer = _base_layers.get(key)
+    if layer is not None:
+        return layer
+
+    with _base_layers_lock:
+        # Другой поток мог успеть отрисовать кадр, пока мы ждали блокировку
+        layer = _base_layers.get(key)
+        if layer is None:
+            layer = render()
+            _base_layers[key] = layer
+
+    return layer
+
+def clear_base_layers():
+    """Очищает кэш базовых кадров"""
+    with _base_layers_lock:
+        _base_layers.clear()
+
+# Шрифт счета и заранее отрисованные цифры. Поиск файла шрифта и отрисовка
+# цифр выполняются один раз на процесс, а не на каждом кадре
+_score_font = None
+_score_glyphs = None
+_score_lock = threading.Lock()
+
+def get_score_font():
+    """Возвращает шрифт для счета, определяя его при первом обращении"""
+    global _score_font
+
+    if _score_font is None:
+        with _score_lock:
+            if _score_font is None:
+                # Примечание: в реальном приложении нужно установить шрифт,
+                # иначе используется стандартный шрифт Pillow
+                try:
+                    _score_font = ImageFont.truetype("arial.ttf", 36)
+                except IOError:
+                    _score_font = ImageFont.load_default()
+
+    return _score_font
+
+def get_score_glyphs():
+    """Возвращает набор заранее отрисованных цифр для счета"""
+    global _score_glyphs
+
+    if _score_glyphs is None:
+        glyphs = ScoreGlyphs(get_score_font())
+        with _score_lock:
+            if _score_glyphs is None:
+                _score_glyphs = glyphs
+
+    return _score_glyphs
+
+class ScoreGlyphs:
+    """Маски цифр 0-9 и их метрики для быстрой отрисовки счета"""
+
+    def __init__(self, font):
+        """Отрисовывает каждую цифру в отдельную маску"""
+        self.digits = {}
+
+        for digit in "0123456789":
+            left, top, right, bottom = font.getbbox(digit)
+            mask = Image.new("L", (max(right - left, 1), max(bottom - top, 1)), 0)
+            ImageDraw.Draw(mask).text((-left, -top), digit, fill=255, font=font)
+            self.digits[digit] = (mask, left, top, right, font.getlength(digit))
+
+    def text_width(self, text):
+        """Возвращает ширину текста по закрашенным пикселям, как font.getbbox"""
+        pen = 0
+        for digit in text[:-1]:
+            pen += self.digits[digit][4]
+
+        first_left = self.digits[text[0]][1]
+        last_right = self.digits[text[-1]][3]
+        return round(pen) + last_right - first_left
+
+    def layout(self, text, position):
+        """Возвращает цифры текста и позиции их масок на изображении"""
+        x, y = position
+        pen = 0
+        placed = []
+
+        for digit in text:
+            _, left, top, _, advance = self.digits[digit]
+            placed.append((digit, (x + round(pen) + left, y + top)))
+            pen += advance
+
+        return placed
+
+    def paste(self, image, text, position, color):
+        """Накладывает текст из цифр на изображение, по одной вставке на цифру"""
+        for digit, digit_position in self.layout(text, position):
+            image.paste(color, digit_position, self.digits[digit][0])
+
+# Размер волн по краям блина: высота и половина ширины
+PANCAKE_WAVE_HEIGHT = 4
+PANCAKE_WAVE_HALF_WIDTH = 5
+
+# Сколько разных спрайтов блинов хранится одновременно
+PANCAKE_SPRITE_CACHE_SIZE = 256
+
+def pancake_wave_spans(x, width, wave_count):
+    """Возвращает левую и правую границы волн блина относительно x, в пикселях
+
+    Волны стоят в дробных точках x + (width / wave_count) * i, а Pillow
+    отбрасывает дробную часть координат. Ошибка округления иногда сдвигает
+    границу волны на пиксель в зависимости от x, поэтому границы считаются
+    от настоящего x по той же формуле, и спрайт с ними совпадает с
+    блином, нарисованным прямо на кадре.
+    """
+    step = width / wave_count
+    spans = []
+    for i in range(wave_count + 1):
+        wave_x = x + step * i
+        spans.append((int(wave_x - PANCAKE_WAVE_HALF_WIDTH) - x, int(wave_x + PANCAKE_WAVE_HALF_WIDTH) - x))
+    return tuple(spans)
+
+def render_pancake_sprite(width, height, wave_count, spans):
+    """Отрисовывает маску блина с волнистыми краями
+
+    Блин закрашен одним цветом, поэтому спрайт - это только маска формы,
+    а цвет подставляется при вставке на кадр. spans - границы волн из
+    pancake_wave_spans.
+    """
+    margin_x, margin_y = PANCAKE_WAVE_HALF_WIDTH, PANCAKE_WAVE_HEIGHT
+    size = (width + 2 * margin_x + 1, height + 2 * margin_y + 1)
+    mask = Image.new("1", size, 0)
+    draw = ImageDraw.Draw(mask)
+
+    # Основная форма блина
+    x, y = margin_x, margin_y
+    draw.rectangle([(x, y), (x + width, y + height)], fill=1)
+
+    # Добавляем волнистые края: четные сверху, нечетные снизу
+    for i, (left, right) in enumerate(spans):
+        if i % 2 == 0:
+            draw.rectangle([(x + left, y - margin_y), (x + right, y)], fill=1)
+        else:
+            draw.rectangle([(x + left, y + height), (x + right, y + height + margin_y)], fill=1)
+
+    return mask
+
+class PancakeSpriteAtlas:
+    """Кэш готовых спрайтов блинов с вытеснением давно не использованных"""
+
+    def __init__(self, max_size=PANCAKE_SPRITE_CACHE_SIZE):
+        """Создает пустой атлас на max_size спрайтов"""
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._sprites = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, x, width, height, wave_count):
+        """Возвращает маску блина в точке x, отрисовывая её при промахе
+
+        Почти для всех x границы волн одинаковы, и спрайт общий.
+        """
+        spans = pancake_wave_spans(x, width, wave_count)
+        key = (width, height, spans)
+
+        with self._lock:
+            sprite = self._sprites.get(key)
+            if sprite is not None:
+                self._sprites.move_to_end(key)
+                self.hits += 1
+                return sprite
+            self.misses += 1
+
+        sprite = render_pancake_sprite(width, height, wave_count, spans)
+
+        with self._lock:
+            self._sprites[key] = sprite
+            self._sprites.move_to_end(key)
+            while len(self._sprites) > self.max_size:
+                self._sprites.popitem(last=False)
+                self.evictions += 1
+
+        return sprite
+
+    def paste(self, image, x, y, width, height, color, wave_count, mask_image=None, origin=(0, 0)):
+        """Рисует блин одной вставкой спрайта, при необходимости дополняя маску
+
+        origin - положение левого верхнего угла image на кадре.
+        """
+        mask = self.get(x, width, height, wave_count)
+        position = (x - PANCAKE_WAVE_HALF_WIDTH - origin[0], y - PANCAKE_WAVE_HEIGHT - origin[1])
+
+        image.paste(color, position, mask)
+        if mask_image is not None:
+            mask_image.paste(1, position, mask)
+
+    def stats(self):
+        """Возвращает размер атласа и счетчики попаданий и промахов"""
+        with self._lock:
+            return {
+                "size": len(self._sprites),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def clear(self):
+        """Очищает атлас и сбрасывает счетчики"""
+        with self._lock:
+            self._sprites.clear()
+            self.hits = self.misses = self.evictions = 0
+
+# Атлас спрайтов, общий для всех игр процесса
+pancake_sprites = PancakeSpriteAtlas()
+
+def image_bytes(image):
+    """Возвращает размер буфера изображения Pillow (RGB хранится по 4 байта на пиксель)"""
+    if image is None:
+        return 0
+    return image.width * image.height * (4 if image.mode == "RGB" else 1)
+
+def pancake_box(x, y, width, height):
+    """Возвращает границы спрайта блина на кадре: left, top, right, bottom"""
+    return (
+        x - PANCAKE_WAVE_HALF_WIDTH, y - PANCAKE_WAVE_HEIGHT,
+        x + width + PANCAKE_WAVE_HALF_WIDTH + 1, y + height + PANCAKE_WAVE_HEIGHT + 1
+    )
+
+class TowerLayer:
+    """Уложенные блины игры: изображение и маска размером с башню, а не с кадр
+
+    Слой не изменяется после того, как игра его сохранила: новые блины
+    рисуются на расширенной копии, поэтому отрисовка в другом потоке
+    всегда видит согласованные изображение, маску и число блинов.
+    """
+
+    __slots__ = ("image", "mask", "origin", "count")
+
+    def __init__(self, box, previous=None):
+        """Создает слой с границами box (left, top, right, bottom), перенося на него прежний слой"""
+        left, top, right, bottom = box
+        size = (max(1, right - left), max(1, bottom - top))
+        self.image = Image.new("RGB", size)
+        self.mask = Image.new("1", size)
+        self.origin = (left, top)
+        self.count = 0
+
+        if previous is not None:
+            offset = (previous.origin[0] - left, previous.origin[1] - top)
+            self.image.paste(previous.image, offset)
+            self.mask.paste(previous.mask, offset)
+            self.count = previous.count
+
+    @property
+    def box(self):
+        """Возвращает границы слоя на кадре: left, top, right, bottom"""
+        left, top = self.origin
+        return (left, top, left + self.image.width, top + self.image.height)
+
+    @classmethod
+    def extend(cls, layer, pancakes, size):
+        """Возвращает слой, вмещающий прежний слой и блины pancakes на кадре размера size"""
+        boxes = [pancake_box(p["x"], p["y"], p["width"], p["height"]) for p in pancakes]
+        if layer is not None:
+            boxes.append(layer.box)
+
+        # За пределами кадра блины все равно не видны
+        left = max(0, min(box[0] for box in boxes))
+        top = max(0, min(box[1] for box in boxes))
+        right = min(size[0], max(box[2] for box in boxes))
+        bottom = min(size[1], max(box[3] for box in boxes))
+        return cls((left, top, max(left, right), max(top, bottom)), previous=layer)
+
+    @property
+    def nbytes(self):
+        """Возвращает размер изображения и маски слоя в байтах"""
+        return image_bytes(self.image) + image_bytes(self.mask)
+
+    def paste_onto(self, image):
+        """Накладывает слой на кадр одной операцией"""
+        image.paste(self.image, self.origin, self.mask)
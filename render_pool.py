@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Отрисовка кадров "Блинной башни" в пуле потоков или процессов
+
+Отрисовка и сжатие кадра занимают процессор, поэтому в обработчиках
+обновлений они выполняются в пуле: асинхронный бот ждет кадр через await,
+не блокируя цикл событий, а пул процессов использует все ядра.
+В пул передается компактный снимок состояния игры, а из процесса кадр
+возвращается через общую память.
+"""
+
+import asyncio
+import importlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+
+from frame_cache import frame_cache
+from frame_encoding import frame_stream, get_encoder
+from resolution import get_profile, observe_render
+
+# Пул для отрисовки: "thread" - потоки, "process" - процессы
+RENDER_EXECUTOR = os.getenv("RENDER_EXECUTOR", "thread")
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(os.cpu_count() or 1)))
+
+# Сколько восстановленных из снимков игр хранит каждый исполнитель
+RESTORED_GAMES_CACHE_SIZE = 64
+
+# Поля блина в снимке состояния
+PANCAKE_FIELDS = ("x", "y", "width", "height", "color")
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    """Возвращает пул отрисовки, создавая его при первом обращении"""
+    global _executor
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                if RENDER_EXECUTOR == "process":
+                    # resource_tracker запускается до пула, чтобы процессы пула
+                    # учитывали блоки общей памяти в нем, а не каждый в своем
+                    resource_tracker.ensure_running()
+                    _executor = ProcessPoolExecutor(max_workers=RENDER_WORKERS)
+                elif RENDER_EXECUTOR == "thread":
+                    _executor = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix="render")
+                else:
+                    raise ValueError(f"Неизвестный пул отрисовки: {RENDER_EXECUTOR}")
+
+    return _executor
+
+def snapshot(game, encoder=None, profile=None):
+    """Возвращает компактный снимок всего, от чего зависит кадр игры"""
+    moving = None
+    current = getattr(game, "current_pancake", None)
+    if current is not None and not game.game_over:
+        moving = tuple(current[field] for field in PANCAKE_FIELDS)
+
+    return (
+        type(game).__module__, type(game).__name__, game.score, game.game_over,
+        tuple(tuple(pancake[field] for field in PANCAKE_FIELDS) for pancake in game.pancakes),
+        moving, get_encoder(encoder).name, get_profile(profile),
+    )
+
+# Восстановленные игры по башне, свои в каждом потоке: слой башни
+# дорисовывается по блину, как в самой игре, а не заново для каждого кадра
+_local = threading.local()
+
+def restore(state):
+    """Восстанавливает из снимка игру, готовую к отрисовке кадра"""
+    module, class_name, score, game_over, pancakes, moving = state[:6]
+
+    restored = getattr(_local, "games", None)
+    if restored is None:
+        restored = _local.games = OrderedDict()
+
+    # Игру с той же башней без последнего блина можно дорисовать одним блином
+    game = restored.pop((module, class_name, pancakes), None)
+    if game is None and pancakes:
+        game = restored.pop((module, class_name, pancakes[:-1]), None)
+    if game is None:
+        game = getattr(importlib.import_module(module), class_name)()
+
+    for values in pancakes[len(game.pancakes):]:
+        pancake = dict(zip(PANCAKE_FIELDS, values))
+        game.pancakes.append(pancake)
+        game._add_to_tower_layer(pancake)
+
+    restored[(module, class_name, pancakes)] = game
+    while len(restored) > RESTORED_GAMES_CACHE_SIZE:
+        restored.popitem(last=False)
+
+    game.score = score
+    game.game_over = game_over
+    if moving is not None:
+        game.current_pancake.update(zip(PANCAKE_FIELDS, moving))
+
+    return game
+
+def render_snapshot(state):
+    """Отрисовывает и кодирует кадр по снимку состояния, возвращает байты"""
+    encoder, profile = state[6:]
+    return restore(state).encode_frame(encoder, profile)
+
+def _render_to_shared_memory(state):
+    """Отрисовывает кадр в процессе пула и кладет байты в общую память
+
+    Возвращает имя блока общей памяти и размер кадра. Блок освобождает
+    основной процесс, прочитав кадр или отказавшись от него. Процессы пула
+    делят с основным процессом один resource_tracker, поэтому учет блока
+    снимается там же, при unlink.
+    """
+    data = render_snapshot(state)
+    block = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+    block.buf[:len(data)] = data
+    block.close()
+    return block.name, len(data)
+
+def _read_shared_memory(name, size):
+    """Читает кадр из общей памяти и освобождает ее"""
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        return bytes(block.buf[:size])
+    finally:
+        block.close()
+        block.unlink()
+
+def _discard_shared_memory(future):
+    """Освобождает общую память кадра, которого уже никто не ждет
+
+    Вызывается по готовности future, если ожидавшую кадр задачу отменили:
+    отрисовку в процессе отменить нельзя, и без этого блок остался бы навсегда.
+    """
+    if future.cancelled() or future.exception() is not None:
+        return
+
+    block = shared_memory.SharedMemory(name=future.result()[0])
+    block.close()
+    block.unlink()
+
+def _submit(state):
+    """Отправляет снимок в пул и возвращает future с байтами или блоком общей памяти"""
+    if RENDER_EXECUTOR == "process":
+        return get_executor().submit(_render_to_shared_memory, state)
+    return get_executor().submit(render_snapshot, state)
+
+def _result(result):
+    """Возвращает байты кадра из результата пула"""
+    if RENDER_EXECUTOR == "process":
+        return _read_shared_memory(*result)
+    return result
+
+def render_frame(game, encoder=None, profile=None):
+    """Возвращает байты кадра игры: из кэша кадров или отрисованные в пуле
+
+    Для синхронных обработчиков: с пулом процессов поток ждет результата,
+    не удерживая GIL, и кадры разных обработчиков отрисовываются на разных
+    ядрах. С пулом потоков передавать кадр в другой поток незачем - он
+    отрисовывается на месте. Время от запроса до готового кадра
+    учитывается при выборе профиля разрешения.
+    """
+    started = time.perf_counter()
+    encoder = get_encoder(encoder)
+    profile = get_profile(profile)
+    key = game.frame_key(encoder, profile=profile)
+
+    data = frame_cache.get(key)
+    if data is None:
+        if RENDER_EXECUTOR == "process":
+            data = _result(_submit(snapshot(game, encoder, profile)).result())
+        else:
+            data = game.encode_frame(encoder, profile)
+        frame_cache.put(key, data)
+        observe_render(started)
+
+    return data
+
+def render_frames(games, encoder=None, profile=None, now=None):
+    """Отрисовывает кадры сразу нескольких игр на момент now, возвращает байты в порядке игр
+
+    Для шага планировщика анимации: кодировщик и профиль выбираются один
+    раз на всю пачку, одинаковые кадры разных игр кодируются один раз,
+    готовые берутся из кэша кадров, а остальные отрисовываются в пуле
+    параллельно. Время всей пачки учитывается при выборе профиля разрешения.
+    """
+    started = time.perf_counter()
+    encoder = get_encoder(encoder)
+    profile = get_profile(profile)
+    now = time.time() if now is None else now
+
+    keys = []
+    frames = {}
+    missing = {}
+    for game in games:
+        game.update_moving_pancake(now)
+        key = game.frame_key(encoder, profile=profile)
+        keys.append(key)
+
+        if key in frames or key in missing:
+            continue
+
+        data = frame_cache.get(key)
+        if data is None:
+            missing[key] = game
+        else:
+            frames[key] = data
+
+    if missing:
+        if RENDER_EXECUTOR == "process":
+            futures = {key: _submit(snapshot(game, encoder, profile)) for key, game in missing.items()}
+            rendered = {key: _result(future.result()) for key, future in futures.items()}
+        else:
+            # Каждая игра кодируется на своем прошлом кадре
+            futures = {key: get_executor().submit(game.encode_frame, encoder, profile) for key, game in missing.items()}
+            rendered = {key: future.result() for key, future in futures.items()}
+
+        for key, data in rendered.items():
+            frame_cache.put(key, data)
+            frames[key] = data
+        observe_render(started)
+
+    return [frames[key] for key in keys]
+
+async def render_frame_async(game, encoder=None, profile=None):
+    """Возвращает байты кадра игры, не блокируя цикл событий
+
+    Время от запроса до готового кадра, включая ожидание в очереди пула,
+    учитывается при выборе профиля разрешения.
+    """
+    started = time.perf_counter()
+    encoder = get_encoder(encoder)
+    profile = get_profile(profile)
+    key = game.frame_key(encoder, profile=profile)
+
+    data = frame_cache.get(key)
+    if data is None:
+        # Снимок снимается сразу, поэтому изменения игры во время
+        # ожидания не попадут в этот кадр
+        future = _submit(snapshot(game, encoder, profile))
+        try:
+            result = await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # Анимацию остановили во время отрисовки: кадр из процесса выбросим
+            if RENDER_EXECUTOR == "process":
+                future.add_done_callback(_discard_shared_memory)
+            raise
+
+        data = _result(result)
+        frame_cache.put(key, data)
+        observe_render(started)
+
+    return data
+
+async def generate_game_image_async(game, encoder=None, profile=None):
+    """Асинхронный аналог game.generate_game_image(): BytesIO с кадром"""
+    encoder = get_encoder(encoder)
+    data = await render_frame_async(game, encoder, profile)
+    return frame_stream(data, name=f"game.{encoder.extension}")
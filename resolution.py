@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Профили разрешения кадров "Блинной башни"
+
+Игра хранит координаты в полном разрешении 600x800, а кадр уменьшается
+в целое число раз уже после отрисовки, поэтому вся геометрия масштабируется
+одинаково. Основное время уходит на сжатие, а оно пропорционально числу
+пикселей. В режиме auto профиль выбирается по задержке очереди отрисовки:
+под нагрузкой кадры становятся меньше, но не отстают от игры.
+"""
+
+import os
+import threading
+import time
+
+# Профили разрешения: во сколько раз уменьшается каждая сторона кадра
+PROFILES = {
+    "full": 1,
+    "half": 2,
+    "thumbnail": 4,
+}
+
+# Профиль по умолчанию: имя из PROFILES или auto
+DEFAULT_PROFILE = os.getenv("FRAME_PROFILE", "full")
+
+# Пороги задержки отрисовки кадра (мс): выше верхнего профиль понижается,
+# ниже нижнего - повышается. Между сменами профиля проходит не меньше
+# RESOLUTION_COOLDOWN секунд, чтобы очередь успела отреагировать
+RENDER_LATENCY_HIGH_MS = float(os.getenv("RENDER_LATENCY_HIGH_MS", "250"))
+RENDER_LATENCY_LOW_MS = float(os.getenv("RENDER_LATENCY_LOW_MS", "50"))
+RESOLUTION_COOLDOWN = float(os.getenv("RESOLUTION_COOLDOWN", "2.0"))
+
+class ResolutionPolicy:
+    """Понижает профиль, когда кадры отрисовываются слишком долго, и повышает обратно"""
+
+    def __init__(self, profiles=tuple(PROFILES), high_ms=RENDER_LATENCY_HIGH_MS,
+                 low_ms=RENDER_LATENCY_LOW_MS, cooldown=RESOLUTION_COOLDOWN, smoothing=0.2):
+        """Создает политику с профилями от самого дорогого к самому дешевому"""
+        self.profiles = profiles
+        self.high_ms = high_ms
+        self.low_ms = low_ms
+        self.cooldown = cooldown
+        self.smoothing = smoothing
+        self.level = 0
+        self.latency_ms = None
+        self.downgrades = 0
+        self.upgrades = 0
+        self._changed_at = 0.0
+        self._lock = threading.Lock()
+
+    def profile(self):
+        """Возвращает текущий профиль"""
+        return self.profiles[self.level]
+
+    def observe(self, latency_ms, now=None):
+        """Учитывает задержку очередного кадра и при необходимости меняет профиль"""
+        now = time.monotonic() if now is None else now
+
+        with self._lock:
+            # Сглаженная задержка не дает менять профиль из-за одного медленного кадра
+            if self.latency_ms is None:
+                self.latency_ms = latency_ms
+            else:
+                self.latency_ms += self.smoothing * (latency_ms - self.latency_ms)
+
+            if now - self._changed_at < self.cooldown:
+                return
+
+            if self.latency_ms > self.high_ms and self.level < len(self.profiles) - 1:
+                self.level += 1
+                self.downgrades += 1
+                self._changed_at = now
+            elif self.latency_ms < self.low_ms and self.level > 0:
+                self.level -= 1
+                self.upgrades += 1
+                self._changed_at = now
+
+    def stats(self):
+        """Возвращает текущий профиль, сглаженную задержку и число смен профиля"""
+        with self._lock:
+            return {
+                "profile": self.profiles[self.level],
+                "latency_ms": self.latency_ms,
+                "downgrades": self.downgrades,
+                "upgrades": self.upgrades,
+            }
+
+# Политика выбора профиля, общая для всех игр процесса
+resolution_policy = ResolutionPolicy()
+
+def get_profile(profile=None):
+    """Возвращает имя профиля: заданного, по умолчанию или выбранного политикой"""
+    if profile is None:
+        profile = DEFAULT_PROFILE
+
+    if profile == "auto":
+        return resolution_policy.profile()
+
+    if profile not in PROFILES:
+        raise ValueError(f"Неизвестный профиль разрешения: {profile}")
+
+    return profile
+
+def scale_frame(image, profile):
+    """Уменьшает кадр полного разрешения до размера профиля"""
+    factor = PROFILES[profile]
+    if factor == 1:
+        return image
+
+    # Усреднение блоков factor x factor: быстро и без сдвига геометрии
+    return image.reduce(factor)
+
+def observe_render(started):
+    """Сообщает политике задержку кадра, запрошенного в момент started (time.perf_counter)"""
+    if DEFAULT_PROFILE == "auto":
+        resolution_policy.observe((time.perf_counter() - started) * 1000)
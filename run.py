@@ -30,15 +30,6 @@ def check_requirements():
         logger.error('Токен бота не найден в файле .env! Добавьте BOT_TOKEN=ваш_токен в файл .env')
         return False
     
-    # Проверка наличия директории для временных файлов
-    if not os.path.exists('temp'):
-        try:
-            os.makedirs('temp')
-            logger.info('Создана директория для временных файлов: temp/')
-        except Exception as e:
-            logger.error(f'Не удалось создать директорию для временных файлов: {e}')
-            return False
-    
     return True
 
 def main():
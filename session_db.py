@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Сохранение игровых сессий "Блинной башни" в SQLite
+
+Игры живут в памяти, а в базу попадают их двоичные снимки: изменения
+копятся и записываются пачкой в одной транзакции раз в
+SESSION_FLUSH_INTERVAL секунд фоновым потоком. База в режиме WAL
+с synchronous=NORMAL, поэтому нажатие кнопки не ждет записи на диск.
+После перезапуска игра пользователя загружается из базы при его первом
+обращении. Сохранение включается переменной окружения SESSION_DB.
+
+Тот же поток раз в SESSION_SWEEP_INTERVAL секунд удаляет игры, которых нет
+в памяти процесса (вытесненные при переполнении или оставшиеся с прошлого
+запуска) и которые не менялись SESSION_TTL секунд. Игры в памяти хранилище
+удаляет само, поэтому их строки не трогаются, сколько бы их ни
+перезаписывали.
+"""
+
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from game_snapshot import dump_game, load_game
+from session_store import SESSION_SWEEP_INTERVAL, SESSION_TTL
+
+# Путь к базе сессий; пустой - игры хранятся только в памяти
+SESSION_DB = os.getenv("SESSION_DB", "")
+
+# Как часто (в секундах) накопленные изменения записываются в базу
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", "1.0"))
+
+logger = logging.getLogger(__name__)
+
+class SessionDatabase:
+    """Снимки игр в SQLite с отложенной пакетной записью"""
+
+    def __init__(self, path, flush_interval=SESSION_FLUSH_INTERVAL, ttl=SESSION_TTL,
+                 expire_interval=SESSION_SWEEP_INTERVAL):
+        """Открывает базу и запускает поток записи"""
+        self.path = path
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self.expire_interval = expire_interval
+        self.writes = 0
+        self.flushes = 0
+        self.loads = 0
+        self.expired = 0
+
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "user_id INTEGER PRIMARY KEY, state BLOB NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+        # Несохраненные изменения: снимок игры или None для удаления.
+        # Пачка, которая сейчас записывается, видна для чтения до конца записи
+        self._pending = {}
+        self._writing = {}
+
+        # Игры, которые сейчас в памяти хранилища: их строки не истекают
+        self._resident = set()
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._closed = threading.Event()
+
+        self._writer = threading.Thread(target=self._write_behind, name="session-db", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def save(self, key, game):
+        """Запоминает состояние игры; в базу оно попадет со следующей пачкой"""
+        state = dump_game(game)
+        with self._lock:
+            self._pending[key] = state
+
+    def delete(self, key):
+        """Удаляет игру из базы со следующей пачкой"""
+        with self._lock:
+            self._pending[key] = None
+            self._resident.discard(key)
+
+    def mark_resident(self, key, resident=True):
+        """Отмечает, что игра загружена в память хранилища (resident=False - вытеснена)"""
+        with self._lock:
+            if resident:
+                self._resident.add(key)
+            else:
+                self._resident.discard(key)
+
+    def load(self, key):
+        """Возвращает игру из базы или None"""
+        with self._lock:
+            for changes in (self._pending, self._writing):
+                if key in changes:
+                    state = changes[key]
+                    return None if state is None else load_game(state)
+
+        with self._db_lock:
+            row = self._connection.execute(
+                "SELECT state FROM sessions WHERE user_id = ?", (key,)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        self.loads += 1
+        try:
+            return load_game(row[0])
+        except (ValueError, TypeError) as e:
+            logger.error(f"Не удалось загрузить игру {key} из базы: {e}")
+            return None
+
+    def flush(self):
+        """Записывает накопленные изменения одной транзакцией"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._writing = pending
+
+        if not pending:
+            return
+
+        now = time.time()
+        saved = [(key, state, now) for key, state in pending.items() if state is not None]
+        deleted = [(key,) for key, state in pending.items() if state is None]
+
+        with self._db_lock:
+            try:
+                self._connection.execute("BEGIN")
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO sessions (user_id, state, updated_at) VALUES (?, ?, ?)", saved
+                )
+                self._connection.executemany("DELETE FROM sessions WHERE user_id = ?", deleted)
+                self._connection.execute("COMMIT")
+            except sqlite3.Error as e:
+                self._connection.execute("ROLLBACK")
+                logger.error(f"Ошибка при записи сессий в базу: {e}")
+
+                # Изменения, сделанные после этой пачки, новее - их не затираем
+                with self._lock:
+                    for key, state in pending.items():
+                        self._pending.setdefault(key, state)
+                    self._writing = {}
+                return
+
+        with self._lock:
+            self._writing = {}
+
+        self.writes += len(pending)
+        self.flushes += 1
+
+    def expire(self, now=None):
+        """Удаляет игры, которых нет в памяти и которые не менялись ttl секунд; возвращает их число"""
+        older_than = (time.time() if now is None else now) - self.ttl
+
+        with self._db_lock:
+            keys = [row[0] for row in self._connection.execute(
+                "SELECT user_id FROM sessions WHERE updated_at < ?", (older_than,)
+            )]
+
+        # Изменения, ждущие записи, новее строки в базе
+        with self._lock:
+            keys = [
+                (key,) for key in keys
+                if key not in self._resident and key not in self._pending and key not in self._writing
+            ]
+        if not keys:
+            return 0
+
+        with self._db_lock:
+            try:
+                self._connection.execute("BEGIN")
+                self._connection.executemany(
+                    "DELETE FROM sessions WHERE user_id = ? AND updated_at < ?",
+                    [(key, older_than) for (key,) in keys]
+                )
+                self._connection.execute("COMMIT")
+            except sqlite3.Error as e:
+                self._connection.execute("ROLLBACK")
+                logger.error(f"Ошибка при удалении простаивающих сессий из базы: {e}")
+                return 0
+
+        self.expired += len(keys)
+        return len(keys)
+
+    def _write_behind(self):
+        """Фоновый поток: записывает изменения раз в flush_interval секунд и удаляет простаивающие игры"""
+        expired_at = time.monotonic()
+        while not self._closed.wait(self.flush_interval):
+            self.flush()
+            if time.monotonic() - expired_at >= self.expire_interval:
+                expired_at = time.monotonic()
+                self.expire()
+
+    def close(self):
+        """Записывает оставшиеся изменения и закрывает базу"""
+        if self._closed.is_set():
+            return
+
+        self._closed.set()
+        self._writer.join()
+        self.flush()
+        with self._db_lock:
+            self._connection.close()
+
+    def stats(self):
+        """Возвращает число записанных снимков, пачек, загрузок, удаленных и ждущих записи изменений"""
+        with self._lock:
+            pending = len(self._pending)
+
+        return {
+            "pending": pending,
+            "writes": self.writes,
+            "flushes": self.flushes,
+            "loads": self.loads,
+            "expired": self.expired,
+        }
+
+def open_session_database(path=None):
+    """Открывает базу сессий из SESSION_DB или возвращает None, если сохранение выключено"""
+    path = SESSION_DB if path is None else path
+    if not path:
+        return None
+
+    return SessionDatabase(path)
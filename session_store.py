@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Хранилище игровых сессий ботов "Блинная башня"
+
+У каждого пользователя одна запись: игра, таймер анимации и время
+последнего обновления сообщения. Брошенные игры удаляются по времени
+простоя, оконченные - раньше, а при переполнении - самые давние.
+Таймер удаленной сессии отменяется, а кадры, которые держит игра (слой
+башни, последний кадр), освобождаются - как и при окончании игры.
+Остановка анимации перед броском кадров не трогает: слой башни
+дорисовывается одним новым блином. Для обработчиков хранилище выглядит как словарь игр:
+active_games[user_id], user_id in active_games.
+
+Сессий в памяти не больше MAX_SESSIONS, а их кадры вместе занимают не
+больше MAX_FRAME_MEMORY_MB: простаивающая игра без кадров - около
+килобайта, а отрисованная держит слой башни и последний кадр (мегабайты).
+Предел проверяется при поиске просроченных сессий (раз в
+SESSION_SWEEP_INTERVAL): сверх него освобождаются кадры давно не
+использованных сессий, а сами сессии остаются.
+
+С базой сессий (session_db) игры еще и сохраняются: вытесненная при
+переполнении или потерянная при перезапуске игра загружается из базы
+при следующем обращении пользователя. Брошенные игры, которых нет в
+памяти, удаляет из базы ее фоновый поток.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from frame_pacing import FramePacer
+
+# Через сколько секунд простоя удаляется игра и оконченная игра
+SESSION_TTL = float(os.getenv("SESSION_TTL", "3600"))
+FINISHED_SESSION_TTL = float(os.getenv("FINISHED_SESSION_TTL", "300"))
+
+# Наибольшее число сессий в процессе
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "10000"))
+
+# Сколько мегабайт могут занимать кадры игр процесса
+MAX_FRAME_MEMORY_MB = float(os.getenv("MAX_FRAME_MEMORY_MB", "512"))
+
+# Как часто (в секундах) хранилище ищет просроченные сессии
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", "60"))
+
+logger = logging.getLogger(__name__)
+
+def _is_finished(game):
+    """Проверяет, окончена ли игра: объект с game_over или словарь с таким ключом"""
+    if isinstance(game, dict):
+        return bool(game.get("game_over"))
+    return bool(getattr(game, "game_over", False))
+
+class GameSession:
+    """Сессия пользователя: игра, таймер анимации, время обновления сообщения и интервал кадров"""
+
+    __slots__ = ("game", "timer", "last_update", "last_access", "pacer")
+
+    def __init__(self, game, now):
+        """Создает сессию без таймера"""
+        self.game = game
+        self.timer = None
+        self.last_update = None
+        self.last_access = now
+        self.pacer = None
+
+    def cancel_timer(self):
+        """Отменяет таймер анимации, если он есть"""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    def frame_memory(self):
+        """Возвращает, сколько байт занимают кадры игры (у игр без кадров - 0)"""
+        frame_memory = getattr(self.game, "frame_memory", None)
+        return 0 if frame_memory is None else frame_memory()
+
+    def release_frames(self):
+        """Освобождает кадры, которые держит игра (у игр без кадров ничего не делает)"""
+        release_frames = getattr(self.game, "release_frames", None)
+        if release_frames is not None:
+            release_frames()
+
+    def close(self):
+        """Отменяет таймер и освобождает кадры сессии, которая покидает память"""
+        self.cancel_timer()
+        self.release_frames()
+
+class SessionStore:
+    """Сессии пользователей с удалением по времени простоя и по числу сессий"""
+
+    def __init__(self, ttl=SESSION_TTL, finished_ttl=FINISHED_SESSION_TTL,
+                 max_sessions=MAX_SESSIONS, sweep_interval=SESSION_SWEEP_INTERVAL, database=None,
+                 max_frame_memory=MAX_FRAME_MEMORY_MB * 2 ** 20):
+        """Создает пустое хранилище; database - session_db.SessionDatabase или None"""
+        self.database = database
+        self.ttl = ttl
+        self.finished_ttl = finished_ttl
+        self.max_sessions = max_sessions
+        self.max_frame_memory = max_frame_memory
+        self.sweep_interval = sweep_interval
+        self.expired = 0
+        self.finished = 0
+        self.evicted = 0
+        self.reloaded = 0
+        self.frames_released = 0
+        self._sessions = OrderedDict()
+        self._swept_at = time.monotonic()
+        self._lock = threading.RLock()
+
+    def session(self, key, now=None):
+        """Возвращает сессию пользователя или None и отмечает обращение к ней"""
+        now = time.monotonic() if now is None else now
+
+        with self._lock:
+            self._sweep_if_due(now)
+            session = self._touch(key, now)
+            if session is not None or self.database is None:
+                return session
+
+        # Игры нет в памяти: возможно, она сохранена до перезапуска. База
+        # читается без блокировки, чтобы другие пользователи не ждали диска
+        game = self.database.load(key)
+        if game is None:
+            return None
+
+        with self._lock:
+            # Пока читалась база, игру могли загрузить или создать в другом потоке
+            session = self._touch(key, now)
+            if session is not None:
+                return session
+
+            self.reloaded += 1
+            return self._insert(key, game, now)
+
+    def _touch(self, key, now):
+        """Возвращает сессию из памяти или None и отмечает обращение к ней; вызывается под блокировкой"""
+        session = self._sessions.get(key)
+        if session is not None:
+            session.last_access = now
+            self._sessions.move_to_end(key)
+        return session
+
+    def peek(self, key):
+        """Возвращает игру пользователя или None, не продлевая сессию
+
+        Для таймеров анимации: игру, которую анимируют, но не трогают,
+        все равно нужно удалить по времени простоя.
+        """
+        with self._lock:
+            self._sweep_if_due(time.monotonic())
+            session = self._sessions.get(key)
+            return None if session is None else session.game
+
+    def get(self, key, default=None):
+        """Возвращает игру пользователя или default"""
+        session = self.session(key)
+        return default if session is None else session.game
+
+    def put(self, key, game, now=None):
+        """Сохраняет игру пользователя; таймер и время обновления сессии остаются"""
+        now = time.monotonic() if now is None else now
+
+        with self._lock:
+            self._sweep_if_due(now)
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._insert(key, game, now)
+            else:
+                session.game = game
+                session.last_access = now
+                self._sessions.move_to_end(key)
+
+        if self.database is not None:
+            self.database.save(key, game)
+
+        return session
+
+    def _insert(self, key, game, now):
+        """Создает сессию, вытесняя самые давние при переполнении"""
+        session = self._sessions[key] = GameSession(game, now)
+        if self.database is not None:
+            self.database.mark_resident(key)
+
+        # Переполнение: удаляем сессии, к которым дольше всего не обращались.
+        # В базе они остаются и загрузятся при следующем обращении
+        while len(self._sessions) > self.max_sessions:
+            oldest_key, oldest = self._sessions.popitem(last=False)
+            oldest.close()
+            if self.database is not None:
+                self.database.mark_resident(oldest_key, False)
+            self.evicted += 1
+
+        return session
+
+    def _trim_frames(self):
+        """Освобождает кадры давно не использованных сессий, пока все кадры не влезут в max_frame_memory"""
+        sizes = [(session, session.frame_memory()) for session in self._sessions.values()]
+        total = sum(size for _, size in sizes)
+
+        # Сессии идут от давно не использованных к недавним
+        for session, size in sizes:
+            if total <= self.max_frame_memory:
+                break
+            if size:
+                session.release_frames()
+                self.frames_released += 1
+                total -= size
+
+    def save(self, key):
+        """Сохраняет в базу изменившуюся игру пользователя (после броска и т.п.)
+
+        Кадры оконченной игры освобождаются: анимации у нее больше не будет.
+        """
+        with self._lock:
+            session = self._sessions.get(key)
+        if session is None:
+            return
+
+        if _is_finished(session.game):
+            session.release_frames()
+        if self.database is not None:
+            self.database.save(key, session.game)
+
+    def remove(self, key):
+        """Удаляет сессию пользователя и отменяет ее таймер"""
+        with self._lock:
+            session = self._sessions.pop(key, None)
+            if session is not None:
+                session.close()
+
+        if self.database is not None:
+            self.database.delete(key)
+
+    def __getitem__(self, key):
+        """Возвращает игру пользователя, как словарь игр"""
+        session = self.session(key)
+        if session is None:
+            raise KeyError(key)
+        return session.game
+
+    def __setitem__(self, key, game):
+        """Сохраняет игру пользователя, как словарь игр"""
+        self.put(key, game)
+
+    def __delitem__(self, key):
+        """Удаляет сессию пользователя"""
+        self.remove(key)
+
+    def __contains__(self, key):
+        """Проверяет, есть ли сессия у пользователя, загружая ее из базы при необходимости"""
+        return self.session(key) is not None
+
+    def __len__(self):
+        """Возвращает число сессий"""
+        return len(self._sessions)
+
+    def set_timer(self, key, timer):
+        """Запоминает таймер анимации сессии, отменяя прежний"""
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                # Сессию уже удалили - анимировать нечего
+                timer.cancel()
+                return
+
+            if session.timer is not None and session.timer is not timer:
+                session.timer.cancel()
+            session.timer = timer
+
+    def cancel_timer(self, key):
+        """Отменяет таймер анимации сессии"""
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None:
+                session.cancel_timer()
+
+    def timer_running(self, key):
+        """Проверяет, запущена ли анимация сессии"""
+        with self._lock:
+            session = self._sessions.get(key)
+            return session is not None and session.timer is not None and session.timer.is_alive()
+
+    def mark_update(self, key, when=None):
+        """Запоминает время последнего обновления сообщения игры (time.time)"""
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None:
+                session.last_update = time.time() if when is None else when
+
+    def last_update(self, key):
+        """Возвращает время последнего обновления сообщения игры или None"""
+        with self._lock:
+            session = self._sessions.get(key)
+            return None if session is None else session.last_update
+
+    def pacer(self, key):
+        """Возвращает подстройщик интервала кадров сессии (frame_pacing) или None без сессии"""
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                return None
+
+            if session.pacer is None:
+                session.pacer = FramePacer()
+            return session.pacer
+
+    def _sweep_if_due(self, now):
+        """Ищет просроченные сессии, если с прошлого поиска прошло sweep_interval"""
+        if now - self._swept_at >= self.sweep_interval:
+            self.sweep(now)
+
+    def sweep(self, now=None):
+        """Удаляет брошенные и давно оконченные игры, отменяя их таймеры"""
+        now = time.monotonic() if now is None else now
+
+        with self._lock:
+            self._swept_at = now
+            removed = 0
+            for key, session in list(self._sessions.items()):
+                idle = now - session.last_access
+                if idle >= self.ttl:
+                    self.expired += 1
+                elif idle >= self.finished_ttl and _is_finished(session.game):
+                    self.finished += 1
+                else:
+                    continue
+
+                del self._sessions[key]
+                session.close()
+                if self.database is not None:
+                    self.database.delete(key)
+                removed += 1
+
+            self._trim_frames()
+
+            if removed:
+                logger.info(f"Удалено простаивающих сессий: {removed}, осталось: {len(self._sessions)}")
+
+            return removed
+
+    def stats(self):
+        """Возвращает число сессий, запущенных анимаций, удаленных сессий и средний интервал кадров"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            intervals = [session.pacer.interval for session in sessions if session.pacer is not None]
+            return {
+                "sessions": len(sessions),
+                "finished_games": sum(1 for session in sessions if _is_finished(session.game)),
+                "timers": sum(1 for session in sessions if session.timer is not None and session.timer.is_alive()),
+                "max_sessions": self.max_sessions,
+                "expired": self.expired,
+                "finished": self.finished,
+                "evicted": self.evicted,
+                "reloaded": self.reloaded,
+                "frames_released": self.frames_released,
+                "frame_memory": sum(session.frame_memory() for session in sessions),
+                "frame_interval": sum(intervals) / len(intervals) if intervals else None,
+                "database": None if self.database is None else self.database.stats(),
+            }
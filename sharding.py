@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Шардированный запуск ботов "Блинная башня" на нескольких процессах
+
+Один процесс получает обновления от Telegram и по user_id раздает их
+BOT_SHARDS процессам-обработчикам. Все обновления одного пользователя
+всегда попадают в один и тот же процесс, поэтому его игра, таймеры
+анимации и кадры живут там же, а процессы не делят ни GIL, ни память.
+Каждый обработчик - обычный диспетчер python-telegram-bot с теми же
+обработчиками команд, что и у бота в одном процессе.
+
+Ограничитель частоты (rate_limit) в каждом обработчике свой, поэтому
+обработчик получает 1/BOT_SHARDS общего бюджета бота и бюджетов групповых
+чатов: в сумме процессы не превышают ограничений Telegram.
+"""
+
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+import zlib
+
+from telegram import Bot, Update
+from telegram.ext import Dispatcher, DispatcherHandlerStop, TypeHandler, Updater
+
+from rate_limit import rate_limiter
+
+# Число процессов-обработчиков: 0 или 1 - бот работает в одном процессе
+BOT_SHARDS = int(os.getenv("BOT_SHARDS", "0"))
+
+# Потоки диспетчера в каждом процессе-обработчике
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "4"))
+
+# Как часто (в секундах) обработчики присылают статистику
+SHARD_STATS_INTERVAL = float(os.getenv("SHARD_STATS_INTERVAL", "60"))
+
+logger = logging.getLogger(__name__)
+
+def shard_for(update, shards):
+    """Возвращает номер процесса для обновления: по пользователю, иначе по чату"""
+    user = update.effective_user
+    chat = update.effective_chat
+    key = user.id if user is not None else chat.id if chat is not None else 0
+
+    # crc32, а не hash(): номер не должен зависеть от процесса и запуска
+    return zlib.crc32(str(key).encode()) % shards
+
+def _shard_main(token, register_handlers, session_stats, shard, shards, inbox, outbox):
+    """Процесс-обработчик: диспетчер с обработчиками бота и его доля пользователей"""
+    # Ctrl+C получает и основной процесс: он сам остановит обработчики по порядку
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # Бюджет отправки в Telegram делится между обработчиками
+    rate_limiter.set_shares(shards)
+
+    bot = Bot(token)
+    dispatcher = Dispatcher(bot, queue.Queue(), workers=SHARD_WORKERS, use_context=True)
+    register_handlers(dispatcher)
+    threading.Thread(target=dispatcher.start, name=f"shard-{shard}", daemon=True).start()
+
+    processed = 0
+    reported_at = time.monotonic()
+    while True:
+        try:
+            data = inbox.get(timeout=SHARD_STATS_INTERVAL)
+        except queue.Empty:
+            data = ""
+
+        if data is None:
+            break
+
+        if data:
+            dispatcher.update_queue.put(Update.de_json(json.loads(data), bot))
+            processed += 1
+
+        now = time.monotonic()
+        if now - reported_at >= SHARD_STATS_INTERVAL:
+            reported_at = now
+            stats = {"processed": processed, "pending": dispatcher.update_queue.qsize()}
+            if session_stats is not None:
+                stats["sessions"] = session_stats()
+            outbox.put((shard, stats))
+
+    dispatcher.stop()
+
+class ShardRouter:
+    """Раздает обновления процессам-обработчикам и собирает их статистику"""
+
+    def __init__(self, token, register_handlers, shards=BOT_SHARDS, session_stats=None):
+        """Запускает процессы-обработчики
+
+        register_handlers(dispatcher) добавляет обработчики бота, session_stats()
+        возвращает статистику сессий процесса. Обе функции должны быть функциями
+        модуля: процессы запускаются заново (spawn), а не копией основного.
+        """
+        self.shards = shards
+        self.routed = [0] * shards
+        self.shard_stats = {}
+
+        context = multiprocessing.get_context("spawn")
+        self._outbox = context.Queue()
+        self._inboxes = []
+        self._processes = []
+        for shard in range(shards):
+            inbox = context.Queue()
+            process = context.Process(
+                target=_shard_main, name=f"bot-shard-{shard}",
+                args=(token, register_handlers, session_stats, shard, shards, inbox, self._outbox),
+            )
+            process.start()
+            self._inboxes.append(inbox)
+            self._processes.append(process)
+
+        self._collector = threading.Thread(target=self._collect_stats, name="shard-stats", daemon=True)
+        self._collector.start()
+
+    def route(self, update, context):
+        """Обработчик основного процесса: передает обновление своему обработчику"""
+        shard = shard_for(update, self.shards)
+        self._inboxes[shard].put(update.to_json())
+        self.routed[shard] += 1
+        raise DispatcherHandlerStop()
+
+    def _collect_stats(self):
+        """Собирает статистику обработчиков и пишет ее в лог"""
+        while True:
+            shard, stats = self._outbox.get()
+            stats["routed"] = self.routed[shard]
+            self.shard_stats[shard] = stats
+            logger.info(f"Шард {shard}: {stats}")
+
+    def stats(self):
+        """Возвращает по обработчикам: сколько обновлений передано, ждет и последнюю статистику"""
+        stats = {}
+        for shard, inbox in enumerate(self._inboxes):
+            stats[shard] = dict(self.shard_stats.get(shard, {}), routed=self.routed[shard])
+            try:
+                stats[shard]["backlog"] = inbox.qsize()
+            except NotImplementedError:
+                pass
+
+        return stats
+
+    def stop(self):
+        """Останавливает обработчики, дав им разобрать уже полученные обновления"""
+        for inbox in self._inboxes:
+            inbox.put(None)
+        for process in self._processes:
+            process.join()
+
+def run_sharded(token, register_handlers, shards=BOT_SHARDS, session_stats=None):
+    """Запускает бота: получение обновлений здесь, обработка - в shards процессах"""
+    router = ShardRouter(token, register_handlers, shards, session_stats)
+
+    updater = Updater(token)
+    updater.dispatcher.add_handler(TypeHandler(Update, router.route), group=-1)
+    updater.start_polling()
+
+    try:
+        updater.idle()
+    finally:
+        router.stop()
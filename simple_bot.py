@@ -11,6 +11,10 @@ from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Updater, CommandHandler, CallbackQueryHandler, CallbackContext
 
+from rate_limit import rate_limiter
+from session_store import SessionStore
+from sharding import BOT_SHARDS, run_sharded
+
 # Настройка логирования
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -18,13 +22,14 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Хранилище активных игр
-active_games = {}
+# Хранилище активных игр (счет по пользователю) с удалением брошенных
+active_games = SessionStore()
 
 def start(update: Update, context: CallbackContext) -> None:
     """Отправляет сообщение при команде /start."""
     user = update.effective_user
-    update.message.reply_text(
+    rate_limiter.call(
+        update.effective_chat.id, update.message.reply_text,
         f"Привет, {user.first_name}! 👋\n\n"
         f"Добро пожаловать в игру 'Блинная башня'!\n\n"
         f"Нажми /play, чтобы начать игру."
@@ -44,7 +49,8 @@ def play_command(update: Update, context: CallbackContext) -> None:
     reply_markup = InlineKeyboardMarkup(keyboard)
     
     # Отправляем начальное состояние игры
-    message = update.message.reply_text(
+    message = rate_limiter.call(
+        update.effective_chat.id, update.message.reply_text,
         f"Счёт: {active_games[user_id]}",
         reply_markup=reply_markup
     )
@@ -85,7 +91,8 @@ def button_callback(update: Update, context: CallbackContext) -> None:
             reply_markup = InlineKeyboardMarkup(keyboard)
             
             # Обновляем сообщение с новым состоянием игры
-            query.edit_message_text(
+            rate_limiter.call(
+                update.effective_chat.id, query.edit_message_text,
                 text=caption,
                 reply_markup=reply_markup
             )
@@ -101,11 +108,22 @@ def button_callback(update: Update, context: CallbackContext) -> None:
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         # Обновляем сообщение с новым состоянием игры
-        query.edit_message_text(
+        rate_limiter.call(
+            update.effective_chat.id, query.edit_message_text,
             text=f"Счёт: {active_games[user_id]}",
             reply_markup=reply_markup
         )
 
+def register_handlers(dispatcher):
+    """Добавляет обработчики команд бота в диспетчер"""
+    dispatcher.add_handler(CommandHandler("start", start))
+    dispatcher.add_handler(CommandHandler("play", play_command))
+    dispatcher.add_handler(CallbackQueryHandler(button_callback))
+
+def session_stats():
+    """Возвращает статистику сессий и ограничителя частоты процесса (для шардированного запуска)"""
+    return dict(active_games.stats(), rate_limit=rate_limiter.stats())
+
 def main():
     """Запускает бота."""
     # Загружаем переменные окружения
@@ -117,23 +135,23 @@ def main():
         logger.error("Токен бота не найден в переменных окружения!")
         exit(1)
     
-    # Создаем Updater и передаем ему токен бота
-    updater = Updater(token)
-    
-    # Получаем диспетчер для регистрации обработчиков
-    dispatcher = updater.dispatcher
-    
-    # Добавляем обработчики команд
-    dispatcher.add_handler(CommandHandler("start", start))
-    dispatcher.add_handler(CommandHandler("play", play_command))
-    dispatcher.add_handler(CallbackQueryHandler(button_callback))
-    
     # Запускаем бота
     print("=" * 50)
     print("Запуск Telegram бота 'Блинная башня' (упрощенная версия)")
     print("=" * 50)
     print("\nБот запущен! Нажмите Ctrl+C для остановки.")
     
+    # С BOT_SHARDS > 1 пользователи распределяются между процессами-обработчиками
+    if BOT_SHARDS > 1:
+        run_sharded(token, register_handlers, BOT_SHARDS, session_stats)
+        return
+    
+    # Создаем Updater и передаем ему токен бота
+    updater = Updater(token)
+    
+    # Добавляем обработчики команд
+    register_handlers(updater.dispatcher)
+    
     # Запускаем бота
     updater.start_polling()
     
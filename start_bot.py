@@ -12,6 +12,11 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMe
 from telegram.ext import Updater, CommandHandler, CallbackQueryHandler, CallbackContext
 
 from game import PancakeGame
+from rate_limit import rate_limiter
+from session_db import open_session_database
+from session_store import SessionStore
+from sharding import BOT_SHARDS, run_sharded
+from telegram_media import photo_for, remember_photo
 
 # Настройка логирования
 logging.basicConfig(
@@ -20,13 +25,15 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Хранилище активных игр
-active_games = {}
+# Хранилище активных игр с удалением брошенных и оконченных.
+# С SESSION_DB игры сохраняются в базу и переживают перезапуск
+active_games = SessionStore(database=open_session_database())
 
 def start(update: Update, context: CallbackContext) -> None:
     """Отправляет сообщение при команде /start."""
     user = update.effective_user
-    update.message.reply_text(
+    rate_limiter.call(
+        update.effective_chat.id, update.message.reply_text,
         f"Привет, {user.first_name}! 👋\n\n"
         f"Добро пожаловать в игру 'Блинная башня'!\n\n"
         f"Нажми /play, чтобы начать игру."
@@ -41,7 +48,8 @@ def play_command(update: Update, context: CallbackContext) -> None:
     game = active_games[user_id]
     
     # Генерируем начальное изображение игры
-    image_path = game.generate_game_image()
+    # (или берем file_id такого же кадра, уже загруженного в Telegram)
+    frame_key, photo = photo_for(game)
     
     # Создаем клавиатуру с кнопкой "Играть"
     keyboard = [
@@ -50,19 +58,18 @@ def play_command(update: Update, context: CallbackContext) -> None:
     reply_markup = InlineKeyboardMarkup(keyboard)
     
     # Отправляем начальное состояние игры
-    with open(image_path, 'rb') as photo:
-        message = update.message.reply_photo(
-            photo=photo,
-            caption=f"Счёт: {game.score}",
-            reply_markup=reply_markup
-        )
+    message = rate_limiter.call(
+        update.effective_chat.id, update.message.reply_photo,
+        photo=photo,
+        caption=f"Счёт: {game.score}",
+        reply_markup=reply_markup
+    )
+    remember_photo(frame_key, message)
     
     # Сохраняем ID сообщения для будущих обновлений
     game.message_id = message.message_id
     game.chat_id = update.effective_chat.id
-    
-    # Удаляем временное изображение
-    os.remove(image_path)
+    active_games.save(user_id)
 
 def button_callback(update: Update, context: CallbackContext) -> None:
     """Обрабатывает нажатия кнопок."""
@@ -75,11 +82,13 @@ def button_callback(update: Update, context: CallbackContext) -> None:
         if user_id in active_games:
             game = active_games[user_id]
             
-            # Добавляем блин
+            # Добавляем блин и сохраняем игру (в базу - со следующей пачкой)
             game_over = game.drop_pancake()
+            active_games.save(user_id)
             
             # Генерируем обновленное изображение игры
-            image_path = game.generate_game_image()
+            # (или берем file_id такого же кадра, уже загруженного в Telegram)
+            frame_key, photo = photo_for(game)
             
             # Обновляем клавиатуру в зависимости от состояния игры
             keyboard = [
@@ -97,19 +106,17 @@ def button_callback(update: Update, context: CallbackContext) -> None:
             reply_markup = InlineKeyboardMarkup(keyboard)
             
             # Обновляем сообщение с новым состоянием игры
-            with open(image_path, 'rb') as photo:
-                context.bot.edit_message_media(
-                    chat_id=game.chat_id,
-                    message_id=game.message_id,
-                    media=InputMediaPhoto(
-                        media=photo,
-                        caption=caption
-                    ),
-                    reply_markup=reply_markup
-                )
-            
-            # Удаляем временное изображение
-            os.remove(image_path)
+            message = rate_limiter.call(
+                game.chat_id, context.bot.edit_message_media,
+                chat_id=game.chat_id,
+                message_id=game.message_id,
+                media=InputMediaPhoto(
+                    media=photo,
+                    caption=caption
+                ),
+                reply_markup=reply_markup
+            )
+            remember_photo(frame_key, message)
     
     elif query.data == "new_game":
         # Начинаем новую игру
@@ -117,7 +124,8 @@ def button_callback(update: Update, context: CallbackContext) -> None:
         game = active_games[user_id]
         
         # Генерируем начальное изображение игры
-        image_path = game.generate_game_image()
+        # (или берем file_id такого же кадра, уже загруженного в Telegram)
+        frame_key, photo = photo_for(game)
         
         # Создаем клавиатуру с кнопкой "Играть"
         keyboard = [
@@ -126,23 +134,32 @@ def button_callback(update: Update, context: CallbackContext) -> None:
         reply_markup = InlineKeyboardMarkup(keyboard)
         
         # Обновляем сообщение с новым состоянием игры
-        with open(image_path, 'rb') as photo:
-            context.bot.edit_message_media(
-                chat_id=update.effective_chat.id,
-                message_id=query.message.message_id,
-                media=InputMediaPhoto(
-                    media=photo,
-                    caption=f"Счёт: {game.score}"
-                ),
-                reply_markup=reply_markup
-            )
+        message = rate_limiter.call(
+            update.effective_chat.id, context.bot.edit_message_media,
+            chat_id=update.effective_chat.id,
+            message_id=query.message.message_id,
+            media=InputMediaPhoto(
+                media=photo,
+                caption=f"Счёт: {game.score}"
+            ),
+            reply_markup=reply_markup
+        )
+        remember_photo(frame_key, message)
         
         # Сохраняем ID сообщения для будущих обновлений
         game.message_id = query.message.message_id
         game.chat_id = update.effective_chat.id
-        
-        # Удаляем временное изображение
-        os.remove(image_path)
+        active_games.save(user_id)
+
+def register_handlers(dispatcher):
+    """Добавляет обработчики команд бота в диспетчер"""
+    dispatcher.add_handler(CommandHandler("start", start))
+    dispatcher.add_handler(CommandHandler("play", play_command))
+    dispatcher.add_handler(CallbackQueryHandler(button_callback))
+
+def session_stats():
+    """Возвращает статистику сессий и ограничителя частоты процесса (для шардированного запуска)"""
+    return dict(active_games.stats(), rate_limit=rate_limiter.stats())
 
 def main():
     """Запускает бота."""
@@ -155,26 +172,23 @@ def main():
         logger.error("Токен бота не найден в переменных окружения!")
         exit(1)
     
-    # Создаем директорию для временных файлов, если её нет
-    os.makedirs("temp", exist_ok=True)
-    
-    # Создаем Updater и передаем ему токен бота
-    updater = Updater(token)
-    
-    # Получаем диспетчер для регистрации обработчиков
-    dispatcher = updater.dispatcher
-    
-    # Добавляем обработчики команд
-    dispatcher.add_handler(CommandHandler("start", start))
-    dispatcher.add_handler(CommandHandler("play", play_command))
-    dispatcher.add_handler(CallbackQueryHandler(button_callback))
-    
     # Запускаем бота
     print("=" * 50)
     print("Запуск Telegram бота 'Блинная башня'")
     print("=" * 50)
     print("\nБот запущен! Нажмите Ctrl+C для остановки.")
     
+    # С BOT_SHARDS > 1 пользователи распределяются между процессами-обработчиками
+    if BOT_SHARDS > 1:
+        run_sharded(token, register_handlers, BOT_SHARDS, session_stats)
+        return
+    
+    # Создаем Updater и передаем ему токен бота
+    updater = Updater(token)
+    
+    # Добавляем обработчики команд
+    register_handlers(updater.dispatcher)
+    
     # Запускаем бота
     updater.start_polling()
     
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Повторное использование загруженных в Telegram кадров "Блинной башни"
+
+Telegram возвращает file_id для каждой загруженной фотографии. Если тот же
+кадр нужно отправить снова, достаточно передать file_id вместо байтов.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+from frame_encoding import frame_stream, get_encoder
+from render_pool import render_frame, render_frame_async
+from resolution import get_profile
+
+# Сколько file_id хранится одновременно
+FILE_ID_CACHE_SIZE = int(os.getenv("TELEGRAM_FILE_ID_CACHE_SIZE", "10000"))
+
+class FileIdCache:
+    """LRU-кэш file_id загруженных кадров по ключу кадра"""
+
+    def __init__(self, max_size=FILE_ID_CACHE_SIZE):
+        """Создает пустой кэш на max_size записей"""
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._file_ids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Возвращает file_id кадра или None"""
+        with self._lock:
+            file_id = self._file_ids.get(key)
+            if file_id is None:
+                self.misses += 1
+                return None
+
+            self._file_ids.move_to_end(key)
+            self.hits += 1
+            return file_id
+
+    def put(self, key, file_id):
+        """Запоминает file_id кадра"""
+        with self._lock:
+            self._file_ids[key] = file_id
+            self._file_ids.move_to_end(key)
+            while len(self._file_ids) > self.max_size:
+                self._file_ids.popitem(last=False)
+
+    def forget(self, key):
+        """Удаляет file_id кадра, например если Telegram его больше не принимает"""
+        with self._lock:
+            self._file_ids.pop(key, None)
+
+    def stats(self):
+        """Возвращает размер кэша и счетчики попаданий и промахов"""
+        with self._lock:
+            return {"size": len(self._file_ids), "hits": self.hits, "misses": self.misses}
+
+# Кэш file_id, общий для всех игр процесса
+file_id_cache = FileIdCache()
+
+def photo_for(game):
+    """Возвращает ключ кадра и фото для отправки: file_id или BytesIO с кадром"""
+    # Профиль выбирается один раз, чтобы ключ и кадр ему соответствовали
+    profile = get_profile()
+    frame_key = game.frame_key(profile=profile)
+
+    file_id = file_id_cache.get(frame_key)
+    if file_id is not None:
+        return frame_key, file_id
+
+    data = render_frame(game, profile=profile)
+    return frame_key, frame_stream(data, name=f"game.{get_encoder().extension}")
+
+async def photo_for_async(game):
+    """Асинхронный photo_for: кадр отрисовывается в пуле, не блокируя цикл событий"""
+    profile = get_profile()
+    frame_key = game.frame_key(profile=profile)
+
+    file_id = file_id_cache.get(frame_key)
+    if file_id is not None:
+        return frame_key, file_id
+
+    data = await render_frame_async(game, profile=profile)
+    return frame_key, frame_stream(data, name=f"game.{get_encoder().extension}")
+
+def remember_photo(frame_key, message):
+    """Запоминает file_id фото из ответа Telegram на отправку кадра"""
+    # Для inline-сообщений edit_message_media возвращает True вместо сообщения
+    photo = getattr(message, "photo", None)
+    if photo:
+        # Последний размер в списке - оригинальное изображение
+        file_id_cache.put(frame_key, photo[-1].file_id)
+
+def animation_for(game):
+    """Возвращает ключ анимации колебаний и то, что отправить: file_id или BytesIO с GIF"""
+    animation_key = game.animation_key()
+
+    file_id = file_id_cache.get(animation_key)
+    if file_id is not None:
+        return animation_key, file_id
+
+    return animation_key, game.generate_game_animation()
+
+def remember_animation(animation_key, message):
+    """Запоминает file_id анимации из ответа Telegram"""
+    animation = getattr(message, "animation", None)
+    if animation:
+        file_id_cache.put(animation_key, animation.file_id)
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Проверка снимков игр в процессах, запущенных через spawn (как шарды бота)
+"""
+
+import multiprocessing
+import os
+import runpy
+import sys
+import types
+import unittest
+
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "emoji_animated_bot.py")
+
+
+def _snapshot_in_spawned_bot(results):
+    """Снимает и восстанавливает игру бота так, как это делает шард под spawn"""
+    # spawn импортирует скрипт родителя как __mp_main__ и подставляет его
+    # вместо __main__ (multiprocessing.spawn._fixup_main_from_path)
+    main_module = types.ModuleType("__mp_main__")
+    main_module.__dict__.update(runpy.run_path(BOT_SCRIPT, run_name="__mp_main__"))
+    sys.modules["__main__"] = sys.modules["__mp_main__"] = main_module
+
+    from game_snapshot import dump_game, load_game
+
+    game = main_module.EmojiPancakeGame()
+    game.chat_id = 42
+    game.score = 3
+    restored = load_game(dump_game(game))
+    results.put((type(restored).__module__, type(restored).__name__,
+                 restored.chat_id, restored.score))
+
+
+class SpawnedSnapshotTest(unittest.TestCase):
+    def test_emoji_game_from_spawned_main(self):
+        context = multiprocessing.get_context("spawn")
+        results = context.Queue()
+        process = context.Process(target=_snapshot_in_spawned_bot, args=(results,))
+        process.start()
+        process.join(60)
+        self.assertEqual(process.exitcode, 0)
+        self.assertEqual(results.get(timeout=5), ("__mp_main__", "EmojiPancakeGame", 42, 3))
+
+
+if __name__ == "__main__":
+    unittest.main()